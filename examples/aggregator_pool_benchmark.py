@@ -0,0 +1,150 @@
+import socket
+import threading
+import time
+
+try:
+    import socketserver
+except ImportError:
+    import SocketServer as socketserver
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from memsql.common.random_aggregator_pool import RandomAggregatorPool
+from memsql.common.topology import Topology, TopologyRefresher
+
+# How long the stand-in server takes to accept a new connection,
+# this simulates the TCP handshake + authentication round trips.
+DIAL_LATENCY = 0.05
+
+# The number of threads checking out connections concurrently
+NUM_WORKERS = 64
+
+# How many checkouts every worker does
+ITERATIONS = 50
+
+# How long a worker holds on to a connection
+WORK_TIME = 0.001
+
+class StandInHandler(socketserver.BaseRequestHandler):
+    """ Accepts a connection, waits DIAL_LATENCY and sends a one byte greeting. """
+
+    def handle(self):
+        time.sleep(DIAL_LATENCY)
+        self.request.sendall(b'+')
+        while self.request.recv(1):
+            pass
+
+class StandInServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 256
+
+class StandInConnection(object):
+    """ Mimics the parts of a pool connection fairy the aggregator pool uses. """
+
+    def __init__(self, pool, key, sock):
+        self._pool = pool
+        self._key = key
+        self._sock = sock
+        self._expired = False
+        # whether connect() handed out an idle connection instead of dialing
+        self.reused = False
+
+    def expire(self):
+        self._expired = True
+
+    def close(self):
+        self._pool.checkin(self)
+
+    def connection_info(self):
+        return self._key
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+class StandInPool(object):
+    """ A tiny connection pool which dials the stand-in server over TCP. """
+
+    def __init__(self):
+        self._idle = {}
+        self.dials = 0
+
+    def connect(self, host, port, user, password, database, options=None):
+        key = (host, port)
+        idle = self._idle.setdefault(key, queue.Queue())
+        try:
+            conn = idle.get_nowait()
+            conn.reused = True
+            return conn
+        except queue.Empty:
+            pass
+
+        self.dials += 1
+        sock = socket.create_connection(key)
+        sock.recv(1)
+        return StandInConnection(self, key, sock)
+
+    def checkin(self, conn):
+        if conn._expired:
+            conn._sock.close()
+        else:
+            self._idle[conn._key].put(conn)
+
+    def close(self):
+        for idle in self._idle.values():
+            while not idle.empty():
+                idle.get_nowait()._sock.close()
+
+class GlobalLockAggregatorPool(RandomAggregatorPool):
+    """ Reproduces the old behaviour of holding one lock for the whole checkout. """
+
+    def _connect(self):
+        with self._global_lock:
+            return super(GlobalLockAggregatorPool, self)._connect()
+
+def build_pool(cls, address):
+    pool = cls(*address)
+    pool._global_lock = threading.RLock()
+    pool._pool = StandInPool()
+    pool._topology = Topology((address,), address, time.time())
+    # the stand-in server can't answer SHOW AGGREGATORS, never refresh
+    pool._refresher = TopologyRefresher(lambda: None)
+    return pool
+
+def run_benchmark(cls, address):
+    pool = build_pool(cls, address)
+
+    def worker():
+        for _ in range(ITERATIONS):
+            with pool.connect():
+                time.sleep(WORK_TIME)
+
+    workers = [ threading.Thread(target=worker) for _ in range(NUM_WORKERS) ]
+
+    start = time.time()
+    [ w.start() for w in workers ]
+    [ w.join() for w in workers ]
+    elapsed = time.time() - start
+
+    checkouts = NUM_WORKERS * ITERATIONS
+    print("%-26s %6.2fs  %8.1f checkouts/s  %4d dials" % (
+        cls.__name__, elapsed, checkouts / elapsed, pool._pool.dials))
+    pool.close()
+
+if __name__ == '__main__':
+    server = StandInServer(('127.0.0.1', 0), StandInHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    try:
+        print('%d workers, %d checkouts each, %dms dial latency' % (
+            NUM_WORKERS, ITERATIONS, DIAL_LATENCY * 1000))
+        run_benchmark(GlobalLockAggregatorPool, server.server_address)
+        run_benchmark(RandomAggregatorPool, server.server_address)
+    finally:
+        server.shutdown()
@@ -0,0 +1,56 @@
+import time
+
+from memsql.common import database, query_builder
+
+# Row counts to benchmark
+ROW_COUNTS = [10000, 100000, 1000000]
+
+# Batch size used with multi_insert, as in multi_threaded_inserts.py
+BATCH_SIZE = 5000
+
+# Statement size budget used with bulk_insert
+MAX_BYTES = 1024 * 1024
+
+def generate_rows(count):
+    for i in range(count):
+        yield {
+            'id': i,
+            'name': 'user-%d' % i,
+            'score': i * 0.5,
+            'email': "o'connor-%d@example.com" % i,
+            'deleted': None,
+        }
+
+def with_multi_insert(rows):
+    """ Build statements the way callers do today: multi_insert + escape_query per batch. """
+    statements, batch = 0, []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == BATCH_SIZE:
+            sql, params = query_builder.multi_insert('tbl', *batch)
+            database.escape_query(sql, params)
+            statements += 1
+            batch = []
+    if batch:
+        sql, params = query_builder.multi_insert('tbl', *batch)
+        database.escape_query(sql, params)
+        statements += 1
+    return statements
+
+def with_bulk_insert(rows):
+    statements = 0
+    for _ in query_builder.bulk_insert('tbl', rows, max_bytes=MAX_BYTES):
+        statements += 1
+    return statements
+
+def run_benchmark(fn, count):
+    start = time.time()
+    statements = fn(generate_rows(count))
+    elapsed = time.time() - start
+    print("%-18s %8d rows  %5d statements  %7.2fs  %10.1f rows/s" % (
+        fn.__name__, count, statements, elapsed, count / elapsed))
+
+if __name__ == '__main__':
+    for count in ROW_COUNTS:
+        run_benchmark(with_multi_insert, count)
+        run_benchmark(with_bulk_insert, count)
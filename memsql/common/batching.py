@@ -0,0 +1,131 @@
+import collections
+import itertools
+import threading
+import time
+
+from memsql.common import database, query_builder
+
+class AdaptiveBatcher(object):
+    """ Picks insert batch sizes by watching how long batches take.
+
+    The batch size is steered towards `target_latency` seconds per batch,
+    TCP style: it doubles while batches are fast (slow start), and once a
+    batch has been too slow it grows by `step` rows per fast batch and is
+    cut by `backoff` on every slow one.  Batches within `tolerance` of the
+    target leave the size alone.  The size always stays between
+    `min_size` and `max_size`.
+
+        batcher = AdaptiveBatcher(target_latency=0.25)
+        with pool.connect(...) as conn:
+            batcher.insert(conn, 'events', rows)
+        batcher.metrics()
+
+    Batchers are thread safe, so one can be shared by several writers to
+    the same table.
+    """
+
+    def __init__(self, target_latency=0.5, initial_size=1000, min_size=10, max_size=100000,
+                 step=None, backoff=0.5, tolerance=0.1, history=100):
+        if not min_size <= initial_size <= max_size:
+            raise ValueError('initial_size must be between min_size and max_size')
+
+        self.target_latency = target_latency
+        self.min_size = min_size
+        self.max_size = max_size
+        self._size = initial_size
+        self._step = step or max(1, initial_size // 10)
+        self._backoff = backoff
+        self._tolerance = tolerance
+        self._slow_start = True
+        self._lock = threading.Lock()
+        self._sizes = collections.deque(maxlen=history)
+        self._metrics = {
+            'batches': 0, 'rows': 0, 'bytes': 0, 'errors': 0,
+            'increases': 0, 'decreases': 0,
+            'last_latency': None, 'avg_latency': None,
+        }
+
+    @property
+    def size(self):
+        """ The number of rows the next batch should have. """
+        return self._size
+
+    def batches(self, rows):
+        """ Cuts `rows` into lists, each as long as the batch size at the
+        time it is cut.
+        """
+        rows = iter(rows)
+        while True:
+            batch = list(itertools.islice(rows, self._size))
+            if not batch:
+                return
+            yield batch
+
+    def record(self, rows, latency, nbytes=0):
+        """ Record that a batch of `rows` rows (and `nbytes` bytes) took
+        `latency` seconds, and adjust the batch size.
+        """
+        with self._lock:
+            m = self._metrics
+            m['batches'] += 1
+            m['rows'] += rows
+            m['bytes'] += nbytes
+            m['last_latency'] = latency
+            m['avg_latency'] = latency if m['avg_latency'] is None else 0.8 * m['avg_latency'] + 0.2 * latency
+
+            # a short final batch says nothing about how a full one would do
+            if rows < self._size and latency <= self.target_latency:
+                return
+
+            if latency > self.target_latency * (1 + self._tolerance):
+                self._slow_start = False
+                self._resize(int(self._size * self._backoff))
+            elif latency < self.target_latency * (1 - self._tolerance):
+                self._resize(self._size * 2 if self._slow_start else self._size + self._step)
+
+    def record_error(self):
+        """ Record a failed batch.  Failures (often timeouts or packets
+        which are too large) shrink the batch size like a slow batch.
+        """
+        with self._lock:
+            self._metrics['errors'] += 1
+            self._slow_start = False
+            self._resize(int(self._size * self._backoff))
+
+    def metrics(self):
+        """ Returns a dict with the current `size`, the `recent_sizes`
+        chosen, and counters for batches, rows, bytes, errors, increases
+        and decreases, plus the last and average (EWMA) batch latency.
+        """
+        with self._lock:
+            metrics = dict(self._metrics)
+            metrics['size'] = self._size
+            metrics['recent_sizes'] = list(self._sizes)
+            return metrics
+
+    def insert(self, conn, table_name, rows, builder=query_builder.multi_insert):
+        """ Inserts `rows` (dicts) into `table_name` on `conn`, one adaptively
+        sized batch at a time.  `builder` is query_builder.multi_insert or
+        query_builder.multi_replace.  Returns the number of rows written.
+        """
+        written = 0
+        for batch in self.batches(rows):
+            statement = database.escape_query(*builder(table_name, *batch))
+            start = time.time()
+            try:
+                conn.execute(statement)
+            except Exception:
+                self.record_error()
+                raise
+            self.record(len(batch), time.time() - start, len(statement))
+            written += len(batch)
+        return written
+
+    def _resize(self, size):
+        size = max(self.min_size, min(self.max_size, size))
+        if size > self._size:
+            self._metrics['increases'] += 1
+        elif size < self._size:
+            self._metrics['decreases'] += 1
+        self._size = size
+        self._sizes.append(size)
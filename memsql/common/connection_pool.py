@@ -2,6 +2,7 @@ from MySQLdb import _mysql
 import errno
 import multiprocessing
 import logging
+import threading
 from memsql.common import database
 
 try:
@@ -29,8 +30,9 @@ class PoolConnectionException(IOError):
     message = property(_get_message)
 
 class ConnectionPool(object):
-    def __init__(self):
+    def __init__(self, result_cache=None):
         self.logger = logging.getLogger('memsql.connection_pool')
+        self.result_cache = result_cache
         self._connections = {}
         self._fairies = {}
         self._current_version = 0
@@ -48,7 +50,9 @@ class ConnectionPool(object):
         key = (host, port, user, password, database, HashableDict(options) if options else None, current_proc.pid)
 
         if key not in self._connections:
-            self._connections[key] = queue.Queue(maxsize=QUEUE_SIZE)
+            # setdefault is atomic, so concurrent first checkouts of a key
+            # always share the same queue
+            self._connections.setdefault(key, queue.Queue(maxsize=QUEUE_SIZE))
 
         fairy = _PoolConnectionFairy(key, self)
         fairy.connect(self._current_version)
@@ -57,7 +61,7 @@ class ConnectionPool(object):
 
     def checkin(self, fairy, key, conn, expire_connection=False):
         if key not in self._connections:
-            self._connections[key] = queue.Queue(maxsize=QUEUE_SIZE)
+            self._connections.setdefault(key, queue.Queue(maxsize=QUEUE_SIZE))
 
         if expire_connection:
             try:
@@ -98,6 +102,8 @@ class _PoolConnectionFairy(object):
         self._pool = pool
         self._expired = False
         self._conn = None
+        # whether connect() took an idle connection rather than dialing
+        self.reused = False
 
     def expire(self):
         self._expired = True
@@ -177,6 +183,7 @@ class _PoolConnectionFairy(object):
         except (queue.Empty, PoolConnectionException):
             pass
 
+        self.reused = self._conn is not None
         if self._conn is None:
             (host, port, user, password, db_name, options, pid) = self._key
             _connect = self.__wrap_errors(database.connect)
@@ -184,6 +191,9 @@ class _PoolConnectionFairy(object):
                 host=host, port=port, user=user, password=password,
                 database=db_name, _version=current_version, options=options)
 
+        # pooled connections share the pool's result cache
+        self._conn.result_cache = self._pool.result_cache
+
     # catchall
     def __getattr__(self, key):
         method = getattr(self._conn, key, None)
@@ -191,3 +201,67 @@ class _PoolConnectionFairy(object):
             raise AttributeError('Attribute `%s` does not exist' % key)
         else:
             return self.__wrap_errors(method)
+
+class RunningQuery(object):
+    """ A query running on a pooled connection which may need to be
+    cancelled with KILL QUERY from another connection.
+
+    The connection goes back to the pool when the query finishes, unless
+    a kill is in flight: then kill() checks it back in once KILL QUERY
+    was sent, so its thread id can't be handed to another query in
+    between.  Connections which were killed are expired rather than
+    reused.
+
+        with RunningQuery(pool.connect(...)) as running:
+            result = running.conn.query(...)
+        # from another thread
+        running.kill(lambda: pool.connect(...))
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+        try:
+            self.thread_id = conn.thread_id()
+        except Exception:
+            conn.close()
+            raise
+        self._lock = threading.Lock()
+        self._finished = False
+        self._killing = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.finish()
+
+    def finish(self):
+        """ Marks the query finished, checking the connection back in
+        unless a kill is in flight.
+        """
+        with self._lock:
+            self._finished = True
+            if self._killing:
+                return
+        self.conn.close()
+
+    def kill(self, connect):
+        """ Sends KILL QUERY through a connection from `connect` if the
+        query is still running.  Returns whether the kill was sent.
+        """
+        with self._lock:
+            if self._finished:
+                return False
+            self._killing = True
+
+        self.conn.expire()
+        try:
+            with connect() as conn:
+                conn.execute('KILL QUERY %d' % self.thread_id)
+            return True
+        finally:
+            with self._lock:
+                self._killing = False
+                finished = self._finished
+            if finished:
+                self.conn.close()
@@ -10,6 +10,8 @@ try:
 except ImportError:
     from thread import get_ident as _get_ident
 
+from memsql.common import routing
+from memsql.common.result_cache import tables_written
 from memsql.common.conversions import CONVERSIONS
 
 MySQLError = _mysql.MySQLError
@@ -34,11 +36,23 @@ class Connection(object):
 
     We explicitly set the timezone to UTC and the character encoding to
     UTF-8 on all connections to avoid time zone and encoding errors.
+
+    If a ResultCache is given as `result_cache`, SELECT results are
+    served from and stored in it, and writes invalidate it.
+
+    If a ResultBudget is given as `result_budget`, query results are
+    streamed and bounded by it instead of being buffered whole.
     """
 
     def __init__(self, host, port=3306, database="information_schema", user=None, password=None,
-                 max_idle_time=7 * 3600, _version=0, options=None):
+                 max_idle_time=7 * 3600, _version=0, options=None, result_cache=None, result_budget=None):
         self.max_idle_time = max_idle_time
+        self.result_cache = result_cache
+        self.result_budget = result_budget
+        self._session_changed = False
+        self._in_transaction = False
+        # tables written by the open transaction, None if unknown
+        self._transaction_writes = set()
 
         args = {
             "db": database,
@@ -103,6 +117,9 @@ class Connection(object):
         if conn is not None:
             self.close()
             self._db = conn
+            self._session_changed = False
+            self._in_transaction = False
+            self._transaction_writes = set()
 
     def select_db(self, database):
         self._db.select_db(database)
@@ -131,6 +148,42 @@ class Connection(object):
         """
         return self._query(query, parameters, kwparameters)
 
+    def cached_query(self, ttl, query, *parameters, **kwparameters):
+        """ Like query(), but results are cached for `ttl` seconds instead
+        of the result cache's default TTL.
+        """
+        if self.result_cache is None:
+            raise ValueError('cached_query needs a connection with a result_cache')
+        return self._query(query, parameters, kwparameters, ttl=ttl)
+
+    def budgeted_query(self, budget, query, *parameters, **kwparameters):
+        """ Like query(), but the result is bounded by `budget` (a
+        ResultBudget), which may spill it to disk.  Oversized results
+        raise ResultTooLarge and close the connection, since the rest of
+        the result can't be skipped.
+        """
+        return self._query(query, parameters, kwparameters, budget=budget)
+
+    def scan_table(self, table_name, key_columns, batch_size=1000, where=None, parameters=None, columns=None,
+                   checkpoint=None, batches=False, prefetch=None):
+        """ Returns a TableScan paging through `table_name` in `key_columns`
+        order with keyset pagination.  See memsql.common.scan.TableScan.
+        """
+        # imported here since scan builds on this module
+        from memsql.common.scan import TableScan
+        return TableScan(self, table_name, key_columns, batch_size=batch_size, where=where, parameters=parameters,
+                         columns=columns, checkpoint=checkpoint, batches=batches, prefetch=prefetch)
+
+    def export_query(self, query, fileobj, format='csv', parameters=None, header=True, compress=False,
+                     compresslevel=6, progress=None, progress_interval=5):
+        """ Streams the result of `query` into the binary file `fileobj` as
+        csv, tsv or jsonl.  See memsql.common.export.export_query.
+        """
+        from memsql.common.export import export_query
+        return export_query(self, query, fileobj, format=format, parameters=parameters, header=header,
+                            compress=compress, compresslevel=compresslevel, progress=progress,
+                            progress_interval=progress_interval)
+
     def get(self, query, *parameters, **kwparameters):
         """Returns the first row returned for the given query."""
         rows = self._query(query, parameters, kwparameters)
@@ -155,22 +208,81 @@ class Connection(object):
         self._result = self._db.store_result()
         return self._db.insert_id()
 
-    def _query(self, query, parameters, kwparameters, debug=False):
+    def _query(self, query, parameters, kwparameters, debug=False, ttl=None, budget=None):
+        cache, key = self.result_cache, None
+        if cache is not None and self._cacheable():
+            query = _escape_parameters(query, parameters, kwparameters)
+            parameters = kwparameters = None
+            key, tables = cache.key(self._cache_key(), query)
+            if key is not None:
+                cached = cache.get(key)
+                if cached is not None:
+                    return SelectResult(*cached)
+                generation = cache.generation(tables)
+
         self._execute(query, parameters, kwparameters, debug)
 
+        budget = budget or self.result_budget
+        if budget is not None:
+            result = self._fetch_budgeted(budget)
+            # spilled results are too big to cache
+            if key is not None and isinstance(result, SelectResult):
+                cache.put(key, tables, generation, result.fieldnames, result.rows, ttl)
+            return result
+
         self._result = self._db.store_result()
         if self._result is None:
             return self._rowcount
 
         fields = [ f[0] for f in self._result.describe() ]
         rows = self._result.fetch_row(0)
+        if key is not None:
+            cache.put(key, tables, generation, fields, rows, ttl)
         return SelectResult(fields, rows)
 
-    def _execute(self, query, parameters, kwparameters, debug=False):
-        if parameters and kwparameters:
-            raise ValueError('database.py querying functions can receive *args or **kwargs, but not both')
+    def _fetch_budgeted(self, budget):
+        self._result = self._db.use_result()
+        if self._result is None:
+            return self._rowcount
+
+        fields = [ f[0] for f in self._result.describe() ]
+        try:
+            return budget.fetch(self._result, fields)
+        except Exception:
+            # unread rows leave the connection unusable, start over
+            self._result = None
+            self.close()
+            raise
+
+    def _stream(self, query, parameters, batch_size=1000):
+        """ Runs `query` and returns its fieldnames and a generator of row
+        batches read from the server as they are consumed.
+        """
+        self._execute(escape_query(query, parameters), None, None)
+        self._result = self._db.use_result()
+        if self._result is None:
+            raise MySQLError("Query is not a select query")
+
+        fields = [ f[0] for f in self._result.describe() ]
+        return fields, self._stream_batches(batch_size)
+
+    def _stream_batches(self, batch_size):
+        done = False
+        try:
+            while True:
+                batch = self._result.fetch_row(batch_size)
+                if not batch:
+                    done = True
+                    return
+                yield batch
+        finally:
+            if not done:
+                # unread rows leave the connection unusable, start over
+                self._result = None
+                self.close()
 
-        query = escape_query(query, parameters or kwparameters)
+    def _execute(self, query, parameters, kwparameters, debug=False):
+        query = _escape_parameters(query, parameters, kwparameters)
         if debug:
             print(query)
 
@@ -178,6 +290,40 @@ class Connection(object):
         self._db.query(query)
         self._rowcount = self._db.affected_rows()
 
+        if self.result_cache is not None:
+            kind = routing.classify_statement(query)
+            if kind == routing.SESSION:
+                self._session_changed = True
+            elif kind == routing.BEGIN:
+                self._in_transaction = True
+            elif kind == routing.WRITE and self._in_transaction and self._transaction_writes is not None:
+                tables = tables_written(query)
+                self._transaction_writes = None if tables is None else self._transaction_writes | tables
+            elif kind == routing.END:
+                # other connections may have cached what the transaction
+                # replaced while it was open
+                if self._transaction_writes is None or self._transaction_writes:
+                    self.result_cache.invalidate(self._transaction_writes)
+                self._in_transaction = False
+                self._transaction_writes = set()
+            self.result_cache.invalidate_statement(query)
+
+    def _cacheable(self):
+        """ Whether this connection's reads can go through the result
+        cache.  After USE, SET and the like the session may not match what
+        the cache key says, so it stays out of the cache until reconnected.
+        Reads inside a transaction (or with autocommit off) may see
+        uncommitted writes, which other connections must not be served.
+        """
+        if self._session_changed or self._in_transaction:
+            return False
+        self._ensure_connected()
+        return bool(self._db.get_autocommit())
+
+    def _cache_key(self):
+        args = self._db_args
+        return (args["host"], args["port"], args.get("user"), args.get("database", args.get("db")))
+
     def _ensure_connected(self):
         # Mysql by default closes client connections that are idle for
         # 8 hours, but the client library does not report this fact until
@@ -299,6 +445,11 @@ class SelectResult(list):
             return SelectResult(self.fieldnames, self.rows[i])
         return list.__getitem__(self, i)
 
+def _escape_parameters(query, parameters, kwparameters):
+    if parameters and kwparameters:
+        raise ValueError('database.py querying functions can receive *args or **kwargs, but not both')
+    return escape_query(query, parameters or kwparameters)
+
 def escape_query(query, parameters):
     if parameters:
         if isinstance(parameters, (list, tuple)):
@@ -0,0 +1,247 @@
+import csv
+import datetime
+import gzip
+import io
+import itertools
+import math
+import threading
+
+from memsql.common import json
+from memsql.common.loader import format_row
+from memsql.common.util import PeriodicTask, ThroughputMeter, format_timedelta
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+CSV = 'csv'
+TSV = 'tsv'
+JSONL = 'jsonl'
+
+WRITE_BUFFER_SIZE = 256 * 1024
+
+def export_query(conn, query, fileobj, format=CSV, parameters=None, header=True, compress=False,
+                 compresslevel=6, progress=None, progress_interval=5):
+    """ Streams the result of `query` on `conn` into `fileobj`, which must
+    be opened in binary mode.
+
+    Rows are read from the server as they arrive rather than buffered
+    whole, and are serialized batch by batch:
+
+    * csv: RFC 4180 CSV with NULL as an empty field,
+    * tsv: LOAD DATA's default format (tab separated, backslash escapes,
+      NULL as \\N), so with header=False the file can be loaded back as is,
+    * jsonl: one JSON object per line; dates and times as ISO strings,
+      TIME values as MySQL writes them.
+
+    `header` adds a row of column names to csv and tsv files.
+
+    With `compress` the output is gzipped on a separate thread.
+    `progress`, if given, is called with a ThroughputMeter (rows and
+    uncompressed bytes) every `progress_interval` seconds.  Returns the
+    ThroughputMeter for the export.
+
+    Stopping part way (e.g. on an exception from `fileobj`) closes the
+    connection, since the rest of the result can't be skipped.
+    """
+    _check_format(format)
+    fieldnames, batches = conn._stream(query, parameters or ())
+    try:
+        return export_result(fieldnames, batches, fileobj, format=format, header=header, compress=compress,
+                             compresslevel=compresslevel, progress=progress, progress_interval=progress_interval)
+    except BaseException:
+        batches.close()
+        conn.close()
+        raise
+
+def export_result(fieldnames, batches, fileobj, format=CSV, header=True, compress=False, compresslevel=6,
+                  progress=None, progress_interval=5):
+    """ Like export_query, for rows already at hand: `batches` is an
+    iterable of lists of row tuples.
+    """
+    _check_format(format)
+    formatter = _FORMATTERS[format](fieldnames)
+    meter = ThroughputMeter()
+    sink = _GzipSink(fileobj, compresslevel) if compress else _Sink(fileobj)
+
+    reporter = None
+    if progress is not None:
+        reporter = PeriodicTask(lambda: progress(meter), interval=progress_interval, jitter=0,
+                                initial_delay=progress_interval, name='memsql-export-progress')
+        reporter.start()
+
+    try:
+        if header:
+            data = formatter.header()
+            if data:
+                sink.write(data)
+                meter.add(0, len(data))
+
+        for batch in batches:
+            data = formatter.rows(batch)
+            sink.write(data)
+            meter.add(len(batch), len(data))
+        sink.close()
+    finally:
+        sink.abort()
+        if reporter is not None:
+            reporter.stop()
+
+    if progress is not None:
+        progress(meter)
+    return meter
+
+class _CsvFormatter(object):
+    def __init__(self, fieldnames):
+        self._fieldnames = fieldnames
+
+    def header(self):
+        return self._format([self._fieldnames])
+
+    def rows(self, batch):
+        if any(type(v) in _CSV_CONVERTED for v in itertools.chain.from_iterable(batch)):
+            batch = [ [ _text(v) for v in row ] for row in batch ]
+        return self._format(batch)
+
+    def _format(self, rows):
+        out = io.StringIO()
+        csv.writer(out, lineterminator='\n').writerows(rows)
+        return out.getvalue().encode('utf-8')
+
+class _TsvFormatter(object):
+    def __init__(self, fieldnames):
+        self._fieldnames = fieldnames
+
+    def header(self):
+        return format_row(self._fieldnames)
+
+    def rows(self, batch):
+        return b''.join([ format_row(row) for row in batch ])
+
+class _JsonLinesFormatter(object):
+    """ Fills a per-row template of the object's keys with the encoded
+    values, so no dict is built per row.
+    """
+
+    def __init__(self, fieldnames):
+        keys = [ json.dumps(name).replace('%', '%%') for name in fieldnames ]
+        self._template = '{' + ','.join([ '%s:%%s' % key for key in keys ]) + '}\n'
+
+    def header(self):
+        return None
+
+    def rows(self, batch):
+        template = self._template
+        encoders = _JSON_ENCODERS
+        lines = [ template % tuple([ encoders.get(type(v), _json_value)(v) for v in row ]) for row in batch ]
+        return ''.join(lines).encode('utf-8')
+
+def _check_format(format):
+    if format not in _FORMATTERS:
+        raise ValueError('format must be one of %s, not %s' % (', '.join(sorted(_FORMATTERS)), format))
+
+def _text(value):
+    if type(value) is bytes:
+        return value.decode('utf-8', 'backslashreplace')
+    elif type(value) is datetime.timedelta:
+        return format_timedelta(value)
+    return value
+
+_CSV_CONVERTED = (bytes, datetime.timedelta)
+
+def _json_float(value):
+    if math.isnan(value) or math.isinf(value):
+        return 'null'
+    return repr(value)
+
+def _json_value(value):
+    if type(value) is bytes:
+        value = _text(value)
+    return json.dumps(value)
+
+_JSON_ENCODERS = {
+    int: str,
+    float: _json_float,
+    bool: lambda v: 'true' if v else 'false',
+    type(None): lambda v: 'null',
+    datetime.timedelta: lambda v: '"%s"' % format_timedelta(v),
+}
+
+_FORMATTERS = { CSV: _CsvFormatter, TSV: _TsvFormatter, JSONL: _JsonLinesFormatter }
+
+class _Sink(object):
+    """ Collects chunks into large writes. """
+
+    def __init__(self, fileobj):
+        self._fileobj = fileobj
+        self._chunks = []
+        self._size = 0
+
+    def write(self, data):
+        self._chunks.append(data)
+        self._size += len(data)
+        if self._size >= WRITE_BUFFER_SIZE:
+            self._flush()
+
+    def close(self):
+        self._flush()
+        self._fileobj.flush()
+
+    def abort(self):
+        self._chunks = []
+
+    def _flush(self):
+        if self._chunks:
+            self._fileobj.write(b''.join(self._chunks))
+            self._chunks, self._size = [], 0
+
+class _GzipSink(_Sink):
+    """ Gzips chunks into `fileobj` on a separate thread (zlib releases
+    the GIL while compressing, so this overlaps with formatting).
+    """
+
+    def __init__(self, fileobj, compresslevel):
+        super(_GzipSink, self).__init__(fileobj)
+        self._queue = queue.Queue(maxsize=8)
+        self._error = None
+        self._thread = threading.Thread(target=self._run, args=(compresslevel,), name='memsql-export-gzip')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def close(self):
+        self._flush()
+        self._finish()
+        if self._error is not None:
+            raise self._error
+        self._fileobj.flush()
+
+    def abort(self):
+        super(_GzipSink, self).abort()
+        self._finish()
+
+    def _flush(self):
+        if self._chunks:
+            if self._error is not None:
+                raise self._error
+            self._queue.put(b''.join(self._chunks))
+            self._chunks, self._size = [], 0
+
+    def _finish(self):
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+
+    def _run(self, compresslevel):
+        try:
+            with gzip.GzipFile(fileobj=self._fileobj, mode='wb', compresslevel=compresslevel) as out:
+                while True:
+                    data = self._queue.get()
+                    if data is None:
+                        return
+                    out.write(data)
+        except Exception as e:
+            self._error = e
+            # keep draining so the producer never blocks on a dead thread
+            while self._queue.get() is not None:
+                pass
@@ -0,0 +1,122 @@
+import collections
+import threading
+import time
+
+from concurrent import futures
+
+from memsql.common.connection_pool import RunningQuery
+from memsql.common.database import SelectResult
+
+NodeResult = collections.namedtuple('NodeResult', ['node', 'result', 'error', 'elapsed'])
+
+class FanOutTimeout(Exception):
+    """ The statement did not finish on a node within the fan out timeout. """
+    pass
+
+class FanOutResult(list):
+    """ A list of NodeResults, one per node, in the order the nodes were given. """
+
+    def results(self):
+        """ Returns { (host, port): result } for the nodes which succeeded. """
+        return dict((r.node, r.result) for r in self if r.error is None)
+
+    def errors(self):
+        """ Returns { (host, port): exception } for the nodes which failed. """
+        return dict((r.node, r.error) for r in self if r.error is not None)
+
+    def ok(self):
+        return all(r.error is None for r in self)
+
+    def merged(self, node_field='Node'):
+        """ Returns the rows of every successful node as one SelectResult,
+        with a `node_field` column holding "host:port" prepended.
+        """
+        fieldnames, rows = None, []
+        for r in self:
+            if r.error is not None or not isinstance(r.result, SelectResult):
+                continue
+            if fieldnames is None:
+                fieldnames = r.result.fieldnames
+            elif r.result.fieldnames != fieldnames:
+                raise ValueError('Cannot merge results with different fields: %s and %s' % (fieldnames, r.result.fieldnames))
+
+            node = '%s:%s' % r.node
+            rows.extend((node,) + tuple(row) for row in r.result.rows)
+
+        return SelectResult((node_field,) + tuple(fieldnames or ()), rows)
+
+def fan_out(connect, query, nodes, parameters=None, timeout=None, max_workers=8):
+    """ Runs `query` concurrently on every node in `nodes`.
+
+    `connect` is called with a (host, port) and must return a pooled
+    connection.  At most `max_workers` nodes are queried at once.  Nodes
+    which fail, or don't answer within `timeout` seconds of their query
+    starting, are reported in the result instead of raising; timed out
+    queries are cancelled with `KILL QUERY` from background threads.
+    """
+    parameters = parameters or ()
+    executor = futures.ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(nodes))))
+    started = {}
+
+    def run(node):
+        start = time.time()
+        # the clock starts before connecting, so a blackholed node times out too
+        started[node] = (start, None)
+        with RunningQuery(connect(node)) as running:
+            started[node] = (start, running)
+            if isinstance(parameters, dict):
+                result = running.conn.query(query, **parameters)
+            else:
+                result = running.conn.query(query, *parameters)
+        return result, time.time() - start
+
+    try:
+        pending = dict((executor.submit(run, node), node) for node in nodes)
+        outcomes = {}
+
+        while pending:
+            wait_for = None
+            if timeout is not None:
+                now = time.time()
+                deadlines = [ started[node][0] + timeout for node in pending.values() if node in started ]
+                # nodes still queued behind max_workers haven't started their clock yet
+                wait_for = max(0, min(deadlines) - now) if deadlines else 0.05
+
+            done, _ = futures.wait(list(pending), timeout=wait_for, return_when=futures.FIRST_COMPLETED)
+            for future in done:
+                node = pending.pop(future)
+                try:
+                    result, elapsed = future.result()
+                    outcomes[node] = NodeResult(node, result, None, elapsed)
+                except Exception as e:
+                    outcomes[node] = NodeResult(node, None, e, None)
+
+            if timeout is not None:
+                now = time.time()
+                for future, node in list(pending.items()):
+                    if node in started and now - started[node][0] >= timeout:
+                        del pending[future]
+                        if started[node][1] is not None:
+                            # connecting to a node which stopped answering can take a while
+                            _spawn(_kill, connect, node, started[node][1])
+                        error = FanOutTimeout('%s:%s did not answer within %ss' % (node + (timeout,)))
+                        outcomes[node] = NodeResult(node, None, error, now - started[node][0])
+
+        return FanOutResult(outcomes[node] for node in nodes)
+    finally:
+        # don't wait for stragglers, their connections are returned to
+        # the pool (or expired, if killed) when their queries finish
+        executor.shutdown(wait=False)
+
+def _spawn(target, *args):
+    thread = threading.Thread(target=target, args=args, name='memsql-fan-out-kill')
+    thread.daemon = True
+    thread.start()
+    return thread
+
+def _kill(connect, node, running):
+    try:
+        # a no-op if the query finished on its own in the meantime
+        running.kill(lambda: connect(node))
+    except Exception:
+        pass
@@ -0,0 +1,196 @@
+import threading
+import time
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+class CircuitBreaker(object):
+    """ Tracks the health of a single aggregator.
+
+    closed:    the aggregator is healthy and may be used.
+    open:      the aggregator was ejected; it is skipped until
+               `reset_timeout` seconds have passed.
+    half_open: the reset timeout passed and a single trial connection
+               (or background probe) is allowed through.  Success closes
+               the breaker, failure opens it again with a doubled timeout
+               (up to `max_reset_timeout`).
+
+    The breaker opens after `failure_threshold` consecutive failures, or
+    when `eject()` is called because the aggregator is a latency outlier.
+    """
+
+    def __init__(self, failure_threshold=3, reset_timeout=5, max_reset_timeout=60, latency_alpha=0.2):
+        self.failure_threshold = failure_threshold
+        self.base_reset_timeout = reset_timeout
+        self.max_reset_timeout = max_reset_timeout
+        self.latency_alpha = latency_alpha
+
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.latency = None
+        self.reset_timeout = reset_timeout
+        self.opened_at = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def available(self, now=None):
+        """ Returns True if a connection may be attempted right now.
+
+        When an open breaker has waited out its reset timeout this moves
+        it to half_open and lets exactly one caller through.
+        """
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN:
+                if (now or time.time()) - self.opened_at < self.reset_timeout:
+                    return False
+                self.state = HALF_OPEN
+                self._trial_in_flight = False
+            if self._trial_in_flight:
+                return False
+            self._trial_in_flight = True
+            return True
+
+    def ready(self, now=None):
+        """ Returns True if available() may let a caller through, without
+        taking the half-open trial.
+        """
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN:
+                return (now or time.time()) - self.opened_at >= self.reset_timeout
+            return not self._trial_in_flight
+
+    def record_success(self, latency=None):
+        with self._lock:
+            if latency is not None:
+                if self.latency is None:
+                    self.latency = latency
+                else:
+                    self.latency += self.latency_alpha * (latency - self.latency)
+            self.consecutive_failures = 0
+            if self.state != CLOSED:
+                self.state = CLOSED
+                self.reset_timeout = self.base_reset_timeout
+                self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.consecutive_failures += 1
+            if self.state != CLOSED:
+                self._open(min(self.reset_timeout * 2, self.max_reset_timeout))
+            elif self.consecutive_failures >= self.failure_threshold:
+                self._open(self.base_reset_timeout)
+
+    def probe_due(self, now=None):
+        """ Returns True if a background probe should check this aggregator. """
+        with self._lock:
+            if self.state == OPEN:
+                return (now or time.time()) - self.opened_at >= self.reset_timeout
+            return self.state == HALF_OPEN
+
+    def eject(self):
+        with self._lock:
+            if self.state == CLOSED:
+                self._open(self.base_reset_timeout)
+
+    def _open(self, reset_timeout):
+        self.state = OPEN
+        self.opened_at = time.time()
+        self.reset_timeout = reset_timeout
+        self._trial_in_flight = False
+        # forget the latency that got us ejected, so a recovered node
+        # gets a fresh start
+        self.latency = None
+
+class HealthTracker(object):
+    """ Per-aggregator circuit breakers plus latency outlier ejection.
+
+    An aggregator is ejected as a latency outlier when the moving average
+    of its connect latency (new connections only, pooled checkouts are
+    not comparable) exceeds `latency_threshold` seconds, or is more
+    than `outlier_factor` times the median of the other healthy
+    aggregators (and slower than `min_outlier_latency`).  At most `max_ejection_ratio` of the aggregators are
+    ejected for latency; consecutive failures always eject.
+    """
+
+    def __init__(self, failure_threshold=3, reset_timeout=5, max_reset_timeout=60,
+                 latency_threshold=None, outlier_factor=5, min_outlier_latency=0.05, max_ejection_ratio=0.5):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.max_reset_timeout = max_reset_timeout
+        self.latency_threshold = latency_threshold
+        self.outlier_factor = outlier_factor
+        self.min_outlier_latency = min_outlier_latency
+        self.max_ejection_ratio = max_ejection_ratio
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    def breaker(self, agg):
+        breaker = self._breakers.get(agg)
+        if breaker is None:
+            with self._lock:
+                breaker = self._breakers.setdefault(agg, CircuitBreaker(
+                    self.failure_threshold, self.reset_timeout, self.max_reset_timeout))
+        return breaker
+
+    def available(self, agg):
+        return self.breaker(agg).available()
+
+    def ready(self, agg):
+        return self.breaker(agg).ready()
+
+    def healthiest_first(self, aggregators):
+        """ Returns `aggregators` with closed breakers first, keeping their order otherwise. """
+        return sorted(aggregators, key=lambda agg: self.breaker(agg).state != CLOSED)
+
+    def ejected(self):
+        """ Returns the aggregators whose breakers are not closed. """
+        return [ agg for agg, breaker in list(self._breakers.items()) if breaker.state != CLOSED ]
+
+    def state(self, agg):
+        return self.breaker(agg).state
+
+    def record_success(self, agg, latency=None):
+        breaker = self.breaker(agg)
+        breaker.record_success(latency)
+        if latency is not None and self._is_outlier(agg, breaker):
+            breaker.eject()
+
+    def record_failure(self, agg):
+        self.breaker(agg).record_failure()
+
+    def forget(self, aggregators):
+        """ Drop state for aggregators which left the cluster. """
+        keep = set(aggregators)
+        with self._lock:
+            for agg in list(self._breakers.keys()):
+                if agg not in keep:
+                    del self._breakers[agg]
+
+    def _is_outlier(self, agg, breaker):
+        latency = breaker.latency
+        if latency is None:
+            return False
+        if self.latency_threshold is not None and latency > self.latency_threshold:
+            return self._can_eject()
+
+        if latency < self.min_outlier_latency:
+            return False
+
+        peers = sorted(
+            b.latency for a, b in list(self._breakers.items())
+            if a != agg and b.state == CLOSED and b.latency is not None)
+        if not peers:
+            return False
+
+        median = peers[len(peers) // 2]
+        return median > 0 and latency > median * self.outlier_factor and self._can_eject()
+
+    def _can_eject(self):
+        breakers = list(self._breakers.values())
+        ejected = sum(1 for b in breakers if b.state != CLOSED)
+        return ejected + 1 <= len(breakers) * self.max_ejection_ratio
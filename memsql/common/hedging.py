@@ -0,0 +1,164 @@
+import collections
+import logging
+import threading
+import time
+
+from concurrent import futures
+
+from memsql.common.connection_pool import PoolConnectionException, RunningQuery
+from memsql.common.database import MySQLError
+
+class HedgedReader(object):
+    """ Runs idempotent reads with a hedge against a slow aggregator.
+
+    The query first runs on a connection from `aggregator_pool` (a
+    RandomAggregatorPool).  If it hasn't answered after `delay` seconds,
+    the same query is issued on a second aggregator and whichever
+    answers first wins.  The losing query is cancelled with
+    `KILL QUERY` in the background, so the winner's result doesn't wait
+    on the aggregator which stalled.
+
+    When `delay` is None the hedge delay is the `percentile` of recently
+    observed latencies (once `min_samples` have been seen; no hedging
+    happens before that).  Hedges are capped at `max_hedge_ratio` of all
+    requests, so a cluster wide slowdown can't double the load.
+
+    Only use this for statements which are safe to run twice.
+    """
+
+    def __init__(self, aggregator_pool, delay=None, percentile=0.95, min_samples=20, window=1000,
+                 max_hedge_ratio=0.05, max_workers=16):
+        self.logger = logging.getLogger('memsql.hedging')
+        self._pool = aggregator_pool
+        self._delay = delay
+        self._percentile = percentile
+        self._min_samples = min_samples
+        self._latencies = collections.deque(maxlen=window)
+        self._measured_delay = None
+        self._max_hedge_ratio = max_hedge_ratio
+        self._hedge_budget = 1.0
+        self._executor = futures.ThreadPoolExecutor(max_workers=max_workers)
+        # kills connect to the slow aggregator, so they get threads of their own
+        self._killer = futures.ThreadPoolExecutor(max_workers=max_workers)
+        self._lock = threading.Lock()
+        self._stats = { 'requests': 0, 'hedges': 0, 'hedge_wins': 0, 'kills': 0 }
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        self._killer.shutdown(wait=True)
+
+    def stats(self):
+        """ Returns a dict of counters: requests, hedges, hedge_wins and kills. """
+        with self._lock:
+            return dict(self._stats)
+
+    def hedge_delay(self):
+        """ Returns the current hedge delay in seconds, or None if hedging is off for now. """
+        if self._delay is not None:
+            return self._delay
+        return self._measured_delay
+
+    def query(self, query, *parameters, **kwparameters):
+        return self._run('query', query, parameters, kwparameters)
+
+    def get(self, query, *parameters, **kwparameters):
+        return self._run('get', query, parameters, kwparameters)
+
+    def _run(self, method, query, parameters, kwparameters):
+        start = time.time()
+        primary = self._submit(self._pool.connect(), method, query, parameters, kwparameters)
+        delay = self.hedge_delay()
+        self._count('requests')
+
+        if delay is not None:
+            futures.wait([primary.future], timeout=delay)
+
+        attempts = [primary]
+        if delay is not None and not primary.future.done() and self._take_hedge():
+            hedge_conn = self._pool.connect_alternate(exclude=[primary.aggregator])
+            if hedge_conn is not None:
+                self._count('hedges')
+                attempts.append(self._submit(hedge_conn, method, query, parameters, kwparameters))
+
+        winner, error = self._first_success(attempts)
+
+        for attempt in attempts:
+            if attempt is not winner:
+                self._cancel(attempt)
+
+        if winner is None:
+            raise error
+        if winner is not primary:
+            self._count('hedge_wins')
+
+        self._record_latency(time.time() - start)
+        return winner.future.result()
+
+    def _submit(self, conn, method, query, parameters, kwparameters):
+        attempt = _Attempt(conn)
+        attempt.future = self._executor.submit(self._call, attempt, method, query, parameters, kwparameters)
+        return attempt
+
+    def _call(self, attempt, method, query, parameters, kwparameters):
+        # the connection goes back to the pool once its query finishes,
+        # unless _cancel is still killing it
+        with attempt.running:
+            return getattr(attempt.conn, method)(query, *parameters, **kwparameters)
+
+    def _first_success(self, attempts):
+        pending = set(a.future for a in attempts)
+        error = None
+        while pending:
+            done, pending = futures.wait(pending, return_when=futures.FIRST_COMPLETED)
+            for attempt in attempts:
+                if attempt.future in done:
+                    if attempt.future.exception() is None:
+                        return attempt, None
+                    error = error or attempt.future.exception()
+        return None, error
+
+    def _cancel(self, attempt):
+        if attempt.future.cancel():
+            # never started, so there is nothing to kill
+            attempt.running.finish()
+        else:
+            self._killer.submit(self._kill, attempt)
+
+    def _kill(self, attempt):
+        try:
+            if attempt.running.kill(lambda: self._pool.connect_to(attempt.aggregator)):
+                self._count('kills')
+        except (PoolConnectionException, MySQLError) as e:
+            # the query may have just finished on its own
+            self.logger.debug('Could not kill hedged query %d on %s:%s: %s' % (
+                (attempt.running.thread_id,) + tuple(attempt.aggregator) + (e,)))
+
+    def _take_hedge(self):
+        with self._lock:
+            if self._hedge_budget >= 1:
+                self._hedge_budget -= 1
+                return True
+            return False
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+            if name == 'requests':
+                # every request earns a fraction of a hedge, capped so
+                # hedges can't be saved up for a burst
+                self._hedge_budget = min(self._hedge_budget + self._max_hedge_ratio, 1 + self._max_hedge_ratio)
+
+    def _record_latency(self, latency):
+        with self._lock:
+            self._latencies.append(latency)
+            count = len(self._latencies)
+            if count >= self._min_samples and (self._measured_delay is None or self._stats['requests'] % 100 == 0):
+                ordered = sorted(self._latencies)
+                self._measured_delay = ordered[min(count - 1, int(count * self._percentile))]
+
+class _Attempt(object):
+    def __init__(self, conn):
+        self.conn = conn
+        self.aggregator = conn.connection_info()
+        self.running = RunningQuery(conn)
+        self.future = None
@@ -0,0 +1,122 @@
+import logging
+import threading
+import time
+
+from memsql.common import json
+from memsql.common.connection_pool import PoolConnectionException
+from memsql.common.database import OperationalError
+from memsql.common.scan import TableScan
+from memsql.common.util import atomic_write
+
+class WatermarkFile(object):
+    """ Persists an IncrementalReader's watermark in a JSON file at `path`.
+
+    Writes go to a temporary file in the same directory which is synced
+    and atomically renamed over `path`, so a crash never leaves a
+    partial watermark behind.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        try:
+            with open(self.path, 'r') as f:
+                return json.loads(f.read())['checkpoint']
+        except (IOError, OSError):
+            return None
+
+    def save(self, checkpoint):
+        data = json.dumps({ 'checkpoint': checkpoint, 'updated': time.time() })
+        with atomic_write(self.path) as f:
+            f.write(data)
+
+class IncrementalReader(object):
+    """ Reads the rows of a table which changed since the last read.
+
+    Rows are read in (`watermark_column`, `key_column`) order, where the
+    watermark is a monotonically increasing column like an AUTO_INCREMENT
+    id or an `updated_at` timestamp, and `key_column` is unique.  The
+    position saved after each page is the last (watermark, key) pair, so
+    rows sharing a watermark value are neither skipped nor read twice
+    when a page ends in the middle of them.  Rows committed later with a
+    watermark below the saved position are not seen, so the watermark
+    should be assigned in commit order.
+
+    The position is saved to `store` (e.g. a WatermarkFile) once the
+    caller asks for the next page, so a page whose processing was
+    interrupted is read again after a restart.
+
+        reader = IncrementalReader(agg_pool.connect, 'orders', 'updated_at', 'id',
+                                   store=WatermarkFile('/var/lib/sync/orders.json'))
+        for page in reader.follow():
+            sync(page)
+    """
+
+    def __init__(self, connect, table_name, watermark_column, key_column, store=None, batch_size=1000,
+                 where=None, parameters=None, columns=None, min_interval=1, max_interval=60):
+        self.logger = logging.getLogger('memsql.incremental')
+        self._connect = connect
+        self._table_name = table_name
+        self._key_columns = [watermark_column, key_column]
+        self._store = store
+        self._batch_size = batch_size
+        self._where = where
+        self._parameters = parameters
+        self._columns = columns
+        self._min_interval = min_interval
+        self._max_interval = max_interval
+        self._checkpoint = store.load() if store is not None else None
+
+    def checkpoint(self):
+        """ Returns the saved position, None before anything was read. """
+        return self._checkpoint
+
+    def poll(self, stopping=None):
+        """ Yields pages (SelectResults) of the rows changed since the last
+        saved position, until there are no more or the `stopping` Event is
+        set.  A page's position is saved once the next one is asked for.
+        """
+        conn = self._connect()
+        try:
+            scan = TableScan(conn, self._table_name, self._key_columns, batch_size=self._batch_size,
+                             where=self._where, parameters=self._parameters, columns=self._columns,
+                             checkpoint=self._checkpoint, batches=True)
+            for page in scan:
+                yield page
+                self._save(scan.checkpoint())
+                # checked after saving, so a stop doesn't read the page again
+                if stopping is not None and stopping.is_set():
+                    return
+        finally:
+            conn.close()
+
+    def follow(self, stopping=None):
+        """ Polls forever (or until the `stopping` Event is set), yielding
+        pages as they show up.
+
+        Polls are `min_interval` seconds apart while there are changes,
+        backing off exponentially up to `max_interval` while the table is
+        idle or unreachable.
+        """
+        stopping = stopping or threading.Event()
+        interval = self._min_interval
+        while not stopping.is_set():
+            found = False
+            try:
+                for page in self.poll(stopping):
+                    found = True
+                    yield page
+            except (PoolConnectionException, OperationalError) as e:
+                self.logger.warning('Polling %s failed, backing off: %s' % (self._table_name, e))
+
+            if found:
+                interval = self._min_interval
+            stopping.wait(interval)
+            if not found:
+                interval = min(self._max_interval, interval * 2)
+
+    def _save(self, checkpoint):
+        if self._store is not None:
+            self._store.save(checkpoint)
+        self._checkpoint = checkpoint
@@ -0,0 +1,388 @@
+""" Stream rows from Python iterables into MemSQL with LOAD DATA LOCAL INFILE.
+
+Rows are formatted in LOAD DATA's default text format (tab separated
+fields, newline terminated lines, backslash escapes) and written into a
+named pipe which the client library reads from, so nothing is staged on
+disk.  The connection must allow LOCAL INFILE, e.g. with
+`options={ "local_infile": 1 }`.
+
+    with database.connect(..., options={ "local_infile": 1 }) as conn:
+        stats = loader.load_data(conn, 'events', rows, columns=['id', 'name'])
+"""
+
+import collections
+import datetime
+import decimal
+import errno
+import itertools
+import logging
+import math
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from memsql.common import database, query_builder
+from memsql.common.connection_pool import PoolConnectionException
+from memsql.common.util import PeriodicTask, ThroughputMeter, format_timedelta
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+NULL = b'\\N'
+RETRYABLE_ERRORS = (PoolConnectionException, database.OperationalError)
+WRITE_BUFFER_SIZE = 256 * 1024
+
+_ESCAPES = [
+    (b'\\', b'\\\\'),
+    (b'\t', b'\\t'),
+    (b'\n', b'\\n'),
+    (b'\r', b'\\r'),
+    (b'\x00', b'\\0'),
+]
+
+def escape_field(value):
+    """ Format a single value as a LOAD DATA field. """
+    if value is None:
+        return NULL
+    elif value is True:
+        return b'1'
+    elif value is False:
+        return b'0'
+    elif isinstance(value, bytes):
+        data = value
+    elif isinstance(value, float):
+        # like query_builder.columnar_insert: NaN is NULL, infinities are errors
+        if math.isnan(value):
+            return NULL
+        if math.isinf(value):
+            raise ValueError('Cannot load %r, SQL has no infinite floats' % value)
+        return repr(value).encode('ascii')
+    elif isinstance(value, (int, decimal.Decimal)):
+        return str(value).encode('ascii')
+    elif isinstance(value, datetime.datetime):
+        return value.isoformat(' ').encode('ascii')
+    elif isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat().encode('ascii')
+    elif isinstance(value, datetime.timedelta):
+        # TIME columns are read back as timedeltas
+        return format_timedelta(value).encode('ascii')
+    else:
+        data = str(value).encode('utf-8')
+
+    for raw, escaped in _ESCAPES:
+        if raw in data:
+            data = data.replace(raw, escaped)
+    return data
+
+def format_row(row):
+    """ Format a sequence of values as one LOAD DATA line. """
+    return b'\t'.join([ escape_field(v) for v in row ]) + b'\n'
+
+class LoadError(Exception):
+    pass
+
+def load_data(conn, table_name, rows, columns=None, replace=False, ignore=False,
+              progress=None, progress_interval=5):
+    """ Load `rows` into `table_name` with LOAD DATA LOCAL INFILE.
+
+    `rows` is any iterable of tuples (in `columns` order) or dicts.  When
+    rows are dicts and `columns` is None, the keys of the first row are
+    used.  `progress`, if given, is called with a ThroughputMeter every
+    `progress_interval` seconds while loading.
+
+    Returns the ThroughputMeter for the load, with `affected_rows` set
+    to what the server reported.
+    """
+    if replace and ignore:
+        raise ValueError('LOAD DATA can either REPLACE or IGNORE duplicates, not both')
+
+    rows = iter(rows)
+    try:
+        first = next(rows)
+    except StopIteration:
+        meter = ThroughputMeter()
+        meter.affected_rows = 0
+        return meter
+
+    if columns is None and isinstance(first, dict):
+        columns = sorted(first.keys())
+
+    tmpdir = tempfile.mkdtemp(prefix='memsql-loader-')
+    try:
+        path = os.path.join(tmpdir, 'rows')
+        os.mkfifo(path)
+
+        writer = _PipeWriter(path, _lines(first, rows, columns), progress, progress_interval)
+        writer.start()
+
+        query = '%s INTO TABLE `%s`' % ('REPLACE' if replace else ('IGNORE' if ignore else ''), table_name)
+        query = 'LOAD DATA LOCAL INFILE %s ' + ' '.join(query.split())
+        if columns is not None:
+            query += ' (%s)' % ', '.join([ '`%s`' % c for c in columns ])
+
+        try:
+            affected_rows = conn.query(query, path)
+        finally:
+            writer.finish()
+
+        if writer.exception is not None:
+            raise writer.exception
+
+        writer.meter.affected_rows = affected_rows
+        return writer.meter
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+def _lines(first, rows, columns):
+    for row in itertools.chain((first,), rows):
+        if isinstance(row, dict):
+            row = [ row[c] for c in columns ]
+        yield format_row(row)
+
+class _PipeWriter(threading.Thread):
+    """ Writes lines into a named pipe until they run out, the reader goes
+    away or `finish()` is called.
+    """
+
+    def __init__(self, path, lines, progress, progress_interval):
+        super(_PipeWriter, self).__init__(name='memsql-loader-writer')
+        self.daemon = True
+        self.meter = ThroughputMeter()
+        self.exception = None
+        self._path = path
+        self._lines = lines
+        self._progress = progress
+        self._progress_interval = progress_interval
+        self._finished = threading.Event()
+
+    def finish(self):
+        """ Called once the LOAD DATA statement returned. """
+        self._finished.set()
+        self.join()
+
+    def run(self):
+        try:
+            fd = self._open()
+            if fd is None:
+                return
+            with os.fdopen(fd, 'wb', WRITE_BUFFER_SIZE) as f:
+                self._write(f)
+        except IOError as e:
+            # on EPIPE the server stopped reading, the LOAD DATA
+            # statement reports why
+            if e.errno != errno.EPIPE:
+                self.exception = e
+        except Exception as e:
+            self.exception = e
+
+    def _open(self):
+        # opening a pipe for writing blocks until someone reads it; poll
+        # instead, so a LOAD DATA which fails before reading can't hang us
+        while not self._finished.is_set():
+            try:
+                fd = os.open(self._path, os.O_WRONLY | os.O_NONBLOCK)
+            except OSError as e:
+                if e.errno != errno.ENXIO:
+                    raise
+                time.sleep(0.005)
+                continue
+            os.set_blocking(fd, True)
+            return fd
+        return None
+
+    def _write(self, f):
+        next_report = time.time() + self._progress_interval
+        for i, line in enumerate(self._lines):
+            f.write(line)
+            self.meter.add(1, len(line))
+
+            if i % 1024 == 0:
+                if self._finished.is_set():
+                    raise LoadError('LOAD DATA finished before all rows were sent')
+                if self._progress is not None and time.time() >= next_report:
+                    self._progress(self.meter)
+                    next_report = time.time() + self._progress_interval
+
+        if self._progress is not None:
+            self._progress(self.meter)
+
+FailedBatch = collections.namedtuple('FailedBatch', ['rows', 'exception'])
+
+class ParallelLoader(object):
+    """ Loads rows into a table over several connections at once.
+
+    Rows are cut into batches of `batch_size` on the calling thread and
+    handed to `workers` worker threads through a bounded queue, so a
+    slow database slows down the producer instead of piling up rows in
+    memory.  Each worker holds its own connection from `connect` (any
+    callable returning a connection, e.g. a bound ConnectionPool.connect
+    or RandomAggregatorPool.connect) and writes batches with multi-row
+    INSERTs (`method='insert'`) or LOAD DATA (`method='load_data'`).
+
+    Batches failing with a connection or operational error are retried
+    up to `max_retries` times on a fresh connection, resuming after the
+    statements which already went through.  The rows of batches which
+    still fail, or fail with any other error, are recorded in `failed`
+    and the worker moves on; one bad batch never stops the load.
+
+    Pass an AdaptiveBatcher as `batcher` to size batches by how long
+    they take to write instead of using a fixed `batch_size`.
+
+        loader = ParallelLoader(agg_pool.connect, 'events', workers=8)
+        meter = loader.load(rows)
+        if loader.failed:
+            ...
+    """
+
+    def __init__(self, connect, table_name, columns=None, workers=4, batch_size=5000, queue_size=None,
+                 method='insert', replace=False, max_retries=3, retry_delay=0.5,
+                 progress=None, progress_interval=5, batcher=None):
+        if method not in ('insert', 'load_data'):
+            raise ValueError('method must be insert or load_data, not %s' % method)
+
+        self.logger = logging.getLogger('memsql.loader')
+        self.meter = ThroughputMeter()
+        self.failed = []
+        self._connect = connect
+        self._table_name = table_name
+        self._columns = columns
+        self._workers = workers
+        self._batch_size = batch_size
+        self._queue = queue.Queue(maxsize=queue_size or workers * 2)
+        self._method = method
+        self._replace = replace
+        self._max_retries = max_retries
+        self._retry_delay = retry_delay
+        self._progress = progress
+        self._progress_interval = progress_interval
+        self._batcher = batcher
+        self._stopping = threading.Event()
+        self._lock = threading.Lock()
+
+    def stop(self):
+        """ Stop reading rows.  Batches already queued are still written,
+        after which load() returns.
+        """
+        self._stopping.set()
+
+    def load(self, rows):
+        """ Loads every row in `rows` (tuples in `columns` order, or dicts)
+        and returns the ThroughputMeter for the load.
+        """
+        rows = iter(rows)
+        workers = [ threading.Thread(target=self._work, name='memsql-loader-%d' % i) for i in range(self._workers) ]
+        for worker in workers:
+            worker.daemon = True
+            worker.start()
+
+        reporter = None
+        if self._progress is not None:
+            reporter = PeriodicTask(lambda: self._progress(self.meter), interval=self._progress_interval,
+                                    jitter=0, initial_delay=self._progress_interval, name='memsql-loader-progress')
+            reporter.start()
+
+        try:
+            for batch in self._batches(rows):
+                self._queue.put(batch)
+        finally:
+            # let the workers drain the queue and exit
+            for _ in workers:
+                self._queue.put(None)
+            for worker in workers:
+                worker.join()
+            if reporter is not None:
+                reporter.stop()
+                self._progress(self.meter)
+
+        return self.meter
+
+    def _batches(self, rows):
+        while not self._stopping.is_set():
+            size = self._batch_size if self._batcher is None else self._batcher.size
+            batch = list(itertools.islice(rows, size))
+            if not batch:
+                return
+            if self._columns is None and isinstance(batch[0], dict):
+                self._columns = sorted(batch[0].keys())
+            yield batch
+
+    def _work(self):
+        conn = None
+        while True:
+            batch = self._queue.get()
+            if batch is None:
+                break
+            conn = self._write_with_retries(conn, batch)
+        if conn is not None:
+            conn.close()
+
+    def _write_with_retries(self, conn, batch):
+        # statements which went through are not sent again on a retry, so
+        # a failure part way through a large batch can't duplicate rows
+        pending, written = None, 0
+        for attempt in range(self._max_retries + 1):
+            try:
+                if pending is None:
+                    pending = self._statements(batch)
+                if conn is None:
+                    conn = self._connect()
+                start, nbytes = time.time(), 0
+                while pending:
+                    statement, count = pending[0]
+                    sent = self._send(conn, statement)
+                    pending.pop(0)
+                    written += count
+                    nbytes += sent
+                    self.meter.add(count, sent)
+                if self._batcher is not None:
+                    self._batcher.record(len(batch), time.time() - start, nbytes)
+                return conn
+            except RETRYABLE_ERRORS as e:
+                if self._batcher is not None:
+                    self._batcher.record_error()
+                # start over on a fresh connection
+                if conn is not None:
+                    _close_quietly(conn)
+                    conn = None
+                if attempt < self._max_retries:
+                    self.logger.warning('Batch of %d rows failed, retrying: %s' % (len(batch) - written, e))
+                    time.sleep(self._retry_delay * 2 ** attempt)
+                    continue
+                self._fail(batch, e, written)
+            except Exception as e:
+                self._fail(batch, e, written)
+            return conn
+
+    def _statements(self, batch):
+        """ Returns the batch as a list of (statement, row count) pairs;
+        LOAD DATA sends the whole batch at once.
+        """
+        if self._method == 'load_data':
+            return [(batch, len(batch))]
+        return list(query_builder._bulk_insert_counted(
+            self._table_name, batch, columns=self._columns, replace=self._replace))
+
+    def _send(self, conn, statement):
+        if self._method == 'load_data':
+            return load_data(conn, self._table_name, statement, columns=self._columns, replace=self._replace).bytes
+        conn.execute(statement)
+        return len(statement)
+
+    def _fail(self, batch, exception, written=0):
+        """ Records the rows of `batch` after the first `written`, which
+        made it, as failed.
+        """
+        rows = batch[written:]
+        self.logger.error('Batch of %d rows failed: %s' % (len(rows), exception))
+        with self._lock:
+            self.failed.append(FailedBatch(rows, exception))
+
+def _close_quietly(conn):
+    try:
+        conn.close()
+    except Exception:
+        pass
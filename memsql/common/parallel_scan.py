@@ -0,0 +1,170 @@
+import heapq
+import threading
+
+from memsql.common import database
+from memsql.common.scan import TableScan
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+RANGE = 'range'
+HASH = 'hash'
+
+class ParallelScan(object):
+    """ Reads a table over several connections at once.
+
+    The table (or the rows matching `where`) is split into `partitions`
+    disjoint parts, each read with a keyset paginated TableScan on its
+    own connection from `connect` (any callable returning a pooled
+    connection, e.g. RandomAggregatorPool.connect).  With
+    `split='range'` the parts are even ranges between the sampled MIN
+    and MAX of the first (integer) key column; with `split='hash'` they
+    are buckets of CRC32(`hash_column`), which spreads skewed keys
+    evenly.
+
+    Iterating yields the rows of every part as they arrive, or in key
+    order with `ordered` set.  At most `buffer_size` pages per part are
+    buffered, so a slow consumer slows the scans down rather than
+    running out of memory.
+
+        scan = ParallelScan(agg_pool.connect, 'events', ['id'], partitions=8)
+        for row in scan:
+            ...
+    """
+
+    def __init__(self, connect, table_name, key_columns, partitions=4, split=RANGE, hash_column=None,
+                 where=None, parameters=None, columns=None, batch_size=1000, buffer_size=2, ordered=False):
+        if split not in (RANGE, HASH):
+            raise ValueError('split must be range or hash, not %s' % split)
+        if isinstance(key_columns, str):
+            key_columns = [key_columns]
+
+        self._connect = connect
+        self._table_name = table_name
+        self._key_columns = list(key_columns)
+        self._partitions = partitions
+        self._split = split
+        self._hash_column = hash_column or self._key_columns[0]
+        self._where = database.escape_query(where, parameters) if where else None
+        self._columns = columns
+        self._batch_size = batch_size
+        self._buffer_size = buffer_size
+        self._ordered = ordered
+
+    def predicates(self):
+        """ Returns the WHERE predicates of the parts the table is split
+        into.  Range splits sample the table to find its key range.
+        """
+        if self._split == HASH:
+            return [ 'CRC32(`%s`) %% %d = %d' % (self._hash_column, self._partitions, i) for i in range(self._partitions) ]
+
+        column = self._key_columns[0]
+        query = 'SELECT MIN(`%s`) AS lo, MAX(`%s`) AS hi FROM `%s`' % (column, column, self._table_name)
+        if self._where:
+            query += ' WHERE %s' % self._where
+
+        conn = self._connect()
+        try:
+            bounds = conn.get(query)
+        finally:
+            conn.close()
+
+        if bounds is None or bounds.lo is None:
+            return []
+        if not all(isinstance(v, int) for v in (bounds.lo, bounds.hi)):
+            raise ValueError("Range splits need an integer key column, use split='hash' for `%s`" % column)
+
+        count = bounds.hi - bounds.lo + 1
+        edges = sorted(set(bounds.lo + count * i // self._partitions for i in range(self._partitions)))
+        edges.append(bounds.hi + 1)
+        return [ '`%s` >= %d AND `%s` < %d' % (column, lo, column, hi) for lo, hi in zip(edges, edges[1:]) ]
+
+    def __iter__(self):
+        predicates = self.predicates()
+        if not predicates:
+            return
+
+        stopping = threading.Event()
+        if self._ordered:
+            queues = [ queue.Queue(maxsize=self._buffer_size) for _ in predicates ]
+        else:
+            queues = [ queue.Queue(maxsize=self._buffer_size * len(predicates)) ] * len(predicates)
+
+        workers = []
+        for i, predicate in enumerate(predicates):
+            worker = threading.Thread(target=self._scan, args=(predicate, queues[i], stopping),
+                                      name='memsql-parallel-scan-%d' % i)
+            worker.daemon = True
+            worker.start()
+            workers.append(worker)
+
+        try:
+            if self._ordered:
+                def key(row):
+                    return tuple(row[c] for c in self._key_columns)
+
+                for row in heapq.merge(*[ _drain(q, 1) for q in queues ], key=key):
+                    yield row
+            else:
+                for row in _drain(queues[0], len(predicates)):
+                    yield row
+        finally:
+            stopping.set()
+            for q in set(queues):
+                _discard(q)
+            for worker in workers:
+                worker.join()
+
+    def _scan(self, predicate, out, stopping):
+        where = predicate if self._where is None else '(%s) AND %s' % (self._where, predicate)
+        try:
+            conn = self._connect()
+            try:
+                scan = TableScan(conn, self._table_name, self._key_columns, batch_size=self._batch_size,
+                                 where=where, columns=self._columns, batches=True)
+                for page in scan:
+                    if not _put(out, page, stopping):
+                        return
+            finally:
+                conn.close()
+        except Exception as e:
+            _put(out, _Failure(e), stopping)
+        else:
+            _put(out, _DONE, stopping)
+
+_DONE = object()
+
+class _Failure(object):
+    def __init__(self, exception):
+        self.exception = exception
+
+def _put(q, item, stopping):
+    """ Puts `item` on `q` unless the scan is stopped first. """
+    while not stopping.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+def _drain(q, producers):
+    """ Yields the rows of the pages on `q` until `producers` finished. """
+    while producers:
+        item = q.get()
+        if item is _DONE:
+            producers -= 1
+        elif isinstance(item, _Failure):
+            raise item.exception
+        else:
+            for row in item:
+                yield row
+
+def _discard(q):
+    while True:
+        try:
+            q.get_nowait()
+        except queue.Empty:
+            return
@@ -1,3 +1,13 @@
+import itertools
+import math
+
+from memsql.common import database
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 def simple_expression(joiner=', ', **fields):
     """ Build a simple expression ready to be added onto another query.
 
@@ -52,7 +62,203 @@ def __multi_insert(table_name, rows, replace=False):
 
     for i, row in enumerate(rows):
         key = '_QB_ROW_%d' % i
-        params[key] = [ v for c, v in sorted(row.items(), key=lambda kv: cols.index(kv[0])) ]
+        params[key] = _row_values(row, cols)
         sql.append('(%%(%s)s)' % key)
 
     return prefix + ', '.join(sql), params
+
+DEFAULT_MAX_BYTES = 1024 * 1024
+
+def bulk_insert(table_name, rows, columns=None, max_bytes=DEFAULT_MAX_BYTES, replace=False):
+    """ Build ready to send multi-row INSERT (or REPLACE) statements.
+        `rows` is any iterable of dicts or tuples; tuples need `columns`.
+        Each value is escaped exactly once and statements are yielded as
+        soon as adding another row would take them past `max_bytes`
+        (a single row larger than that gets a statement of its own).
+
+    >>> list(bulk_insert('foo_table', [{ 'a': 5, 'b': 2 }, { 'a': 5, 'b': 2 }]))
+    ["INSERT INTO `foo_table` (`a`, `b`) VALUES (5,2),(5,2)"]
+    """
+    for statement, _ in _bulk_insert_counted(table_name, rows, columns, max_bytes, replace):
+        yield statement
+
+def _bulk_insert_counted(table_name, rows, columns=None, max_bytes=DEFAULT_MAX_BYTES, replace=False):
+    """ Like bulk_insert, yielding (statement, number of rows) pairs. """
+    rows = iter(rows)
+    try:
+        first = next(rows)
+    except StopIteration:
+        return
+
+    cols = _columns(first, columns)
+    prefix = '%s INTO `%s` (%s) VALUES ' % (
+        'REPLACE' if replace else 'INSERT',
+        table_name,
+        ', '.join(['`%s`' % col for col in cols])
+    )
+    for chunk in _counted_chunks(prefix, '', _escaped_rows(first, rows, cols), max_bytes):
+        yield chunk
+
+def multi_upsert(table_name, rows, update_columns=None, increment_columns=None, columns=None, max_bytes=DEFAULT_MAX_BYTES):
+    """ Build batched INSERT ... ON DUPLICATE KEY UPDATE statements.
+        Rows are handled like bulk_insert.  On a duplicate key, columns
+        in `update_columns` are overwritten with the new value and
+        columns in `increment_columns` have the new value added to them.
+        If neither is given every column is overwritten.
+
+    >>> list(multi_upsert('counters', [{ 'id': 1, 'hits': 2 }], increment_columns=['hits']))
+    ["INSERT INTO `counters` (`hits`, `id`) VALUES (2,1) ON DUPLICATE KEY UPDATE `hits`=`hits`+VALUES(`hits`)"]
+    """
+    rows = iter(rows)
+    try:
+        first = next(rows)
+    except StopIteration:
+        return
+
+    cols = _columns(first, columns)
+    if update_columns is None and increment_columns is None:
+        update_columns = cols
+    update_columns = list(update_columns or [])
+    increment_columns = list(increment_columns or [])
+
+    if not update_columns and not increment_columns:
+        raise ValueError('multi_upsert needs at least one column to update')
+    unknown = [ c for c in update_columns + increment_columns if c not in cols ]
+    if unknown:
+        raise ValueError('Cannot update columns which are not inserted: %s' % ', '.join(unknown))
+    both = [ c for c in update_columns if c in increment_columns ]
+    if both:
+        raise ValueError('Columns cannot be both updated and incremented: %s' % ', '.join(both))
+
+    assignments = [ '`%s`=VALUES(`%s`)' % (col, col) for col in update_columns ]
+    assignments.extend('`%s`=`%s`+VALUES(`%s`)' % (col, col, col) for col in increment_columns)
+    prefix = 'INSERT INTO `%s` (%s) VALUES ' % (table_name, ', '.join(['`%s`' % col for col in cols]))
+    suffix = ' ON DUPLICATE KEY UPDATE ' + ', '.join(assignments)
+
+    for statement in _chunked(prefix, suffix, _escaped_rows(first, rows, cols), max_bytes):
+        yield statement
+
+def columnar_insert(table_name, columns, column_order=None, max_bytes=DEFAULT_MAX_BYTES, replace=False):
+    """ Build multi-row INSERT (or REPLACE) statements from column-major data.
+        `columns` is a dict of { column_name: values } where values is a
+        list, a NumPy array or anything with `to_numpy()` (like a pandas
+        Series); a pandas DataFrame works too.  Each column is escaped in
+        one pass with an escaper picked for its type, so integer arrays
+        are formatted by NumPy without touching Python objects per value.
+        Float NaNs are inserted as NULL and infinities raise ValueError;
+        datetime64 values are inserted as datetimes.  Statements are chunked by
+        `max_bytes` like bulk_insert.
+
+    >>> list(columnar_insert('foo_table', { 'a': [1, 2], 'b': ['x', 'y'] }))
+    ["INSERT INTO `foo_table` (`a`, `b`) VALUES (1,'x'),(2,'y')"]
+    """
+    if column_order is None:
+        column_order = sorted(columns.keys())
+    cols = list(column_order)
+    escaped = [ _escape_column(columns[c]) for c in cols ]
+
+    lengths = set(len(values) for values in escaped)
+    if len(lengths) > 1:
+        raise ValueError('All columns must have the same length, got %s' % sorted(lengths))
+    if not escaped or not escaped[0]:
+        return
+
+    prefix = '%s INTO `%s` (%s) VALUES ' % (
+        'REPLACE' if replace else 'INSERT',
+        table_name,
+        ', '.join(['`%s`' % col for col in cols])
+    )
+    values = ('(%s)' % ','.join(row) for row in zip(*escaped))
+
+    for statement in _chunked(prefix, '', values, max_bytes):
+        yield statement
+
+def _escape_column(values):
+    """ Returns a list with every value in `values` escaped. """
+    if hasattr(values, 'to_numpy'):
+        values = values.to_numpy()
+
+    if numpy is not None and isinstance(values, numpy.ndarray):
+        kind = values.dtype.kind
+        if kind in 'iu':
+            return values.astype(str).tolist()
+        elif kind == 'b':
+            return numpy.where(values, '1', '0').tolist()
+        elif kind == 'f':
+            return [ _escape_float(v) for v in values.tolist() ]
+        elif kind == 'M' and numpy.datetime_data(values.dtype)[0] in ('ns', 'ps', 'fs', 'as'):
+            # finer than microseconds tolist() returns integers, not datetimes
+            values = values.astype('datetime64[us]')
+        values = values.tolist()
+
+    values = list(values)
+    if all(type(v) is int for v in values):
+        return [ str(v) for v in values ]
+    elif all(type(v) is float for v in values):
+        return [ _escape_float(v) for v in values ]
+    escape = database._escape
+    return [ escape(v) for v in values ]
+
+def _escape_float(v):
+    if math.isnan(v):
+        return 'NULL'
+    if math.isinf(v):
+        raise ValueError('Cannot insert %r, SQL has no infinite floats' % v)
+    s = repr(v)
+    return s if 'e' in s else s + 'e0'
+
+def _columns(first, columns):
+    if columns is not None:
+        return list(columns)
+    if isinstance(first, dict):
+        return sorted(first.keys())
+    raise ValueError('columns must be given when rows are not dicts')
+
+def _row_values(row, cols):
+    """ Returns the values of a dict row in `cols` order.  Rows with
+    other keys are rejected rather than silently losing values.
+    """
+    try:
+        if len(row) == len(cols):
+            return [ row[c] for c in cols ]
+    except KeyError:
+        pass
+    raise ValueError('Row columns %s do not match %s' % (sorted(row.keys()), list(cols)))
+
+def _escaped_rows(first, rows, cols):
+    """ Yields every row as an escaped "(v1,v2,...)" string. """
+    escape = database._escape
+    for row in itertools.chain((first,), rows):
+        if isinstance(row, dict):
+            row = _row_values(row, cols)
+        yield '(%s)' % ','.join([ escape(v) for v in row ])
+
+def _chunked(prefix, suffix, values, max_bytes):
+    """ Joins escaped `values` into `prefix` v1,v2,... `suffix`
+        statements of at most `max_bytes` bytes each.
+    """
+    for statement, _ in _counted_chunks(prefix, suffix, values, max_bytes):
+        yield statement
+
+def _counted_chunks(prefix, suffix, values, max_bytes):
+    """ Like _chunked, yielding (statement, number of values) pairs. """
+    fixed = _byte_len(prefix) + _byte_len(suffix)
+    chunk, size = [], fixed
+
+    for value in values:
+        value_size = _byte_len(value) + 1
+        if chunk and size + value_size > max_bytes:
+            yield prefix + ','.join(chunk) + suffix, len(chunk)
+            chunk, size = [], fixed
+        chunk.append(value)
+        size += value_size
+
+    if chunk:
+        yield prefix + ','.join(chunk) + suffix, len(chunk)
+
+if hasattr(str, 'isascii'):
+    def _byte_len(s):
+        return len(s) if s.isascii() else len(s.encode('utf-8'))
+else:
+    def _byte_len(s):
+        return len(s.encode('utf-8'))
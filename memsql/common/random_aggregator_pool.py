@@ -1,10 +1,40 @@
 from memsql.common.connection_pool import ConnectionPool, PoolConnectionException
 from memsql.common import errorcodes
 from memsql.common.database import DatabaseError
-from wraptor.decorators import memoize
+from memsql.common.fan_out import fan_out
+from memsql.common.health import HealthTracker, CLOSED
+from memsql.common.topology import Topology, TopologyCache, TopologyRefresher, AsyncTopologyRefresher, EMPTY_TOPOLOGY
+from memsql.common.util import PeriodicTask, AsyncPeriodicTask
+import functools
 import threading
 import random
 import logging
+import time
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+def _spawn(target, *args):
+    thread = threading.Thread(target=target, args=args)
+    thread.daemon = True
+    thread.start()
+    return thread
+
+def _checkin_losers(results, count):
+    """ Returns the connections of attempts which lost a dial race to the pool. """
+    for _ in range(count):
+        _, conn, _ = results.get()
+        if conn is not None:
+            conn.close()
+
+class _PendingDial(object):
+    """ An in-flight connection attempt other threads can wait on. """
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.exception = None
 
 class RandomAggregatorPool(object):
     """ A automatic fail-over connection pool.
@@ -12,49 +42,202 @@ class RandomAggregatorPool(object):
     One layer above the connection pool. It's purpose is to choose a
     random aggregator and use it while it is available. If not it fails
     over to another aggregator.  The class maintains the list of
-    aggregators by periodically calling `SHOW AGGREGATORS`.
+    aggregators by periodically calling `SHOW AGGREGATORS` on a
+    background refresher, so connect() never waits on discovery.
+
+    Every aggregator has a circuit breaker (see `memsql.common.health`).
+    Aggregators which keep failing, or which are much slower to connect
+    to than their peers, are ejected and skipped until a background
+    probe finds them healthy again.
 
     Note: If you point this class at a MemSQL Singlebox instance, it
     will still work, but all connections will just be made to the
     singlebox node.
     """
 
-    def __init__(self, host, port, user='root', password='', database='information_schema'):
+    def __init__(self, host, port, user='root', password='', database='information_schema',
+                 refresh_interval=30, discovery_timeout=10, health=None, probe_interval=2,
+                 parallel_dial=False, dial_stagger=0.25, dial_fanout=3,
+                 standby_connections=0, standby_aggregators=1, standby_ping_interval=10,
+                 topology_cache=None, result_cache=None):
         """ Initialize the RandomAggregatorPool with connection
         information for an aggregator in a MemSQL Distributed System.
 
         All aggregator connections will share the same user/password/database.
+
+        The aggregator list is refreshed every `refresh_interval` seconds
+        (with jitter).  `discovery_timeout` bounds how long connect_master()
+        waits for the first refresh when the master is not yet known.
+
+        `health` is a HealthTracker to configure ejection thresholds, and
+        ejected aggregators are probed every `probe_interval` seconds.
+
+        With `parallel_dial` set, failover dials up to `dial_fanout`
+        aggregators at once, starting a new attempt every `dial_stagger`
+        seconds, which bounds failover to roughly one connect timeout.
+
+        With `standby_connections` set, the pool keeps that many live
+        connections to each of `standby_aggregators` alternate aggregators,
+        pinging them every `standby_ping_interval` seconds.  When the
+        current aggregator fails, the pool switches to a standby
+        connection instead of dialing a new one.
+
+        `topology_cache` is a TopologyCache (or a path for one).  A fresh
+        cached topology is used straight away, and the first background
+        refresh is deferred, so short lived processes don't all run
+        `SHOW AGGREGATORS` against the primary aggregator on startup.
+
+        `result_cache` is a ResultCache shared by every connection.
         """
         self.logger = logging.getLogger('memsql.random_aggregator_pool')
-        self._pool = ConnectionPool()
-        self._refresh_aggregator_list = memoize(30)(self._update_aggregator_list)
+        self._pool = ConnectionPool(result_cache=result_cache)
         self._lock = threading.RLock()
 
         self._primary_aggregator = (host, port)
         self._user = user
         self._password = password
         self._database = database
-        self._aggregators = []
+        self._refresh_interval = refresh_interval
+        self._discovery_timeout = discovery_timeout
+        self._probe_interval = probe_interval
+        self._health = health or HealthTracker()
+        self._parallel_dial = parallel_dial
+        self._dial_stagger = dial_stagger
+        self._dial_fanout = dial_fanout
+        self._standby_connections = standby_connections
+        self._standby_aggregators = standby_aggregators
+        self._standby_ping_interval = standby_ping_interval
+
+        self._topology = EMPTY_TOPOLOGY
+        self._topology_ready = threading.Event()
+        if topology_cache is not None and not isinstance(topology_cache, TopologyCache):
+            topology_cache = TopologyCache(topology_cache)
+        self._topology_cache = topology_cache
+        self._initial_refresh_delay = 0
+        if topology_cache is not None:
+            cached = topology_cache.load(self._primary_aggregator)
+            if cached is not None:
+                self._topology = cached
+                self._topology_ready.set()
+                self._initial_refresh_delay = max(0, refresh_interval - cached.age())
+        self._refresher = None
+        self._prober = None
+        self._standby_keeper = None
+        self._standby = {}
         self._aggregator = None
-        self._master_aggregator = None
+        self._dialing = {}
+
+    def start_refresher(self, loop=None):
+        """ Start refreshing the aggregator list and probing ejected
+        aggregators in the background.
+
+        connect() starts thread based workers the first time it is
+        called.  Asyncio applications can call this first with their
+        event `loop` to run them as tasks on that loop instead.
+        """
+        with self._lock:
+            if self._refresher is None:
+                if loop is None:
+                    self._refresher = TopologyRefresher(
+                        self._discover, interval=self._refresh_interval, initial_delay=self._initial_refresh_delay)
+                    self._prober = PeriodicTask(self._probe, interval=self._probe_interval, name='memsql-aggregator-prober')
+                else:
+                    self._refresher = AsyncTopologyRefresher(
+                        self._discover, loop=loop, interval=self._refresh_interval, initial_delay=self._initial_refresh_delay)
+                    self._prober = AsyncPeriodicTask(self._probe, loop=loop, interval=self._probe_interval, name='memsql-aggregator-prober')
+                self._refresher.start()
+                self._prober.start()
+
+                if self._standby_connections:
+                    task = PeriodicTask if loop is None else functools.partial(AsyncPeriodicTask, loop=loop)
+                    self._standby_keeper = task(
+                        self._maintain_standby, interval=self._standby_ping_interval, name='memsql-standby-keeper')
+                    self._standby_keeper.start()
+            return self._refresher
+
+    def health(self):
+        """ Returns the HealthTracker for this pool's aggregators. """
+        return self._health
+
+    def topology(self):
+        """ Returns the current Topology snapshot. """
+        return self._topology
 
     def connect(self):
-        """ Returns an aggregator connection, and periodically updates the aggregator list. """
-        conn = self._connect()
-        self._refresh_aggregator_list(conn)
-        return conn
+        """ Returns an aggregator connection. """
+        self.start_refresher()
+        return self._connect()
+
+    def connect_to(self, aggregator):
+        """ Returns a connection to a specific (host, port) aggregator. """
+        return self._checkout(aggregator)
+
+    def connect_alternate(self, exclude):
+        """ Returns a connection to a healthy aggregator other than the
+        (host, port) pairs in `exclude`, or None if there isn't one.
+        """
+        aggregators = [ agg for agg in self._topology.aggregators if agg not in exclude ]
+        random.shuffle(aggregators)
+        for agg in self._health.healthiest_first(aggregators):
+            if not self._health.available(agg):
+                continue
+            try:
+                return self._checkout(agg)
+            except PoolConnectionException:
+                continue
+        return None
+
+    def fan_out(self, query, parameters=None, nodes=None, timeout=None, max_workers=8):
+        """ Runs `query` concurrently on every aggregator (or every
+        (host, port) in `nodes`) and returns a FanOutResult with a
+        NodeResult per node.  See `memsql.common.fan_out`.
+        """
+        if nodes is None:
+            nodes = list(self._topology.aggregators) or [self._primary_aggregator]
+        return fan_out(self._pool_connect, query, nodes,
+                       parameters=parameters, timeout=timeout, max_workers=max_workers)
 
     def connect_master(self):
-        if self._master_aggregator is None:
-            with self._pool_connect(self._primary_aggregator) as conn:
-                self._update_aggregator_list(conn)
-                conn.expire()
+        """ Returns a connection to the master aggregator, or None if it
+        can't be reached.
+
+        Until the master is known this waits up to `discovery_timeout`
+        for the first refresh, except on the event loop running an async
+        refresher, which can't refresh while blocked; there the topology
+        is discovered inline instead.
+        """
+        refresher = self.start_refresher()
+        if self._topology.master is None:
+            if refresher.can_wait():
+                refresher.run_now()
+                self._topology_ready.wait(self._discovery_timeout)
+            else:
+                try:
+                    self._discover()
+                except PoolConnectionException:
+                    return None
+
+        master = self._topology.master
+        if master is None:
+            return None
         try:
-            return self._pool_connect(self._master_aggregator)
+            return self._pool_connect(master)
         except PoolConnectionException:
             return None
 
     def close(self):
+        with self._lock:
+            workers = [self._refresher, self._prober, self._standby_keeper]
+            self._refresher = self._prober = self._standby_keeper = None
+        for worker in workers:
+            if worker is not None:
+                worker.stop()
+
+        with self._lock:
+            standby, self._standby = self._standby, {}
+        for conns in standby.values():
+            for conn in conns:
+                conn.close()
         self._pool.close()
 
     def _pool_connect(self, agg):
@@ -64,39 +247,286 @@ class RandomAggregatorPool(object):
         return self._pool.connect(agg[0], agg[1], self._user, self._password, self._database)
 
     def _connect(self):
-        """ Returns an aggregator connection. """
+        """ Returns an aggregator connection.
+
+        The lock is only held while reading or updating the pool's
+        in-memory state, every network dial happens outside of it.
+        """
+        aggregator = self._aggregator
+        if aggregator and self._health.available(aggregator):
+            try:
+                return self._checkout(aggregator)
+            except PoolConnectionException:
+                with self._lock:
+                    if self._aggregator == aggregator:
+                        self._aggregator = None
+
+        conn = self._take_standby()
+        if conn is not None:
+            return conn
+
+        # until the first refresh finishes, the primary aggregator is
+        # the only one we know about
+        aggregators = list(self._topology.aggregators) or [self._primary_aggregator]
+        random.shuffle(aggregators)
+        aggregators = self._health.healthiest_first(aggregators)
+
+        # only the aggregators actually dialed take their breaker's
+        # half-open trial, see _dial_serial and _dial_parallel
+        candidates = [ agg for agg in aggregators if self._health.ready(agg) ]
+        if candidates:
+            try:
+                if self._parallel_dial:
+                    aggregator, conn = self._dial_parallel(candidates)
+                else:
+                    aggregator, conn = self._dial_serial(candidates)
+            except PoolConnectionException:
+                # bad news bears...  try again later, with a fresh aggregator list
+                with self._lock:
+                    self._aggregator = None
+                    if self._refresher is not None:
+                        self._refresher.run_now()
+                raise
+
+            if conn is not None:
+                # connection successful!
+                with self._lock:
+                    self._aggregator = aggregator
+                return conn
+
+        # every aggregator is ejected, rather than failing outright
+        # give the least recently ejected ones a chance
+        return self._dial_serial(aggregators, check_health=False)[1]
+
+    def _dial_serial(self, aggregators, check_health=True):
+        """ Dials `aggregators` one at a time.  Returns (None, None) if
+        none of them was available to dial.
+        """
+        last_exception = None
+        for aggregator in aggregators:
+            if check_health and not self._health.available(aggregator):
+                continue
+            self.logger.debug('Attempting connection with %s:%s' % (aggregator[0], aggregator[1]))
+            try:
+                return aggregator, self._dial(aggregator)
+            except PoolConnectionException as e:
+                # connection error
+                last_exception = e
+        if last_exception is None:
+            return None, None
+        raise last_exception
+
+    def _dial_parallel(self, aggregators):
+        """ Dials `aggregators` concurrently, happy eyeballs style.
+
+        A new attempt starts every `dial_stagger` seconds, or as soon as
+        an earlier attempt fails, with at most `dial_fanout` attempts in
+        flight.  The first connection to succeed is returned; connections
+        which finish later are checked back into the pool.  Returns
+        (None, None) if none of them was available to dial.
+        """
+        results = queue.Queue()
+
+        def attempt(aggregator):
+            self.logger.debug('Attempting connection with %s:%s' % (aggregator[0], aggregator[1]))
+            try:
+                results.put((aggregator, self._dial(aggregator), None))
+            except Exception as e:
+                # every attempt must report back, or connect() waits forever
+                results.put((aggregator, None, e))
+
+        remaining, in_flight = list(aggregators), 0
+        last_exception = None
+        while remaining or in_flight:
+            timeout = None
+            if remaining and in_flight < self._dial_fanout:
+                aggregator = remaining.pop(0)
+                if not self._health.available(aggregator):
+                    continue
+                _spawn(attempt, aggregator)
+                in_flight += 1
+                if remaining:
+                    timeout = self._dial_stagger
+
+            try:
+                aggregator, conn, exception = results.get(timeout=timeout)
+            except queue.Empty:
+                continue
+
+            in_flight -= 1
+            if conn is not None or not isinstance(exception, PoolConnectionException):
+                if in_flight:
+                    _spawn(_checkin_losers, results, in_flight)
+                if conn is None:
+                    # not a connection error, so failing over won't help
+                    raise exception
+                return aggregator, conn
+            last_exception = exception
+
+        if last_exception is None:
+            return None, None
+        raise last_exception
+
+    def _checkout(self, agg):
+        """ Checks out a connection to `agg`, recording the outcome with
+        the aggregator's circuit breaker.
+        """
+        start = time.time()
+        try:
+            conn = self._pool_connect(agg)
+        except PoolConnectionException:
+            self._health.record_failure(agg)
+            raise
+        # idle pooled connections only cost a ping, so only new dials
+        # are comparable latency samples
+        self._health.record_success(agg, None if conn.reused else time.time() - start)
+        return conn
+
+    def _dial(self, agg):
+        """ Connect to `agg`, coalescing concurrent attempts.
+
+        Only one thread at a time pays for dialing an aggregator that is
+        not known to be up.  Other threads wait for that attempt and
+        either fail fast with the same exception, or check out their own
+        connection once the aggregator has answered.
+        """
+        with self._lock:
+            pending = self._dialing.get(agg)
+            leader = pending is None
+            if leader:
+                pending = self._dialing[agg] = _PendingDial()
+
+        if not leader:
+            pending.event.wait()
+            if pending.exception is not None:
+                raise pending.exception
+            return self._checkout(agg)
+
+        try:
+            return self._checkout(agg)
+        except PoolConnectionException as e:
+            pending.exception = e
+            raise
+        finally:
+            with self._lock:
+                del self._dialing[agg]
+            pending.event.set()
+
+    def _probe(self):
+        """ Checks on ejected aggregators whose reset timeout has passed,
+        closing their breakers again if they answer.  Called by the prober.
+        """
+        for agg in self._health.ejected():
+            if not self._health.breaker(agg).probe_due():
+                continue
+            start = time.time()
+            try:
+                with self._pool_connect(agg) as conn:
+                    conn.ping()
+                    reused = conn.reused
+            except PoolConnectionException:
+                self._health.record_failure(agg)
+                self.logger.debug('Aggregator %s:%s is still unavailable' % agg)
+            else:
+                self._health.record_success(agg, None if reused else time.time() - start)
+                self.logger.info('Aggregator %s:%s is healthy again' % agg)
+
+    def _take_standby(self):
+        """ Switches over to a standby aggregator, returning one of its
+        standby connections, or None if there are none.
+        """
         with self._lock:
-            if self._aggregator:
+            for agg, conns in list(self._standby.items()):
+                if conns and self._health.breaker(agg).state == CLOSED:
+                    conn = conns.pop()
+                    self._aggregator = agg
+                    self.logger.info('Failing over to standby aggregator %s:%s' % agg)
+                    break
+            else:
+                return None
+
+            # the other standby connections to the new aggregator are
+            # ordinary pooled connections now
+            released = self._standby.pop(agg)
+            if self._standby_keeper is not None:
+                self._standby_keeper.run_now()
+
+        for standby in released:
+            standby.close()
+        return conn
+
+    def _maintain_standby(self):
+        """ Pings standby connections and tops them up.  Called by the
+        standby keeper.
+        """
+        current = self._aggregator
+        healthy = [ agg for agg in self._topology.aggregators
+                    if agg != current and self._health.breaker(agg).state == CLOSED ]
+
+        with self._lock:
+            # keep the standby aggregators we already have, if they're still healthy
+            targets = [ agg for agg in self._standby if agg in healthy ]
+            others = [ agg for agg in healthy if agg not in targets ]
+            random.shuffle(others)
+            targets = (targets + others)[:self._standby_aggregators]
+
+            # take the connections out while we ping them, so failover
+            # never hands out a connection the keeper is using
+            checked, self._standby = self._standby, {}
+
+        kept = {}
+        for agg, conns in checked.items():
+            for conn in conns:
+                if agg in targets and self._ping_standby(agg, conn):
+                    kept.setdefault(agg, []).append(conn)
+                else:
+                    conn.close()
+
+        for agg in targets:
+            conns = kept.setdefault(agg, [])
+            while len(conns) < self._standby_connections:
                 try:
-                    return self._pool_connect(self._aggregator)
+                    conns.append(self._checkout(agg))
                 except PoolConnectionException:
-                    self._aggregator = None
+                    break
 
-            if not len(self._aggregators):
-                with self._pool_connect(self._primary_aggregator) as conn:
-                    self._update_aggregator_list(conn)
-                    conn.expire()
+        with self._lock:
+            for agg, conns in kept.items():
+                self._standby.setdefault(agg, []).extend(conns)
 
-            random.shuffle(self._aggregators)
+    def _ping_standby(self, agg, conn):
+        try:
+            conn.ping()
+            return True
+        except (PoolConnectionException, DatabaseError):
+            self._health.record_failure(agg)
+            return False
 
-            last_exception = None
-            for aggregator in self._aggregators:
-                self.logger.debug('Attempting connection with %s:%s' % (aggregator[0], aggregator[1]))
+    def _discover(self):
+        """ Runs `SHOW AGGREGATORS` on the first reachable aggregator and
+        swaps in the resulting topology.  Called by the refresher.
+        """
+        # spread discovery over the known aggregators, the primary
+        # aggregator is only the first choice when we know nothing else
+        known = list(self._topology.aggregators)
+        random.shuffle(known)
+        candidates = [self._aggregator] + known + [self._primary_aggregator]
 
-                try:
-                    conn = self._pool_connect(aggregator)
-                    # connection successful!
-                    self._aggregator = aggregator
-                    return conn
-                except PoolConnectionException as e:
-                    # connection error
-                    last_exception = e
-            else:
-                # bad news bears...  try again later
-                self._aggregator = None
-                self._aggregators = []
+        last_exception = None
+        for agg in candidates:
+            if agg is None:
+                continue
+            try:
+                conn = self._pool_connect(agg)
+            except PoolConnectionException as e:
+                last_exception = e
+                continue
 
-                raise last_exception
+            with conn:
+                self._update_aggregator_list(conn)
+            return
+
+        raise last_exception
 
     def _update_aggregator_list(self, conn):
         try:
@@ -104,21 +534,27 @@ class RandomAggregatorPool(object):
         except DatabaseError as e:
             if e.args[0] == errorcodes.ER_DISTRIBUTED_NOT_AGGREGATOR:
                 # connected to memsql singlebox
-                self._aggregators = [self._primary_aggregator]
-                self._master_aggregator = self._primary_aggregator
+                aggregators = [self._primary_aggregator]
+                master_aggregator = self._primary_aggregator
             else:
                 raise
         else:
-            with self._lock:
-                self._aggregators = []
-                for row in rows:
-                    if row.Host == '127.0.0.1':
-                        # this is the aggregator we are connecting to
-                        row['Host'] = conn.connection_info()[0]
-                    if int(row.Master_Aggregator) == 1:
-                        self._master_aggregator = (row.Host, row.Port)
-                    self._aggregators.append((row.Host, row.Port))
-
-            assert len(self._aggregators) > 0, "Failed to retrieve a list of aggregators"
-
-        self.logger.debug('Aggregator list is updated to %s. Current aggregator is %s.' % (self._aggregators, self._aggregator))
+            aggregators, master_aggregator = [], self._topology.master
+            for row in rows:
+                if row.Host == '127.0.0.1':
+                    # this is the aggregator we are connecting to
+                    row['Host'] = conn.connection_info()[0]
+                if int(row.Master_Aggregator) == 1:
+                    master_aggregator = (row.Host, row.Port)
+                aggregators.append((row.Host, row.Port))
+
+            assert len(aggregators) > 0, "Failed to retrieve a list of aggregators"
+
+        # a single assignment, so readers always see a consistent snapshot
+        self._topology = Topology(tuple(aggregators), master_aggregator, time.time())
+        self._health.forget(aggregators + [self._primary_aggregator])
+        if self._topology_cache is not None:
+            self._topology_cache.save(self._primary_aggregator, self._topology)
+        self._topology_ready.set()
+
+        self.logger.debug('Aggregator list is updated to %s. Current aggregator is %s.' % (aggregators, self._aggregator))
@@ -0,0 +1,207 @@
+import collections
+import re
+import threading
+import time
+
+from memsql.common import routing
+from memsql.common.util import estimate_row_size
+
+_IDENT = r'`?([\w$]+)`?(?:\s*\.\s*`?([\w$]+)`?)?'
+_KEYWORD = r'(?:JOIN|INNER|LEFT|RIGHT|CROSS|NATURAL|FULL|OUTER|STRAIGHT_JOIN|WHERE|GROUP|ORDER|HAVING|LIMIT|ON|USING|UNION)\b'
+_ALIAS = r'(?:\s+(?:AS\s+)?(?!%s)\w+)?' % _KEYWORD
+_TABLE_LIST = re.compile(r'\b(?:FROM|JOIN)\s+(%s%s(?:\s*,\s*%s%s)*)' % (_IDENT, _ALIAS, _IDENT, _ALIAS), re.I)
+_WRITTEN = re.compile(r'\b(?:INTO|UPDATE|FROM|JOIN|TABLE|TRUNCATE)\s+(?:IF\s+(?:NOT\s+)?EXISTS\s+)?' + _IDENT, re.I)
+_WRITE_ALIAS = r'(?:\s+(?:AS\s+)?(?!%s|(?:SET|VALUES?|SELECT|PARTITION|ADD|TO)\b)\w+)?' % _KEYWORD
+# multi-table UPDATE / DELETE and DROP TABLE a, b
+_WRITTEN_LIST = re.compile(r'\b(?:UPDATE|FROM|USING|TABLE)\s+' + _IDENT + _WRITE_ALIAS + r'\s*,', re.I)
+_TABLE_NAME = re.compile(_IDENT)
+_SELECT = re.compile(r'(\s|/\*.*?\*/|(--|#)[^\n]*(\n|$)|\()*(SELECT|WITH)\b', re.I | re.S)
+
+def tables_read(query):
+    """ Returns the (lower cased, unqualified) names of the tables a
+    SELECT reads, found after FROM and JOIN.
+    """
+    query = routing._COMMENTS.sub(' ', query)
+    tables = set()
+    for match in _TABLE_LIST.finditer(query):
+        for part in match.group(1).split(','):
+            tables.add(_unqualified(_TABLE_NAME.search(part)))
+    return tables
+
+def tables_written(query):
+    """ Returns the names of the tables a write or DDL statement may
+    change, or None if it can't tell.
+    """
+    query = routing._COMMENTS.sub(' ', query)
+    if _WRITTEN_LIST.search(query):
+        # only the first table of a list would be found
+        return None
+    tables = set(_unqualified(m) for m in _WRITTEN.finditer(query))
+    return tables or None
+
+def _unqualified(match):
+    return (match.group(2) or match.group(1)).lower()
+
+class ResultCache(object):
+    """ A client side cache of SELECT results, keyed on the fully escaped
+    SQL and the server, user and database it ran against.  Connections
+    which changed their session (USE, SET, ...), are inside a
+    transaction or have autocommit off bypass the cache.
+
+    Entries live for `ttl` seconds (or the TTL given to
+    `Connection.cached_query`) and the least recently used entries are
+    evicted once the cached results take up more than `max_bytes`.
+    Writes through any connection sharing the cache invalidate the
+    cached reads of the tables they touch; writes from other processes
+    are only seen once entries expire.
+
+        cache = ResultCache(max_bytes=64 * 1024 * 1024, ttl=5)
+        conn = database.connect(..., result_cache=cache)
+        pool = ConnectionPool(result_cache=cache)
+
+    Results are stored as tuples of tuples and every hit returns a new
+    SelectResult over them, so callers can't change what other callers
+    see.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, ttl=60):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        # key => _Entry, least recently used first
+        self._entries = collections.OrderedDict()
+        # table => keys of the entries reading it
+        self._readers = collections.defaultdict(set)
+        # table => number of writes seen, to catch writes racing a read
+        self._generations = collections.defaultdict(int)
+        # bumped by writes whose tables are unknown
+        self._epoch = 0
+        self._bytes = 0
+        self._stats = { 'hits': 0, 'misses': 0, 'evictions': 0, 'expirations': 0, 'invalidations': 0 }
+
+    def key(self, connection_key, query):
+        """ Returns (key, tables) for an escaped statement, or (None, None)
+        if its result should not be cached.  Only SELECTs reading tables
+        are cached; SHOW statements and table-less SELECTs like
+        `SELECT 1` or `SELECT NOW()` always go to the server.
+        """
+        if routing.classify_statement(query) != routing.READ or not _SELECT.match(query):
+            return None, None
+        tables = tables_read(query)
+        if not tables:
+            return None, None
+        return (connection_key, query), tables
+
+    def get(self, key):
+        """ Returns (fieldnames, rows) for `key`, or None. """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires <= time.time():
+                self._remove(key)
+                self._stats['expirations'] += 1
+                entry = None
+            if entry is None:
+                self._stats['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats['hits'] += 1
+            return entry.fieldnames, entry.rows
+
+    def generation(self, tables):
+        """ Returns a token to pass to `put()` for a read of `tables`
+        which is about to start.
+        """
+        with self._lock:
+            return self._generation(tables)
+
+    def put(self, key, tables, generation, fieldnames, rows, ttl=None):
+        """ Caches a result for `key`, unless one of `tables` was written
+        since `generation` was taken or the result is larger than the
+        whole cache.
+        """
+        rows = tuple(tuple(row) for row in rows)
+        size = _result_size(key, rows)
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            if generation != self._generation(tables):
+                return
+            if key in self._entries:
+                self._remove(key)
+
+            ttl = self.ttl if ttl is None else ttl
+            self._entries[key] = _Entry(tuple(fieldnames), rows, tables, size, time.time() + ttl)
+            for table in tables:
+                self._readers[table].add(key)
+            self._bytes += size
+
+            while self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self._stats['evictions'] += 1
+
+    def invalidate_statement(self, query):
+        """ Invalidates what an escaped statement which just ran may have
+        changed.  Reads and transaction or session statements change
+        nothing; writes whose tables can't be told drop every entry.
+        """
+        if routing.classify_statement(query) == routing.WRITE:
+            self.invalidate(tables_written(query))
+
+    def invalidate(self, tables=None):
+        """ Drops the entries reading any of `tables`, or every entry if
+        `tables` is None.
+        """
+        with self._lock:
+            if tables is None:
+                keys = list(self._entries)
+                self._epoch += 1
+            else:
+                keys = set()
+                for table in tables:
+                    self._generations[table] += 1
+                    keys.update(self._readers.get(table, ()))
+
+            for key in keys:
+                if key in self._entries:
+                    self._remove(key)
+                    self._stats['invalidations'] += 1
+
+    def stats(self):
+        """ Returns a dict of counters: hits, misses, evictions,
+        expirations and invalidations, plus the current entries and bytes.
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = len(self._entries)
+            stats['bytes'] = self._bytes
+            return stats
+
+    def _generation(self, tables):
+        return (self._epoch,) + tuple(self._generations[t] for t in tables)
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        self._bytes -= entry.size
+        for table in entry.tables:
+            readers = self._readers.get(table)
+            if readers is not None:
+                readers.discard(key)
+                if not readers:
+                    del self._readers[table]
+
+    def __len__(self):
+        return len(self._entries)
+
+def _result_size(key, rows):
+    return len(key[1]) + 64 + sum(estimate_row_size(row) for row in rows)
+
+class _Entry(object):
+    __slots__ = ['fieldnames', 'rows', 'tables', 'size', 'expires']
+
+    def __init__(self, fieldnames, rows, tables, size, expires):
+        self.fieldnames = fieldnames
+        self.rows = rows
+        self.tables = tables
+        self.size = size
+        self.expires = expires
@@ -0,0 +1,184 @@
+import re
+
+from memsql.common.exceptions import NotConnected
+
+READ = 'read'
+WRITE = 'write'
+BEGIN = 'begin'
+END = 'end'
+SESSION = 'session'
+
+_COMMENTS = re.compile(r'(/\*.*?\*/|(--|#)[^\n]*(\n|$))', re.S)
+_FIRST_WORD = re.compile(r'[\s(]*([a-zA-Z]+)')
+_LOCKING_READ = re.compile(r'\bFOR\s+UPDATE\b|\bLOCK\s+IN\s+SHARE\s+MODE\b|\bINTO\b', re.I)
+_START_TRANSACTION = re.compile(r'[\s(]*START\s+TRANSACTION\b', re.I)
+# functions reporting on the session's previous statement
+_SESSION_FUNCTIONS = re.compile(r'\b(?:LAST_INSERT_ID|ROW_COUNT|FOUND_ROWS)\s*\(', re.I)
+
+_READ_KEYWORDS = frozenset(['SELECT', 'SHOW', 'DESCRIBE', 'DESC', 'EXPLAIN', 'PROFILE', 'WITH'])
+_END_KEYWORDS = frozenset(['COMMIT', 'ROLLBACK'])
+_SESSION_KEYWORDS = frozenset(['SET', 'USE', 'LOCK', 'UNLOCK'])
+
+def classify_statement(query):
+    """ Classify a SQL statement for routing.
+
+    Returns READ for statements which any aggregator can answer, BEGIN
+    and END for transaction boundaries, SESSION for statements which
+    change session state (and so pin the session to one connection) and
+    WRITE for everything else, which has to go to the master aggregator.
+
+    >>> classify_statement('SELECT * FROM foo')
+    'read'
+    >>> classify_statement('/* hi */ INSERT INTO foo VALUES (1)')
+    'write'
+    """
+    stripped = _COMMENTS.sub(' ', query)
+    match = _FIRST_WORD.match(stripped)
+    if match is None:
+        return WRITE
+
+    keyword = match.group(1).upper()
+    if keyword in _READ_KEYWORDS:
+        if keyword in ('SELECT', 'WITH') and _LOCKING_READ.search(stripped):
+            return WRITE
+        return READ
+    elif keyword == 'BEGIN' or (keyword == 'START' and _START_TRANSACTION.match(stripped)):
+        # but not START PIPELINE and the like
+        return BEGIN
+    elif keyword in _END_KEYWORDS:
+        return END
+    elif keyword in _SESSION_KEYWORDS:
+        return SESSION
+    return WRITE
+
+class RoutingPool(object):
+    """ Routes statements between the master and child aggregators.
+
+    Wraps a RandomAggregatorPool.  Reads go to whichever aggregator the
+    pool picks and writes and DDL go to the master aggregator, so
+    callers no longer have to choose between connect() and
+    connect_master() for every statement.
+
+        pool = RoutingPool(RandomAggregatorPool('agg-1', 3306))
+        with pool.connect() as conn:
+            conn.query('SELECT * FROM foo')      # child aggregator
+            conn.execute('INSERT INTO foo ...')  # master aggregator
+    """
+
+    def __init__(self, aggregator_pool):
+        self._aggregator_pool = aggregator_pool
+
+    def connect(self):
+        """ Returns a RoutedConnection.  Underlying connections are checked
+        out lazily, the first time a statement needs them.
+        """
+        return RoutedConnection(self._aggregator_pool)
+
+    def close(self):
+        self._aggregator_pool.close()
+
+class RoutedConnection(object):
+    """ A connection which dispatches each statement to the master or a
+    child aggregator connection.
+
+    Once a transaction is started (with BEGIN / START TRANSACTION or
+    `transaction()`), every statement goes to the master connection until
+    it is committed or rolled back.  Statements which change session
+    state (SET, USE, LOCK TABLES) and calls to `pin()` pin the session to
+    the master connection until the RoutedConnection is closed.  Reads of
+    LAST_INSERT_ID(), ROW_COUNT() and FOUND_ROWS() go to the connection
+    which ran the previous statement.
+    """
+
+    def __init__(self, aggregator_pool):
+        self._aggregator_pool = aggregator_pool
+        self._master = None
+        self._child = None
+        self._in_transaction = False
+        self._pinned = False
+        self._last = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        for conn in (self._child, self._master):
+            if conn is not None:
+                conn.close()
+        self._master = self._child = self._last = None
+        self._in_transaction = False
+
+    def master(self):
+        """ Returns the master aggregator connection. """
+        if self._master is None:
+            self._master = self._aggregator_pool.connect_master()
+            if self._master is None:
+                raise NotConnected('Could not connect to the master aggregator')
+        return self._master
+
+    def child(self):
+        """ Returns the connection used for reads. """
+        if self._pinned or self._in_transaction:
+            return self.master()
+        if self._child is None:
+            self._child = self._aggregator_pool.connect()
+        return self._child
+
+    def pin(self):
+        """ Send every following statement to the master connection. """
+        self._pinned = True
+
+    def pinned(self):
+        return self._pinned or self._in_transaction
+
+    def transaction(self):
+        return _Transaction(self)
+
+    def route(self, query):
+        """ Returns the connection `query` should run on, updating the
+        transaction and pinning state for it.
+        """
+        kind = classify_statement(query)
+        if kind == BEGIN:
+            self._in_transaction = True
+        elif kind == SESSION:
+            self._pinned = True
+
+        if kind == READ and self._last is not None and _SESSION_FUNCTIONS.search(query):
+            conn = self._last
+        else:
+            conn = self.child() if kind == READ else self.master()
+
+        if kind == END:
+            self._in_transaction = False
+        self._last = conn
+        return conn
+
+    def query(self, query, *parameters, **kwparameters):
+        return self.route(query).query(query, *parameters, **kwparameters)
+
+    def get(self, query, *parameters, **kwparameters):
+        return self.route(query).get(query, *parameters, **kwparameters)
+
+    def execute(self, query, *parameters, **kwparameters):
+        return self.route(query).execute(query, *parameters, **kwparameters)
+
+    def execute_lastrowid(self, query, *parameters, **kwparameters):
+        return self.route(query).execute_lastrowid(query, *parameters, **kwparameters)
+
+    def debug_query(self, query, *parameters, **kwparameters):
+        return self.route(query).debug_query(query, *parameters, **kwparameters)
+
+class _Transaction(object):
+    def __init__(self, conn):
+        self._conn = conn
+
+    def __enter__(self):
+        self._conn.execute('BEGIN')
+        return self._conn
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._conn.execute('ROLLBACK' if exc_type is not None else 'COMMIT')
@@ -0,0 +1,127 @@
+import base64
+
+from concurrent import futures
+
+from memsql.common import database, json
+
+class TableScan(object):
+    """ Reads a whole table (or the rows matching `where`) in pages of
+    `batch_size` rows, ordered by `key_columns`.
+
+    Each page starts right after the last key of the previous one
+    (`WHERE k1 > ? OR (k1 = ? AND k2 > ?) ... ORDER BY k1, k2 LIMIT n`),
+    so every page costs the same no matter how deep into the table the
+    scan is.  `key_columns` must uniquely identify a row, e.g. the
+    primary key.
+
+    Iterating yields Rows, or SelectResult pages if `batches` is set.
+    `checkpoint()` returns a token for resuming after the last row (or
+    page) handed out; pass it back as `checkpoint` to pick up where a
+    scan left off.
+
+    With `prefetch` (a callable returning a pooled connection, e.g. a
+    bound ConnectionPool.connect), the next page is read on that
+    connection while the caller processes the current one.
+    """
+
+    def __init__(self, conn, table_name, key_columns, batch_size=1000, where=None, parameters=None,
+                 columns=None, checkpoint=None, batches=False, prefetch=None):
+        if isinstance(key_columns, str):
+            key_columns = [key_columns]
+        self._key_columns = list(key_columns)
+        if columns is not None:
+            missing = [ c for c in self._key_columns if c not in columns ]
+            if missing:
+                raise ValueError('Key columns must be selected, missing: %s' % ', '.join(missing))
+
+        self._conn = conn
+        self._table_name = table_name
+        self._batch_size = batch_size
+        self._where = database.escape_query(where, parameters) if where else None
+        self._columns = '*' if columns is None else ', '.join([ '`%s`' % c for c in columns ])
+        self._batches = batches
+        self._prefetch = prefetch
+        self._last = self._load_checkpoint(checkpoint)
+
+    def __iter__(self):
+        for page in self._pages():
+            if self._batches:
+                self._last = self._key(page[-1])
+                yield page
+            else:
+                for row in page:
+                    self._last = self._key(row)
+                    yield row
+
+    def checkpoint(self):
+        """ Returns a token for resuming this scan after the last row
+        handed out, or None if nothing was handed out yet.
+        """
+        if self._last is None:
+            return None
+        state = { 'table': self._table_name, 'keys': self._key_columns, 'last': list(self._last) }
+        return base64.urlsafe_b64encode(json.dumps(state).encode('utf-8')).decode('ascii')
+
+    def _load_checkpoint(self, checkpoint):
+        if checkpoint is None:
+            return None
+        try:
+            state = json.loads(base64.urlsafe_b64decode(checkpoint.encode('ascii')).decode('utf-8'), use_decimal=True)
+        except (TypeError, ValueError):
+            raise ValueError('Invalid scan checkpoint')
+        if state.get('table') != self._table_name or state.get('keys') != self._key_columns:
+            raise ValueError('Checkpoint is for a scan of %s by %s' % (state.get('table'), state.get('keys')))
+        return tuple(state['last'])
+
+    def _pages(self):
+        prefetch_conn, executor = None, None
+        try:
+            page = self._fetch(self._conn, self._last)
+            while page:
+                full = len(page) == self._batch_size
+                upcoming = None
+                if full and self._prefetch is not None:
+                    if executor is None:
+                        prefetch_conn = self._prefetch()
+                        executor = futures.ThreadPoolExecutor(max_workers=1)
+                    upcoming = executor.submit(self._fetch, prefetch_conn, self._key(page[-1]))
+
+                last_key = self._key(page[-1])
+                yield page
+                if not full:
+                    return
+                page = upcoming.result() if upcoming is not None else self._fetch(self._conn, last_key)
+        finally:
+            if executor is not None:
+                executor.shutdown(wait=True)
+            if prefetch_conn is not None:
+                prefetch_conn.close()
+
+    def _fetch(self, conn, after):
+        conditions = []
+        if self._where:
+            conditions.append('(%s)' % self._where)
+        if after is not None:
+            conditions.append(self._after(after))
+
+        query = 'SELECT %s FROM `%s`' % (self._columns, self._table_name)
+        if conditions:
+            query += ' WHERE ' + ' AND '.join(conditions)
+        query += ' ORDER BY %s LIMIT %d' % (', '.join([ '`%s`' % c for c in self._key_columns ]), self._batch_size)
+        return conn.query(query)
+
+    def _after(self, last):
+        """ Returns the predicate for keys strictly after `last`.
+
+        Spelled out as k1 > a OR (k1 = a AND k2 > b) ... rather than a row
+        comparison, so the leading key column can use an index.
+        """
+        escaped = [ database._escape(v) for v in last ]
+        clauses = []
+        for i, column in enumerate(self._key_columns):
+            equal = [ '`%s` = %s' % (c, v) for c, v in zip(self._key_columns[:i], escaped[:i]) ]
+            clauses.append('(%s)' % ' AND '.join(equal + [ '`%s` > %s' % (column, escaped[i]) ]))
+        return '(%s)' % ' OR '.join(clauses)
+
+    def _key(self, row):
+        return tuple(row[c] for c in self._key_columns)
@@ -0,0 +1,180 @@
+import asyncio
+import threading
+
+from memsql.common import database, routing
+
+class SingleFlight(object):
+    """ Runs at most one call per key at a time.
+
+    Callers which ask for a key while a call for it is in flight wait
+    for that call and share its result (or exception) instead of
+    starting their own.  Nothing is remembered once the call finishes.
+
+        flight = SingleFlight()
+        rows = flight.do(sql, run_query, sql)
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._stats = { 'calls': 0, 'shared': 0 }
+
+    def do(self, key, fn, *args, **kwargs):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self._stats['calls'] += 1
+            else:
+                self._stats['shared'] += 1
+
+        if not leader:
+            call.done.wait()
+            return call.outcome()
+
+        try:
+            call.result = fn(*args, **kwargs)
+        except Exception as e:
+            call.error = e
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.outcome()
+
+    def stats(self):
+        """ Returns a dict of counters: calls (executions started) and
+        shared (callers which waited on another caller's execution).
+        """
+        with self._lock:
+            return dict(self._stats)
+
+class AsyncSingleFlight(object):
+    """ A SingleFlight for coroutines on one asyncio event loop.
+
+    `fn` is a coroutine function.  The shared call runs as its own task,
+    so a waiter being cancelled doesn't cancel it for the others.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._stats = { 'calls': 0, 'shared': 0 }
+
+    async def do(self, key, fn, *args, **kwargs):
+        task = self._calls.get(key)
+        if task is not None:
+            self._stats['shared'] += 1
+        else:
+            task = self._calls[key] = asyncio.ensure_future(fn(*args, **kwargs))
+            task.add_done_callback(lambda _: self._calls.pop(key, None))
+            self._stats['calls'] += 1
+        return await asyncio.shield(task)
+
+    def stats(self):
+        return dict(self._stats)
+
+class SingleFlightReader(object):
+    """ Coalesces identical concurrent reads.
+
+    `connect` is any callable returning a pooled connection (like a
+    bound RandomAggregatorPool.connect).  Concurrent read statements
+    with the same escaped SQL share one pool checkout and one execution,
+    and each caller gets its own SelectResult over the same immutable
+    rows.  Anything other than a read runs on its own connection as
+    usual.
+
+    Pass the same `flight` to several readers only if they query the
+    same database, since calls are keyed on the SQL alone.
+    """
+
+    def __init__(self, connect, flight=None):
+        self._connect = connect
+        self._flight = flight or SingleFlight()
+
+    def stats(self):
+        return self._flight.stats()
+
+    def query(self, query, *parameters, **kwparameters):
+        sql = database._escape_parameters(query, parameters, kwparameters)
+        if routing.classify_statement(sql) != routing.READ:
+            return _run(self._connect, sql)
+        return _select_result(self._flight.do(sql, _run, self._connect, sql))
+
+    def get(self, query, *parameters, **kwparameters):
+        return _first_row(self.query(query, *parameters, **kwparameters))
+
+class AsyncSingleFlightReader(object):
+    """ A SingleFlightReader for asyncio callers.
+
+    Queries run on `executor` (the loop's default executor if None),
+    since connections are blocking.
+
+        reader = AsyncSingleFlightReader(agg_pool.connect)
+        rows = await reader.query('SELECT * FROM foo WHERE id = %s', 1)
+    """
+
+    def __init__(self, connect, loop=None, executor=None, flight=None):
+        self._connect = connect
+        self._loop = loop
+        self._executor = executor
+        self._flight = flight or AsyncSingleFlight()
+
+    def stats(self):
+        return self._flight.stats()
+
+    async def query(self, query, *parameters, **kwparameters):
+        sql = database._escape_parameters(query, parameters, kwparameters)
+        if routing.classify_statement(sql) != routing.READ:
+            return await self._run_in_executor(sql)
+        return _select_result(await self._flight.do(sql, self._run_in_executor, sql))
+
+    async def get(self, query, *parameters, **kwparameters):
+        return _first_row(await self.query(query, *parameters, **kwparameters))
+
+    async def _run_in_executor(self, sql):
+        loop = self._loop or asyncio.get_event_loop()
+        return await loop.run_in_executor(self._executor, _run, self._connect, sql)
+
+class _Call(object):
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+    def outcome(self):
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+def _run(connect, sql):
+    conn = connect()
+    try:
+        result = conn.query(sql)
+    finally:
+        conn.close()
+    if isinstance(result, database.SelectResult):
+        # shared between callers, so keep the rows immutable
+        return _Shared(result.fieldnames, tuple(tuple(row) for row in result.rows))
+    return result
+
+def _select_result(result):
+    if isinstance(result, _Shared):
+        return database.SelectResult(result.fieldnames, result.rows)
+    return result
+
+def _first_row(rows):
+    if not rows:
+        return None
+    elif not isinstance(rows, list):
+        raise database.MySQLError("Query is not a select query")
+    elif len(rows) > 1:
+        raise database.MySQLError("Multiple rows returned for Database.get() query")
+    return rows[0]
+
+class _Shared(object):
+    __slots__ = ['fieldnames', 'rows']
+
+    def __init__(self, fieldnames, rows):
+        self.fieldnames = fieldnames
+        self.rows = rows
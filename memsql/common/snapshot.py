@@ -0,0 +1,275 @@
+""" Share query results between processes through memory mapped files.
+
+A snapshot file holds one result in a compact column major layout: per
+column, an array of offsets followed by the encoded values.  Opening a
+snapshot maps the file without reading it, so any number of processes
+can share one copy of the data through the page cache, decoding only
+the values they touch.
+
+    # in one process, e.g. a cron job or the prefork master
+    snapshot.materialize(conn, '/dev/shm/countries.snap', 'SELECT * FROM countries')
+
+    # in every worker
+    reader = snapshot.SnapshotReader('/dev/shm/countries.snap')
+    for row in reader.current():
+        print(row.name)
+
+Snapshots are replaced atomically by rename, and every file records a
+version which increases with each refresh.
+"""
+
+import datetime
+import decimal
+import mmap
+import os
+import struct
+import time
+
+from memsql.common.database import Row
+from memsql.common.util import atomic_write
+
+MAGIC = b'MEMSQLS1'
+
+# magic, version, created, rows, columns
+_HEADER = struct.Struct('<8sQdQI')
+_U32 = struct.Struct('<I')
+_U64 = struct.Struct('<Q')
+_INT = struct.Struct('<q')
+_FLOAT = struct.Struct('<d')
+_DATETIME = struct.Struct('<HBBBBBI')
+_DATE = struct.Struct('<HBB')
+_TIMEDELTA = struct.Struct('<iii')
+
+_NONE, _INTEGER, _BIG_INTEGER, _DOUBLE, _TEXT, _BYTES, _DECIMAL, _DATETIME_TAG, _DATE_TAG, _TIMEDELTA_TAG = range(10)
+
+class SnapshotError(Exception):
+    pass
+
+def materialize(conn, path, query, *parameters, **kwparameters):
+    """ Runs `query` on `conn` and writes the result to a snapshot at
+    `path`.  Returns the new snapshot's version.
+    """
+    return write_snapshot(path, conn.query(query, *parameters, **kwparameters))
+
+def write_snapshot(path, result, version=None):
+    """ Atomically replaces the snapshot at `path` with `result` (a
+    SelectResult).  `version` defaults to one more than the version of
+    the snapshot being replaced.  Returns the version written.
+    """
+    if version is None:
+        version = _current_version(path) + 1
+
+    fieldnames = tuple(result.fieldnames)
+    rows = result.rows
+
+    with atomic_write(path, 'wb') as f:
+        f.write(_HEADER.pack(MAGIC, version, time.time(), len(rows), len(fieldnames)))
+        for name in fieldnames:
+            encoded = name.encode('utf-8')
+            f.write(_U32.pack(len(encoded)) + encoded)
+
+        # the column directory is filled in once the columns are written
+        directory_offset = f.tell()
+        f.write(b'\0' * (_U64.size * len(fieldnames)))
+
+        column_offsets = []
+        for i in range(len(fieldnames)):
+            column_offsets.append(f.tell())
+            _write_column(f, [ row[i] for row in rows ])
+
+        f.seek(directory_offset)
+        f.write(b''.join(_U64.pack(offset) for offset in column_offsets))
+
+    return version
+
+def _write_column(f, values):
+    """ Writes (rows + 1) offsets, relative to the end of the offsets,
+    followed by the encoded values.
+    """
+    encoded = [ _encode(v) for v in values ]
+    offsets, position = [], 0
+    for value in encoded:
+        offsets.append(position)
+        position += len(value)
+    offsets.append(position)
+
+    f.write(struct.pack('<%dQ' % len(offsets), *offsets))
+    f.write(b''.join(encoded))
+
+def _encode(value):
+    if value is None:
+        return bytes((_NONE,))
+    elif isinstance(value, bool):
+        return bytes((_INTEGER,)) + _INT.pack(int(value))
+    elif isinstance(value, int):
+        if -2 ** 63 <= value < 2 ** 63:
+            return bytes((_INTEGER,)) + _INT.pack(value)
+        return bytes((_BIG_INTEGER,)) + str(value).encode('ascii')
+    elif isinstance(value, float):
+        return bytes((_DOUBLE,)) + _FLOAT.pack(value)
+    elif isinstance(value, str):
+        return bytes((_TEXT,)) + value.encode('utf-8')
+    elif isinstance(value, (bytes, bytearray)):
+        return bytes((_BYTES,)) + bytes(value)
+    elif isinstance(value, decimal.Decimal):
+        return bytes((_DECIMAL,)) + str(value).encode('ascii')
+    elif isinstance(value, datetime.datetime):
+        return bytes((_DATETIME_TAG,)) + _DATETIME.pack(
+            value.year, value.month, value.day, value.hour, value.minute, value.second, value.microsecond)
+    elif isinstance(value, datetime.date):
+        return bytes((_DATE_TAG,)) + _DATE.pack(value.year, value.month, value.day)
+    elif isinstance(value, datetime.timedelta):
+        return bytes((_TIMEDELTA_TAG,)) + _TIMEDELTA.pack(value.days, value.seconds, value.microseconds)
+    raise TypeError('Cannot store values of type %s in a snapshot' % type(value).__name__)
+
+def _decode(data):
+    tag, payload = data[0], data[1:]
+    if tag == _NONE:
+        return None
+    elif tag == _INTEGER:
+        return _INT.unpack(payload)[0]
+    elif tag == _BIG_INTEGER:
+        return int(payload)
+    elif tag == _DOUBLE:
+        return _FLOAT.unpack(payload)[0]
+    elif tag == _TEXT:
+        return payload.decode('utf-8')
+    elif tag == _BYTES:
+        return payload
+    elif tag == _DECIMAL:
+        return decimal.Decimal(payload.decode('ascii'))
+    elif tag == _DATETIME_TAG:
+        return datetime.datetime(*_DATETIME.unpack(payload))
+    elif tag == _DATE_TAG:
+        return datetime.date(*_DATE.unpack(payload))
+    elif tag == _TIMEDELTA_TAG:
+        return datetime.timedelta(*_TIMEDELTA.unpack(payload))
+    raise SnapshotError('Unknown value tag %d' % tag)
+
+def _current_version(path):
+    try:
+        with open(path, 'rb') as f:
+            magic, version, _, _, _ = _HEADER.unpack(f.read(_HEADER.size))
+    except (IOError, OSError, struct.error):
+        return 0
+    return version if magic == MAGIC else 0
+
+class Snapshot(object):
+    """ A read only, memory mapped snapshot.
+
+    Behaves like a sequence of Rows.  Rows decode their values from the
+    mapping when they are accessed, so they stay valid (and keep the
+    mapping open) even after the file is replaced.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._stat = os.fstat(f.fileno())
+            if self._stat.st_size < _HEADER.size:
+                raise SnapshotError('%s is not a snapshot' % path)
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, self.version, self.created, self._rows, columns = _HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC:
+            raise SnapshotError('%s is not a snapshot' % path)
+
+        position, fieldnames = _HEADER.size, []
+        for _ in range(columns):
+            length = _U32.unpack_from(self._mmap, position)[0]
+            position += _U32.size
+            fieldnames.append(self._mmap[position:position + length].decode('utf-8'))
+            position += length
+        self.fieldnames = tuple(fieldnames)
+        self.field_index = dict((name, i) for i, name in enumerate(fieldnames))
+
+        # per column: where its offsets start and where its values start
+        self._columns = []
+        for i in range(columns):
+            start = _U64.unpack_from(self._mmap, position + i * _U64.size)[0]
+            self._columns.append((start, start + (self._rows + 1) * _U64.size))
+
+    def __len__(self):
+        return self._rows
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [ self[j] for j in range(*i.indices(self._rows)) ]
+        if i < 0:
+            i += self._rows
+        if not 0 <= i < self._rows:
+            raise IndexError('snapshot row index out of range')
+        return Row(self.fieldnames, _RowValues(self, i))
+
+    def __iter__(self):
+        for i in range(self._rows):
+            yield Row(self.fieldnames, _RowValues(self, i))
+
+    def width(self):
+        return len(self.fieldnames)
+
+    def value(self, i, column):
+        """ Returns the value of `column` (a name or index) in row `i`. """
+        if not isinstance(column, int):
+            column = self.field_index[column]
+        offsets, data = self._columns[column]
+        start, end = struct.unpack_from('<QQ', self._mmap, offsets + i * _U64.size)
+        return _decode(self._mmap[data + start:data + end])
+
+    def replaced(self):
+        """ Returns True if the file at `path` is no longer this snapshot. """
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return True
+        return (stat.st_ino, stat.st_dev, stat.st_mtime) != (self._stat.st_ino, self._stat.st_dev, self._stat.st_mtime)
+
+    def __repr__(self):
+        return 'Snapshot(%r, version=%d, rows=%d)' % (self.path, self.version, self._rows)
+
+class SnapshotReader(object):
+    """ Hands out the latest snapshot at `path`, re-opening it (at most
+    every `check_interval` seconds) once it has been replaced.
+    """
+
+    def __init__(self, path, check_interval=1):
+        self.path = path
+        self._check_interval = check_interval
+        self._snapshot = None
+        self._checked = 0
+
+    def current(self):
+        now = time.time()
+        if self._snapshot is None:
+            self._snapshot = Snapshot(self.path)
+            self._checked = now
+        elif now - self._checked >= self._check_interval:
+            self._checked = now
+            if self._snapshot.replaced():
+                self._snapshot = Snapshot(self.path)
+        return self._snapshot
+
+class _RowValues(object):
+    """ The values of one snapshot row, decoded on access. """
+
+    __slots__ = ['_snapshot', '_row']
+
+    def __init__(self, snapshot, row):
+        self._snapshot = snapshot
+        self._row = row
+
+    def __len__(self):
+        return len(self._snapshot.fieldnames)
+
+    def __getitem__(self, column):
+        if not 0 <= column < len(self._snapshot.fieldnames):
+            raise IndexError(column)
+        return self._snapshot.value(self._row, column)
+
+    def __iter__(self):
+        for column in range(len(self._snapshot.fieldnames)):
+            yield self._snapshot.value(self._row, column)
+
+    def __add__(self, other):
+        # Row adds fields by concatenating tuples, which copies
+        return tuple(self) + tuple(other)
@@ -0,0 +1,177 @@
+import array
+import mmap
+import pickle
+import tempfile
+
+from memsql.common.database import Row, SelectResult
+from memsql.common.exceptions import ResultTooLarge
+from memsql.common.util import estimate_row_size
+
+FETCH_SIZE = 1000
+
+class ResultBudget(object):
+    """ Bounds the memory a query result may take.
+
+    Rows are streamed from the server instead of being buffered by the
+    client library.  Results which fit in `memory_bytes` come back as a
+    SelectResult like always.  Past that, with `spill` set, the rest of
+    the rows are written to a temporary file in `directory` and a
+    SpilledResult pages them back in on access; without `spill` (or
+    once `disk_bytes` are spilled) the query fails with ResultTooLarge.
+
+        budget = ResultBudget(memory_bytes=256 * 1024 * 1024)
+        rows = conn.budgeted_query(budget, 'SELECT * FROM events')
+
+    Sizes are estimates of the Python objects the rows become.
+    """
+
+    def __init__(self, memory_bytes=64 * 1024 * 1024, spill=True, disk_bytes=None, directory=None):
+        self.memory_bytes = memory_bytes
+        self.spill = spill
+        self.disk_bytes = disk_bytes
+        self.directory = directory
+
+    def fetch(self, result, fieldnames):
+        """ Reads every row from `result` (from use_result()). """
+        rows, memory = [], 0
+        spilled = None
+        try:
+            while True:
+                batch = result.fetch_row(FETCH_SIZE)
+                if not batch:
+                    break
+
+                if spilled is None:
+                    for i, row in enumerate(batch):
+                        size = estimate_row_size(row)
+                        if memory + size > self.memory_bytes:
+                            if not self.spill:
+                                raise ResultTooLarge('Result is larger than %d bytes after %d rows' % (
+                                    self.memory_bytes, len(rows)))
+                            spilled = _SpillFile(self.directory)
+                            batch = batch[i:]
+                            break
+                        memory += size
+                        rows.append(row)
+                    else:
+                        continue
+
+                spilled.write(batch)
+                if self.disk_bytes is not None and spilled.size > self.disk_bytes:
+                    raise ResultTooLarge('Result spilled more than %d bytes to disk after %d rows' % (
+                        self.disk_bytes, len(rows) + len(spilled)))
+        except BaseException:
+            if spilled is not None:
+                spilled.close()
+            raise
+
+        if spilled is None:
+            return SelectResult(fieldnames, rows)
+        spilled.finish()
+        return SpilledResult(fieldnames, rows, memory, spilled)
+
+class SpilledResult(object):
+    """ A read only sequence of Rows, some held in memory and the rest in
+    a temporary file which is read back in as rows are accessed.
+
+    Iterating reads the file sequentially.  close() (or leaving a `with`
+    block) removes the file straight away rather than when the result is
+    garbage collected.
+    """
+
+    def __init__(self, fieldnames, rows, memory_bytes, spilled):
+        self.fieldnames = tuple(fieldnames)
+        self.rows_in_memory = len(rows)
+        self.memory_bytes = memory_bytes
+        self._rows = rows
+        self._spilled = spilled
+
+    @property
+    def rows_on_disk(self):
+        return len(self._spilled)
+
+    @property
+    def disk_bytes(self):
+        return self._spilled.size
+
+    def __len__(self):
+        return self.rows_in_memory + len(self._spilled)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return SelectResult(self.fieldnames, [ self._row(j) for j in range(*i.indices(len(self))) ])
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError('result index out of range')
+        return Row(self.fieldnames, self._row(i))
+
+    def __iter__(self):
+        for row in self._rows:
+            yield Row(self.fieldnames, row)
+        for row in self._spilled.read_all():
+            yield Row(self.fieldnames, row)
+
+    def width(self):
+        return len(self.fieldnames)
+
+    def close(self):
+        self._spilled.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __repr__(self):
+        return 'SpilledResult(%d rows in memory, %d rows on disk)' % (self.rows_in_memory, self.rows_on_disk)
+
+    def _row(self, i):
+        if i < self.rows_in_memory:
+            return self._rows[i]
+        return self._spilled.read(i - self.rows_in_memory)
+
+class _SpillFile(object):
+    """ Pickled rows in an anonymous temporary file, with their offsets
+    kept in memory for random access.
+    """
+
+    def __init__(self, directory):
+        self._file = tempfile.TemporaryFile(prefix='memsql-spill-', dir=directory)
+        self._offsets = array.array('Q', [0])
+        self._mmap = None
+
+    @property
+    def size(self):
+        return self._offsets[-1]
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def write(self, rows):
+        chunk, position = [], self._offsets[-1]
+        for row in rows:
+            data = pickle.dumps(row, pickle.HIGHEST_PROTOCOL)
+            chunk.append(data)
+            position += len(data)
+            self._offsets.append(position)
+        self._file.write(b''.join(chunk))
+
+    def finish(self):
+        self._file.flush()
+        if self.size:
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def read(self, i):
+        return pickle.loads(self._mmap[self._offsets[i]:self._offsets[i + 1]])
+
+    def read_all(self):
+        for i in range(len(self)):
+            yield self.read(i)
+
+    def close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        self._file.close()
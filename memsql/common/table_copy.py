@@ -0,0 +1,226 @@
+import logging
+import threading
+
+from memsql.common.loader import ParallelLoader
+from memsql.common.parallel_scan import _Failure, _put, _discard
+from memsql.common.scan import TableScan
+from memsql.common.util import PeriodicTask
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+class CopyPipeline(object):
+    """ Copies a table from one cluster to another.
+
+    Three stages run at once, connected by bounded queues:
+
+    * a reader thread pages through `table_name` on a connection from
+      `source_connect` with a keyset paginated TableScan,
+    * the calling thread applies `transform` to every row: it gets a
+      Row and returns a dict, a tuple (in `dest_columns` order), or None
+      to drop the row.  Without `transform`, rows are copied as they are,
+    * a ParallelLoader writes pages to `dest_table` over `workers`
+      connections from `dest_connect`, with multi-row INSERTs or LOAD
+      DATA (`method`).
+
+    With a `store` (e.g. an incremental.WatermarkFile), the position
+    after the last page which was written, along with every page before
+    it, is saved, and a later run resumes from there.  Pages written
+    after that position are written again on resume, so use
+    `replace=True` (or a table without unique keys) to make that safe.
+
+        pipeline = CopyPipeline(old_pool.connect, new_pool.connect, 'events', ['id'],
+                                store=WatermarkFile('events.copy'), replace=True)
+        stats = pipeline.run()
+    """
+
+    def __init__(self, source_connect, dest_connect, table_name, key_columns, dest_table=None,
+                 columns=None, where=None, parameters=None, transform=None, dest_columns=None,
+                 batch_size=5000, workers=4, queue_size=4, method='insert', replace=False,
+                 max_retries=3, store=None, progress=None, progress_interval=5):
+        self.logger = logging.getLogger('memsql.table_copy')
+        self._source_connect = source_connect
+        self._table_name = table_name
+        self._key_columns = key_columns
+        self._columns = columns
+        self._where = where
+        self._parameters = parameters
+        self._transform = transform
+        self._batch_size = batch_size
+        self._store = store
+        self._progress = progress
+        self._progress_interval = progress_interval
+
+        self._read = queue.Queue(maxsize=queue_size)
+        self._stopping = threading.Event()
+        self._lock = threading.Lock()
+        self._written = {}
+        self._next_page = 0
+        self._checkpoint = store.load() if store is not None else None
+        self._stats = { 'pages_read': 0, 'rows_read': 0, 'rows_dropped': 0, 'pages_written': 0 }
+
+        self._writer = _PageWriter(self, dest_connect, dest_table or table_name,
+                                   columns=dest_columns if transform is not None else columns,
+                                   workers=workers, queue_size=queue_size, method=method,
+                                   replace=replace, max_retries=max_retries)
+
+    @property
+    def failed(self):
+        """ FailedBatches for the pages which could not be written. """
+        return self._writer.failed
+
+    def checkpoint(self):
+        return self._checkpoint
+
+    def stop(self):
+        """ Stop reading.  Pages already read are still written. """
+        self._stopping.set()
+        self._writer.stop()
+
+    def stats(self):
+        """ Returns a dict with pages and rows read, dropped and written,
+        bytes written, the write rate and the depth of the read queue.
+        """
+        meter = self._writer.meter
+        with self._lock:
+            stats = dict(self._stats)
+        stats.update({
+            'rows_written': meter.rows,
+            'bytes_written': meter.bytes,
+            'rows_per_second': meter.rows_per_second(),
+            'bytes_per_second': meter.bytes_per_second(),
+            'elapsed': meter.elapsed(),
+            'read_queue': self._read.qsize(),
+            'failed_pages': len(self._writer.failed),
+        })
+        return stats
+
+    def run(self):
+        """ Copies every row and returns stats(). """
+        reader = threading.Thread(target=self._read_pages, name='memsql-table-copy-reader')
+        reader.daemon = True
+        reader.start()
+
+        reporter = None
+        if self._progress is not None:
+            reporter = PeriodicTask(lambda: self._progress(self.stats()), interval=self._progress_interval,
+                                    jitter=0, initial_delay=self._progress_interval, name='memsql-table-copy-progress')
+            reporter.start()
+
+        try:
+            self._writer.load(self._transformed())
+        finally:
+            self._stopping.set()
+            while reader.is_alive():
+                _discard(self._read)
+                reader.join(0.1)
+            if reporter is not None:
+                reporter.stop()
+
+        stats = self.stats()
+        if self._progress is not None:
+            self._progress(stats)
+        return stats
+
+    def _read_pages(self):
+        try:
+            conn = self._source_connect()
+            try:
+                scan = TableScan(conn, self._table_name, self._key_columns, batch_size=self._batch_size,
+                                 where=self._where, parameters=self._parameters, columns=self._columns,
+                                 checkpoint=self._checkpoint, batches=True)
+                for seq, page in enumerate(scan):
+                    if not self._put((seq, page, scan.checkpoint())):
+                        return
+            finally:
+                conn.close()
+        except Exception as e:
+            self._put(_Failure(e))
+        else:
+            self._put(None)
+
+    def _put(self, item):
+        return _put(self._read, item, self._stopping)
+
+    def _transformed(self):
+        while True:
+            try:
+                item = self._read.get(timeout=0.1)
+            except queue.Empty:
+                # once stopped, pages already read are still written
+                if self._stopping.is_set():
+                    return
+                continue
+
+            if item is None:
+                return
+            elif isinstance(item, _Failure):
+                raise item.exception
+
+            seq, page, checkpoint = item
+            if self._transform is None:
+                rows = _Page(page.rows)
+                self._writer.columns_for(page.fieldnames)
+            else:
+                rows = _Page(r for r in (self._transform(row) for row in page) if r is not None)
+
+            rows.seq, rows.checkpoint = seq, checkpoint
+            with self._lock:
+                self._stats['pages_read'] += 1
+                self._stats['rows_read'] += len(page)
+                self._stats['rows_dropped'] += len(page) - len(rows)
+            yield rows
+
+    def _page_written(self, page):
+        """ Advances the checkpoint past every page written so far without gaps. """
+        with self._lock:
+            self._stats['pages_written'] += 1
+            self._written[page.seq] = page.checkpoint
+            checkpoint = None
+            while self._next_page in self._written:
+                checkpoint = self._written.pop(self._next_page)
+                self._next_page += 1
+            if checkpoint is None:
+                return
+            if self._store is not None:
+                self._store.save(checkpoint)
+            self._checkpoint = checkpoint
+
+class _PageWriter(ParallelLoader):
+    """ A ParallelLoader which writes the pipeline's pages as they are
+    and reports back which ones made it.
+    """
+
+    def __init__(self, pipeline, *args, **kwargs):
+        super(_PageWriter, self).__init__(*args, **kwargs)
+        self._pipeline = pipeline
+
+    def columns_for(self, fieldnames):
+        if self._columns is None:
+            self._columns = list(fieldnames)
+
+    def _batches(self, pages):
+        for page in pages:
+            if self._columns is None and page and isinstance(page[0], dict):
+                self._columns = sorted(page[0].keys())
+            yield page
+            if self._stopping.is_set():
+                return
+
+    def _write_with_retries(self, conn, page):
+        if page:
+            conn = super(_PageWriter, self)._write_with_retries(conn, page)
+        if not page.failed:
+            self._pipeline._page_written(page)
+        return conn
+
+    def _fail(self, page, exception, written=0):
+        page.failed = True
+        super(_PageWriter, self)._fail(page, exception, written)
+
+class _Page(list):
+    seq = None
+    checkpoint = None
+    failed = False
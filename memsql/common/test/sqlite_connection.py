@@ -0,0 +1,40 @@
+import threading
+
+from memsql.common import database
+
+class SqliteConnection(object):
+    """ Just enough of a database.Connection to run queries on sqlite.
+
+    Connections sharing `lock` take turns on the database.  Every query
+    is appended to `queries` and the name of the thread running it is
+    added to `threads`; both can be shared between connections too.
+    Statements containing `fail_on` raise a duplicate key error.
+    """
+
+    def __init__(self, db, lock=None, queries=None, threads=None, fail_on=None):
+        self._db = db
+        self._lock = threading.Lock() if lock is None else lock
+        self._fail_on = fail_on
+        self.queries = [] if queries is None else queries
+        self.threads = set() if threads is None else threads
+        self.closed = False
+
+    def query(self, sql):
+        with self._lock:
+            self.queries.append(sql)
+            self.threads.add(threading.current_thread().name)
+            cursor = self._db.execute(sql)
+            return database.SelectResult([ d[0] for d in cursor.description ], cursor.fetchall())
+
+    def get(self, sql):
+        rows = self.query(sql)
+        return rows[0] if rows else None
+
+    def execute(self, sql):
+        if self._fail_on is not None and self._fail_on in sql:
+            raise database.DatabaseError(1062, 'Duplicate entry')
+        with self._lock:
+            self._db.execute(sql)
+
+    def close(self):
+        self.closed = True
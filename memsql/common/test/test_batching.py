@@ -0,0 +1,64 @@
+import mock
+import pytest
+
+from memsql.common import query_builder
+from memsql.common.batching import AdaptiveBatcher
+
+def test_slow_start_then_additive_increase():
+    batcher = AdaptiveBatcher(target_latency=1, initial_size=100, step=10)
+
+    batcher.record(100, 0.1)
+    assert batcher.size == 200
+    batcher.record(200, 0.1)
+    assert batcher.size == 400
+
+    batcher.record(400, 2)
+    assert batcher.size == 200
+    batcher.record(200, 0.1)
+    assert batcher.size == 210
+
+    # close enough to the target, hold steady
+    batcher.record(210, 0.95)
+    assert batcher.size == 210
+
+def test_bounds_and_errors():
+    batcher = AdaptiveBatcher(target_latency=1, initial_size=100, min_size=60, max_size=150)
+
+    batcher.record(100, 0.1)
+    assert batcher.size == 150
+    batcher.record_error()
+    assert batcher.size == 75
+    batcher.record(75, 5)
+    assert batcher.size == 60
+
+    metrics = batcher.metrics()
+    assert metrics['size'] == 60
+    assert metrics['recent_sizes'] == [150, 75, 60]
+    assert metrics['increases'] == 1
+    assert metrics['decreases'] == 2
+    assert metrics['errors'] == 1
+    assert metrics['rows'] == 175
+
+    with pytest.raises(ValueError):
+        AdaptiveBatcher(initial_size=10, min_size=20)
+
+def test_short_final_batch_does_not_grow():
+    batcher = AdaptiveBatcher(target_latency=1, initial_size=100)
+    batcher.record(3, 0.01)
+    assert batcher.size == 100
+
+def test_insert_uses_current_size():
+    batcher = AdaptiveBatcher(target_latency=1, initial_size=2, min_size=1, step=1)
+    conn = mock.MagicMock()
+
+    written = batcher.insert(conn, 'foo', ({ 'id': i } for i in range(9)), builder=query_builder.multi_replace)
+
+    assert written == 9
+    statements = [ c[0][0] for c in conn.execute.call_args_list ]
+    # every fast batch doubles the size during slow start: 2, 4, then the last 3
+    assert statements == [
+        'REPLACE INTO `foo` (`id`) VALUES (0), (1)',
+        'REPLACE INTO `foo` (`id`) VALUES (2), (3), (4), (5)',
+        'REPLACE INTO `foo` (`id`) VALUES (6), (7), (8)',
+    ]
+    assert batcher.metrics()['batches'] == 3
@@ -0,0 +1,91 @@
+import datetime
+import gzip
+import io
+import mock
+import pytest
+
+from memsql.common import database, json
+from memsql.common.export import export_result
+
+FIELDS = ['id', 'name', 'created']
+ROWS = [
+    (1, 'plain', datetime.datetime(2014, 1, 2, 3, 4, 5)),
+    (2, 'comma, "quote"\nnewline\ttab', None),
+    (3, b'bytes', datetime.date(2014, 1, 2)),
+]
+
+def _result(rows):
+    """ A use_result() result handing out `rows` two at a time. """
+    result = mock.MagicMock()
+    result.describe.return_value = [ (f,) for f in FIELDS ]
+    batches = [ tuple(rows[i:i + 2]) for i in range(0, len(rows), 2) ] + [()]
+    result.fetch_row.side_effect = lambda maxrows: batches.pop(0)
+    return result
+
+def _export(format, **kwargs):
+    out = io.BytesIO()
+    meter = export_result(FIELDS, [ROWS[:2], ROWS[2:]], out, format=format, **kwargs)
+    return out.getvalue(), meter
+
+def test_csv():
+    data, meter = _export('csv')
+    assert data.decode('utf-8').split('\n', 1) == [
+        'id,name,created',
+        '1,plain,2014-01-02 03:04:05\n2,"comma, ""quote""\nnewline\ttab",\n3,bytes,2014-01-02\n',
+    ]
+    assert meter.rows == 3
+    assert meter.bytes == len(data)
+
+def test_tsv():
+    data, _ = _export('tsv', header=False)
+    assert data == b'1\tplain\t2014-01-02 03:04:05\n2\tcomma, "quote"\\nnewline\\ttab\t\\N\n3\tbytes\t2014-01-02\n'
+
+def test_jsonl():
+    data, _ = _export('jsonl')
+    lines = data.decode('utf-8').splitlines()
+    assert [ json.loads(line) for line in lines ] == [
+        { 'id': 1, 'name': 'plain', 'created': '2014-01-02T03:04:05' },
+        { 'id': 2, 'name': 'comma, "quote"\nnewline\ttab', 'created': None },
+        { 'id': 3, 'name': 'bytes', 'created': '2014-01-02' },
+    ]
+    assert lines[0] == '{"id":1,"name":"plain","created":"2014-01-02T03:04:05"}'
+
+def test_time_values():
+    rows = [[(datetime.timedelta(hours=30),), (datetime.timedelta(minutes=-90, microseconds=-1),)]]
+    for format, expected in [
+        ('csv', b'30:00:00\n-01:30:00.000001\n'),
+        ('tsv', b'30:00:00\n-01:30:00.000001\n'),
+        ('jsonl', b'{"t":"30:00:00"}\n{"t":"-01:30:00.000001"}\n'),
+    ]:
+        out = io.BytesIO()
+        export_result(['t'], rows, out, format=format, header=False)
+        assert out.getvalue() == expected
+
+def test_gzip_and_progress():
+    progress = []
+    data, meter = _export('jsonl', compress=True, progress=progress.append)
+    assert gzip.GzipFile(fileobj=io.BytesIO(data)).read() == _export('jsonl')[0]
+    assert progress == [meter]
+
+def test_connection_export():
+    with mock.patch.object(database._mysql, 'connect') as connect:
+        db = connect.return_value
+        db.use_result.side_effect = lambda: _result(ROWS)
+        conn = database.Connection('localhost')
+
+        out = io.BytesIO()
+        conn.export_query('SELECT * FROM foo WHERE id > %s', out, format='csv', parameters=(0,), header=False)
+        db.query.assert_called_with('SELECT * FROM foo WHERE id > 0')
+        assert out.getvalue().count(b'\n') == 4
+        assert not db.store_result.called
+
+        # a failed write leaves unread rows behind, so the connection is closed
+        broken = mock.MagicMock()
+        broken.write.side_effect = IOError('disk full')
+        with mock.patch('memsql.common.export.WRITE_BUFFER_SIZE', 1):
+            with pytest.raises(IOError):
+                conn.export_query('SELECT * FROM foo', broken)
+        assert conn._db is None
+
+        with pytest.raises(ValueError):
+            conn.export_query('SELECT * FROM foo', out, format='xml')
@@ -0,0 +1,91 @@
+import time
+import mock
+import pytest
+
+from memsql.common import database
+from memsql.common.fan_out import fan_out, FanOutTimeout
+
+NODES = [('agg-1', 3306), ('agg-2', 3306), ('agg-3', 3306)]
+
+def _connect_factory(latency=None, fail=()):
+    latency = latency or {}
+    conns = {}
+
+    def connect(node):
+        conn = conns.setdefault(node, mock.MagicMock(name='%s:%s' % node))
+        conn.__enter__.return_value = conn
+        conn.thread_id.return_value = 7
+
+        def query(sql, *args):
+            if node in fail:
+                raise database.OperationalError(2013, 'Lost connection')
+            time.sleep(latency.get(node, 0))
+            return database.SelectResult(['Id', 'Host'], [(1, node[0])])
+        conn.query.side_effect = query
+        return conn
+    return connect, conns
+
+def _wait_for(condition, timeout=2):
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.01)
+    assert condition()
+
+def test_fan_out_tags_results_per_node():
+    connect, _ = _connect_factory(fail=[NODES[1]])
+    result = fan_out(connect, 'SHOW PROCESSLIST', NODES)
+
+    assert [ r.node for r in result ] == NODES
+    assert not result.ok()
+    assert list(result.errors().keys()) == [NODES[1]]
+    assert sorted(result.results().keys()) == [NODES[0], NODES[2]]
+
+    merged = result.merged()
+    assert merged.fieldnames == ('Node', 'Id', 'Host')
+    assert [ row.Node for row in merged ] == ['agg-1:3306', 'agg-3:3306']
+
+def test_fan_out_timeout_kills_slow_node():
+    connect, conns = _connect_factory(latency={ NODES[2]: 0.5 })
+    start = time.time()
+    result = fan_out(connect, 'SELECT 1', NODES, timeout=0.1, max_workers=2)
+
+    assert time.time() - start < 0.45
+    assert isinstance(result.errors()[NODES[2]], FanOutTimeout)
+    _wait_for(lambda: conns[NODES[2]].execute.called)
+    conns[NODES[2]].execute.assert_called_with('KILL QUERY 7')
+
+def test_fan_out_does_not_wait_for_kills():
+    connect, conns = _connect_factory(latency={ NODES[1]: 0.5, NODES[2]: 0.5 })
+    for node in NODES[1:]:
+        # the stalled nodes are slow to take the kill too
+        connect(node).execute.side_effect = lambda sql: time.sleep(1)
+
+    start = time.time()
+    result = fan_out(connect, 'SELECT 1', NODES, timeout=0.1)
+    assert time.time() - start < 0.4
+    assert sorted(result.errors().keys()) == NODES[1:]
+
+def test_merge_requires_matching_fields():
+    connect, _ = _connect_factory()
+    result = fan_out(connect, 'SELECT 1', NODES[:2])
+    result[1].result.fieldnames = ('Other',)
+    with pytest.raises(ValueError):
+        result.merged()
+
+def test_timed_out_node_is_held_until_its_kill_was_sent():
+    connect, conns = _connect_factory(latency={ NODES[0]: 0.15 })
+    conn = connect(NODES[0])
+
+    # the query finishes while the kill is on its way
+    closed_during_kill = []
+
+    def kill(sql):
+        time.sleep(0.15)
+        closed_during_kill.append(conn.close.called)
+    conn.execute.side_effect = kill
+
+    result = fan_out(connect, 'SELECT 1', NODES[:1], timeout=0.05)
+    assert isinstance(result.errors()[NODES[0]], FanOutTimeout)
+    _wait_for(lambda: conn.close.called)
+    assert closed_during_kill == [False]
+    assert conn.expire.called and conn.close.call_count == 1
@@ -0,0 +1,113 @@
+import threading
+import time
+import mock
+
+from memsql.common.hedging import HedgedReader
+
+def _conn(host, latency, result):
+    conn = mock.MagicMock(name=host)
+    conn.connection_info.return_value = (host, 3306)
+    conn.thread_id.return_value = 42
+
+    def query(*args, **kwargs):
+        time.sleep(latency)
+        return result
+    conn.query.side_effect = query
+    return conn
+
+def test_hedge_wins_over_slow_aggregator():
+    pool = mock.MagicMock()
+    slow, fast = _conn('agg-1', 0.5, 'slow'), _conn('agg-2', 0, 'fast')
+    pool.connect.return_value = slow
+    pool.connect_alternate.return_value = fast
+
+    reader = HedgedReader(pool, delay=0.05)
+    start = time.time()
+    assert reader.query('SELECT 1') == 'fast'
+    assert time.time() - start < 0.4
+
+    pool.connect_alternate.assert_called_once_with(exclude=[('agg-1', 3306)])
+    reader.close()
+    kill_conn = pool.connect_to.return_value.__enter__.return_value
+    kill_conn.execute.assert_called_once_with('KILL QUERY 42')
+    assert reader.stats() == { 'requests': 1, 'hedges': 1, 'hedge_wins': 1, 'kills': 1 }
+    assert slow.close.called and fast.close.called
+
+def test_winner_does_not_wait_for_the_kill():
+    pool = mock.MagicMock()
+    slow, fast = _conn('agg-1', 0.5, 'slow'), _conn('agg-2', 0, 'fast')
+    pool.connect.return_value = slow
+    pool.connect_alternate.return_value = fast
+    # the stalled aggregator is slow to take the kill too
+    pool.connect_to.return_value.__enter__.return_value.execute.side_effect = lambda sql: time.sleep(1)
+
+    reader = HedgedReader(pool, delay=0.02)
+    start = time.time()
+    assert reader.query('SELECT 1') == 'fast'
+    assert time.time() - start < 0.4
+    reader.close()
+    assert reader.stats()['kills'] == 1
+
+def test_hedges_are_capped():
+    pool = mock.MagicMock()
+    pool.connect.side_effect = lambda: _conn('agg-1', 0.02, 'slow')
+    pool.connect_alternate.side_effect = lambda exclude: _conn('agg-2', 0.02, 'slow')
+
+    reader = HedgedReader(pool, delay=0, max_hedge_ratio=0.1)
+    for _ in range(20):
+        reader.query('SELECT 1')
+    reader.close()
+
+    assert reader.stats()['hedges'] <= 3
+
+def test_no_hedging_without_latency_samples():
+    pool = mock.MagicMock()
+    pool.connect.side_effect = lambda: _conn('agg-1', 0.01, 'ok')
+
+    reader = HedgedReader(pool, min_samples=5)
+    for _ in range(5):
+        assert reader.hedge_delay() is None
+        reader.query('SELECT 1')
+    reader.close()
+
+    assert not pool.connect_alternate.called
+    assert reader.hedge_delay() >= 0.01
+
+def test_loser_is_held_until_its_kill_was_sent():
+    pool = mock.MagicMock()
+    slow, fast = _conn('agg-1', 0.1, 'slow'), _conn('agg-2', 0, 'fast')
+    pool.connect.return_value = slow
+    pool.connect_alternate.return_value = fast
+
+    # the slow query finishes while the kill is on its way
+    checked_in_during_kill = []
+
+    def kill(sql):
+        time.sleep(0.2)
+        checked_in_during_kill.append(slow.close.called)
+    pool.connect_to.return_value.__enter__.return_value.execute.side_effect = kill
+
+    reader = HedgedReader(pool, delay=0.02)
+    assert reader.query('SELECT 1') == 'fast'
+    reader.close()
+
+    assert checked_in_during_kill == [False]
+    assert slow.expire.called and slow.close.call_count == 1
+
+def test_queued_loser_is_cancelled():
+    pool = mock.MagicMock()
+    queued = _conn('agg-2', 0, 'fast')
+    reader = HedgedReader(pool, max_workers=1)
+
+    # the only worker is busy, so the attempt is still queued when cancelled
+    busy = threading.Event()
+    reader._executor.submit(busy.wait)
+    attempt = reader._submit(queued, 'query', 'SELECT 1', (), {})
+    reader._cancel(attempt)
+    busy.set()
+    reader.close()
+
+    assert attempt.future.cancelled()
+    assert not queued.query.called
+    assert queued.close.called
+    assert not pool.connect_to.called
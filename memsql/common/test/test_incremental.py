@@ -0,0 +1,90 @@
+import sqlite3
+import threading
+import mock
+import pytest
+
+from memsql.common import database
+from memsql.common.incremental import IncrementalReader, WatermarkFile
+from memsql.common.test.sqlite_connection import SqliteConnection
+
+@pytest.fixture
+def db():
+    db = sqlite3.connect(':memory:', check_same_thread=False)
+    db.execute('CREATE TABLE foo (id INT PRIMARY KEY, version INT)')
+    return db
+
+def _insert(db, rows):
+    db.executemany('INSERT INTO foo VALUES (?, ?)', rows)
+
+def test_ties_across_pages_and_restarts(db, tmpdir):
+    # five rows share version 2, so pages end in the middle of them
+    _insert(db, [ (1, 1), (2, 2), (3, 2), (4, 2), (5, 2), (6, 2), (7, 3) ])
+    path = str(tmpdir.join('foo.json'))
+    reader = IncrementalReader(lambda: SqliteConnection(db), 'foo', 'version', 'id',
+                               store=WatermarkFile(path), batch_size=2)
+
+    seen = []
+    pages = reader.poll()
+    for page in pages:
+        seen.extend(r.id for r in page)
+        if len(seen) == 4:
+            break
+    pages.close()
+    assert seen == [1, 2, 3, 4]
+
+    # a fresh reader picks up after the last page which was fully handed out
+    reader = IncrementalReader(lambda: SqliteConnection(db), 'foo', 'version', 'id',
+                               store=WatermarkFile(path), batch_size=2)
+    assert [ r.id for page in reader.poll() for r in page ] == [3, 4, 5, 6, 7]
+
+    _insert(db, [ (8, 3), (0, 4) ])
+    db.execute('UPDATE foo SET version = 5 WHERE id = 1')
+    assert [ r.id for page in reader.poll() for r in page ] == [8, 0, 1]
+    assert [ r.id for page in reader.poll() for r in page ] == []
+
+def test_follow_backs_off_when_idle(db):
+    _insert(db, [(1, 1)])
+    reader = IncrementalReader(lambda: SqliteConnection(db), 'foo', 'version', 'id',
+                               min_interval=1, max_interval=8)
+    stopping = threading.Event()
+    waits = []
+
+    def wait(interval):
+        waits.append(interval)
+        if len(waits) == 3:
+            _insert(db, [(2, 2)])
+        if len(waits) == 6:
+            stopping.set()
+    stopping.wait = wait
+
+    pages = [ [ r.id for r in page ] for page in reader.follow(stopping) ]
+    assert pages == [[1], [2]]
+    assert waits == [1, 1, 2, 1, 1, 2]
+
+def test_follow_saves_the_last_page_when_stopped(db, tmpdir):
+    _insert(db, [ (1, 1), (2, 1), (3, 2) ])
+    path = str(tmpdir.join('foo.json'))
+    reader = IncrementalReader(lambda: SqliteConnection(db), 'foo', 'version', 'id',
+                               store=WatermarkFile(path), batch_size=2)
+    stopping = threading.Event()
+
+    pages = []
+    for page in reader.follow(stopping):
+        pages.append([ r.id for r in page ])
+        stopping.set()
+    assert pages == [[1, 2]]
+
+    reader = IncrementalReader(lambda: SqliteConnection(db), 'foo', 'version', 'id',
+                               store=WatermarkFile(path), batch_size=2)
+    assert [ r.id for page in reader.poll() for r in page ] == [3]
+
+def test_follow_survives_connection_errors(db):
+    connect = mock.MagicMock(side_effect=[database.OperationalError(2003, 'down'), SqliteConnection(db)])
+    _insert(db, [(1, 1)])
+    reader = IncrementalReader(connect, 'foo', 'version', 'id', min_interval=0)
+    stopping = threading.Event()
+
+    for page in reader.follow(stopping):
+        assert [ r.id for r in page ] == [1]
+        stopping.set()
+    assert connect.call_count == 2
@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+import datetime
+import decimal
+import mock
+import pytest
+
+from memsql.common import loader
+
+def test_escape_field():
+    assert loader.escape_field(None) == b'\\N'
+    assert loader.escape_field(True) == b'1'
+    assert loader.escape_field(12) == b'12'
+    assert loader.escape_field(1.5) == b'1.5'
+    assert loader.escape_field(float('nan')) == b'\\N'
+    assert loader.escape_field(decimal.Decimal('1.10')) == b'1.10'
+    assert loader.escape_field(datetime.datetime(2020, 1, 2, 3, 4, 5)) == b'2020-01-02 03:04:05'
+    assert loader.escape_field(datetime.date(2020, 1, 2)) == b'2020-01-02'
+    assert loader.escape_field(datetime.timedelta(hours=30)) == b'30:00:00'
+    assert loader.escape_field(datetime.timedelta(hours=-1, microseconds=-5)) == b'-01:00:00.000005'
+    assert loader.escape_field(datetime.timedelta(seconds=59)) == b'00:00:59'
+    with pytest.raises(ValueError):
+        loader.escape_field(float('-inf'))
+    assert loader.escape_field('a\tb\nc\\d\r\x00') == b'a\\tb\\nc\\\\d\\r\\0'
+    assert loader.escape_field('ಠ_ಠ') == 'ಠ_ಠ'.encode('utf-8')
+    assert loader.escape_field(b'\x00\xff') == b'\\0\xff'
+
+def test_format_row():
+    assert loader.format_row([1, None, 'x y']) == b'1\t\\N\tx y\n'
+
+def _reading_conn(received):
+    """ A connection whose LOAD DATA reads the pipe like the client library would. """
+    conn = mock.MagicMock()
+
+    def query(sql, path):
+        received.append(sql)
+        with open(path, 'rb') as f:
+            data = f.read()
+        received.append(data)
+        return data.count(b'\n')
+    conn.query.side_effect = query
+    return conn
+
+def test_load_data_streams_rows():
+    received = []
+    progress = mock.MagicMock()
+    rows = ({ 'id': i, 'name': 'row\t%d' % i } for i in range(5000))
+
+    stats = loader.load_data(_reading_conn(received), 'foo', rows, progress=progress)
+
+    sql, data = received
+    assert sql == 'LOAD DATA LOCAL INFILE %s INTO TABLE `foo` (`id`, `name`)'
+    assert data.splitlines()[:2] == [b'0\trow\\t0', b'1\trow\\t1']
+    assert stats.rows == 5000 == stats.affected_rows
+    assert stats.bytes == len(data)
+    assert progress.called
+
+def test_load_data_replace():
+    received = []
+    loader.load_data(_reading_conn(received), 'foo', [(1, 2)], columns=['a', 'b'], replace=True)
+    assert received[0] == 'LOAD DATA LOCAL INFILE %s REPLACE INTO TABLE `foo` (`a`, `b`)'
+
+def test_load_data_error_before_reading():
+    conn = mock.MagicMock()
+    conn.query.side_effect = ValueError('no such table')
+
+    with pytest.raises(ValueError):
+        loader.load_data(conn, 'foo', [(1,)])
+
+def test_parallel_loader_inserts_every_row():
+    statements = []
+    conn = mock.MagicMock()
+    conn.execute.side_effect = statements.append
+
+    parallel = loader.ParallelLoader(lambda: conn, 'foo', workers=3, batch_size=10)
+    meter = parallel.load({ 'id': i } for i in range(95))
+
+    assert meter.rows == 95
+    assert len(statements) == 10
+    assert all(s.startswith('INSERT INTO `foo` (`id`) VALUES ') for s in statements)
+    assert sorted(int(v) for s in statements for v in s.split('VALUES ')[1].strip('()').split('),(')) == list(range(95))
+    assert parallel.failed == []
+
+def test_parallel_loader_retries_and_isolates_failures():
+    from memsql.common import database
+    attempts = []
+
+    def connect():
+        conn = mock.MagicMock()
+
+        def execute(statement):
+            attempts.append(statement)
+            if '(13)' in statement:
+                raise database.DatabaseError(1062, 'Duplicate entry')
+            if attempts.count(statement) == 1:
+                raise database.OperationalError(2013, 'Lost connection')
+        conn.execute.side_effect = execute
+        return conn
+
+    parallel = loader.ParallelLoader(connect, 'foo', columns=['id'], workers=2, batch_size=1, retry_delay=0)
+    meter = parallel.load((i,) for i in range(20))
+
+    assert meter.rows == 19
+    assert len(parallel.failed) == 1
+    assert parallel.failed[0].rows == [(13,)]
+    # every other batch failed once with a connection error and was retried,
+    # the duplicate key error is not retried
+    assert len(attempts) == 19 * 2 + 1
+
+def test_parallel_loader_resumes_large_batches():
+    from memsql.common import database
+    sent = []
+
+    def connect():
+        conn = mock.MagicMock()
+
+        def execute(statement):
+            # the second statement of the batch fails once
+            if len(sent) == 1:
+                sent.append(None)
+                raise database.OperationalError(2013, 'Lost connection')
+            sent.append(statement)
+        conn.execute.side_effect = execute
+        return conn
+
+    # 400KB rows, so the batch of four takes two 1MB statements
+    rows = [ (i, 'x' * 400 * 1024) for i in range(4) ]
+    parallel = loader.ParallelLoader(connect, 'foo', columns=['id', 'v'], workers=1, batch_size=4, retry_delay=0)
+    meter = parallel.load(rows)
+
+    statements = [ s for s in sent if s is not None ]
+    assert len(sent) == 3 and len(statements) == 2
+    assert [ s.count("'x") for s in statements ] == [2, 2]
+    assert meter.rows == 4
+    assert parallel.failed == []
+
+    # a batch which keeps failing only reports the rows which didn't make it
+    del sent[:]
+    parallel = loader.ParallelLoader(connect, 'foo', columns=['id', 'v'], workers=1, batch_size=4,
+                                     max_retries=0, retry_delay=0)
+    parallel.load(rows)
+    assert [ r[0] for r in parallel.failed[0].rows ] == [2, 3]
+
+def test_parallel_loader_stop_drains_queue():
+    conn = mock.MagicMock()
+    parallel = loader.ParallelLoader(lambda: conn, 'foo', columns=['id'], workers=1, batch_size=1)
+
+    def rows():
+        for i in range(1000):
+            if i == 10:
+                parallel.stop()
+            yield (i,)
+
+    meter = parallel.load(rows())
+    assert 10 <= meter.rows < 1000
+    assert meter.rows == conn.execute.call_count
+
+def test_parallel_loader_adaptive_batches():
+    from memsql.common.batching import AdaptiveBatcher
+    conn = mock.MagicMock()
+    batcher = AdaptiveBatcher(target_latency=1, initial_size=5, min_size=1)
+
+    parallel = loader.ParallelLoader(lambda: conn, 'foo', columns=['id'], workers=1, batcher=batcher)
+    meter = parallel.load((i,) for i in range(100))
+
+    assert meter.rows == 100
+    assert batcher.metrics()['rows'] == 100
+    assert batcher.size > 5
@@ -0,0 +1,53 @@
+import sqlite3
+import threading
+import zlib
+import pytest
+
+from memsql.common.parallel_scan import ParallelScan
+from memsql.common.test.sqlite_connection import SqliteConnection
+
+@pytest.fixture
+def connect():
+    db = sqlite3.connect(':memory:', check_same_thread=False)
+    db.create_function('CRC32', 1, lambda v: zlib.crc32(str(v).encode('utf-8')))
+    db.execute('CREATE TABLE foo (id INT PRIMARY KEY, v INT)')
+    db.executemany('INSERT INTO foo VALUES (?, ?)', [ (i, i * 2) for i in range(10, 110) ])
+    lock, threads = threading.Lock(), set()
+
+    def connect():
+        return SqliteConnection(db, lock, threads=threads)
+    connect.threads = threads
+    return connect
+
+def test_range_split(connect):
+    scan = ParallelScan(connect, 'foo', ['id'], partitions=4, batch_size=7)
+    assert scan.predicates() == [
+        '`id` >= 10 AND `id` < 35', '`id` >= 35 AND `id` < 60', '`id` >= 60 AND `id` < 85', '`id` >= 85 AND `id` < 110',
+    ]
+    assert sorted(r.id for r in scan) == list(range(10, 110))
+    assert len([ t for t in connect.threads if t.startswith('memsql-parallel-scan-') ]) == 4
+
+def test_hash_split_ordered(connect):
+    scan = ParallelScan(connect, 'foo', ['id'], partitions=3, split='hash', hash_column='v',
+                        where='id < %s', parameters=(50,), batch_size=5, ordered=True)
+    assert [ r.id for r in scan ] == list(range(10, 50))
+
+def test_small_or_empty_ranges(connect):
+    assert len(ParallelScan(connect, 'foo', ['id'], partitions=8, where='id < 13').predicates()) == 3
+    assert list(ParallelScan(connect, 'foo', ['id'], where='id > 1000')) == []
+
+def test_errors_and_early_exit(connect):
+    def failing():
+        conn = connect()
+        conn.query = lambda sql: 1 / 0
+        return conn
+
+    scan = ParallelScan(failing, 'foo', ['id'], partitions=2, split='hash')
+    with pytest.raises(ZeroDivisionError):
+        list(scan)
+
+    # stopping early doesn't leave scans blocked on a full buffer
+    rows = iter(ParallelScan(connect, 'foo', ['id'], partitions=4, batch_size=2, buffer_size=1))
+    next(rows)
+    rows.close()
+    assert not [ t for t in threading.enumerate() if t.name.startswith('memsql-parallel-scan-') ]
@@ -1,3 +1,6 @@
+# -*- coding: utf-8 -*-
+import pytest
+
 from memsql.common import query_builder, database
 
 def test_simple_expression():
@@ -21,9 +24,113 @@ def test_multi_insert():
     assert params == { '_QB_ROW_0': [1, '2', 1223.4], '_QB_ROW_1': [2, '5', 1] }
     assert database.escape_query(sql, params) == r"INSERT INTO `foo` (`a`, `b`, `c`) VALUES (1,'2',1223.4e0), (2,'5',1)"
 
+def test_multi_insert_rejects_mismatched_rows():
+    with pytest.raises(ValueError):
+        query_builder.multi_insert('foo', { 'a': 1 }, { 'a': 2, 'b': 3 })
+    with pytest.raises(ValueError):
+        query_builder.multi_insert('foo', { 'a': 1, 'b': 2 }, { 'a': 2, 'c': 3 })
+    with pytest.raises(ValueError):
+        list(query_builder.bulk_insert('foo', [{ 'a': 1 }, { 'a': 2, 'b': 3 }]))
+    with pytest.raises(ValueError):
+        list(query_builder.bulk_insert('foo', [{ 'a': 1, 'b': 2 }], columns=['a']))
+
 def test_replace():
     rows = [{ 'a': 1, 'b': '2', 'c': 1223.4 }, { 'a': 2, 'b': '5', 'c': 1 }]
     sql, params = query_builder.multi_replace('foo', *rows)
     assert sql == 'REPLACE INTO `foo` (`a`, `b`, `c`) VALUES (%(_QB_ROW_0)s), (%(_QB_ROW_1)s)'
     assert params == { '_QB_ROW_0': [1, '2', 1223.4], '_QB_ROW_1': [2, '5', 1] }
     assert database.escape_query(sql, params) == r"REPLACE INTO `foo` (`a`, `b`, `c`) VALUES (1,'2',1223.4e0), (2,'5',1)"
+
+def test_bulk_insert():
+    rows = [{ 'a': 1, 'b': '2', 'c': 1223.4 }, { 'a': 2, 'b': '5', 'c': None }]
+    statements = list(query_builder.bulk_insert('foo', rows))
+    assert statements == [r"INSERT INTO `foo` (`a`, `b`, `c`) VALUES (1,'2',1223.4e0),(2,'5',NULL)"]
+
+    sql, params = query_builder.multi_insert('foo', *rows)
+    assert statements == [database.escape_query(sql, params).replace('), (', '),(')]
+
+def test_bulk_insert_tuples():
+    statements = list(query_builder.bulk_insert('foo', [(1, 'x'), (2, 'y')], columns=['a', 'b'], replace=True))
+    assert statements == [r"REPLACE INTO `foo` (`a`, `b`) VALUES (1,'x'),(2,'y')"]
+
+    with pytest.raises(ValueError):
+        list(query_builder.bulk_insert('foo', [(1, 'x')]))
+
+def test_bulk_insert_max_bytes():
+    rows = ({ 'a': i, 'b': 'ಠ_ಠ' * 10 } for i in range(1000))
+    statements = list(query_builder.bulk_insert('foo', rows, max_bytes=4096))
+
+    assert len(statements) > 1
+    assert all(len(s.encode('utf-8')) <= 4096 for s in statements)
+    assert sum(s.count('ಠ_ಠ') for s in statements) == 10000
+
+def test_bulk_insert_empty():
+    assert list(query_builder.bulk_insert('foo', [])) == []
+
+def test_multi_upsert():
+    rows = [{ 'id': 1, 'name': 'a', 'hits': 2 }, { 'id': 2, 'name': 'b', 'hits': 3 }]
+    statements = list(query_builder.multi_upsert('foo', rows, update_columns=['name'], increment_columns=['hits']))
+    assert statements == [
+        "INSERT INTO `foo` (`hits`, `id`, `name`) VALUES (2,1,'a'),(3,2,'b') "
+        "ON DUPLICATE KEY UPDATE `name`=VALUES(`name`), `hits`=`hits`+VALUES(`hits`)"]
+
+def test_multi_upsert_defaults_to_all_columns():
+    statements = list(query_builder.multi_upsert('foo', [(1, 'a')], columns=['id', 'name']))
+    assert statements == [
+        "INSERT INTO `foo` (`id`, `name`) VALUES (1,'a') "
+        "ON DUPLICATE KEY UPDATE `id`=VALUES(`id`), `name`=VALUES(`name`)"]
+
+def test_multi_upsert_batches():
+    rows = ({ 'id': i, 'hits': 1 } for i in range(1000))
+    statements = list(query_builder.multi_upsert('foo', rows, increment_columns=['hits'], max_bytes=1024))
+    assert len(statements) > 1
+    assert all(len(s) <= 1024 and s.endswith('`hits`=`hits`+VALUES(`hits`)') for s in statements)
+
+def test_multi_upsert_unknown_column():
+    with pytest.raises(ValueError):
+        list(query_builder.multi_upsert('foo', [{ 'id': 1 }], update_columns=['nope']))
+
+def test_multi_upsert_needs_distinct_updates():
+    with pytest.raises(ValueError):
+        list(query_builder.multi_upsert('foo', [{ 'id': 1 }], update_columns=[]))
+    with pytest.raises(ValueError):
+        list(query_builder.multi_upsert('foo', [{ 'id': 1, 'hits': 1 }], update_columns=['hits'], increment_columns=['hits']))
+
+def test_columnar_insert():
+    columns = { 'a': [1, 2], 'b': ['x', None], 'c': [1.5, float('nan')] }
+    statements = list(query_builder.columnar_insert('foo', columns))
+    assert statements == ["INSERT INTO `foo` (`a`, `b`, `c`) VALUES (1,'x',1.5e0),(2,NULL,NULL)"]
+
+    rows = [{ 'a': 1, 'b': 'x', 'c': 1.5 }]
+    assert list(query_builder.columnar_insert('foo', { 'a': [1], 'b': ['x'], 'c': [1.5] })) == \
+        list(query_builder.bulk_insert('foo', rows))
+
+def test_columnar_insert_numpy():
+    numpy = pytest.importorskip('numpy')
+    columns = {
+        'id': numpy.arange(1000, dtype=numpy.int64),
+        'flag': numpy.arange(1000) % 2 == 0,
+        'score': numpy.linspace(0, 1, 1000),
+    }
+    statements = list(query_builder.columnar_insert('foo', columns, column_order=['id', 'flag', 'score'], max_bytes=4096))
+
+    assert len(statements) > 1
+    assert statements[0].startswith('INSERT INTO `foo` (`id`, `flag`, `score`) VALUES (0,1,0.0e0),(1,0,0.001001001001001001e0)')
+    assert sum(s.count('),(') + 1 for s in statements) == 1000
+
+def test_columnar_insert_infinity_and_datetimes():
+    with pytest.raises(ValueError):
+        list(query_builder.columnar_insert('foo', { 'a': [1.5, float('inf')] }))
+
+    numpy = pytest.importorskip('numpy')
+    with pytest.raises(ValueError):
+        list(query_builder.columnar_insert('foo', { 'a': numpy.array([1.5, -numpy.inf]) }))
+
+    # what a pandas datetime Series' to_numpy() returns
+    created = numpy.array(['2020-01-02T03:04:05.123456789', 'NaT'], dtype='datetime64[ns]')
+    statements = list(query_builder.columnar_insert('foo', { 'created': created }))
+    assert statements == ["INSERT INTO `foo` (`created`) VALUES ('2020-01-02 03:04:05.123456'),(NULL)"]
+
+def test_columnar_insert_length_mismatch():
+    with pytest.raises(ValueError):
+        list(query_builder.columnar_insert('foo', { 'a': [1, 2], 'b': [1] }))
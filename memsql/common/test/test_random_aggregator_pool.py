@@ -0,0 +1,314 @@
+import asyncio
+import errno
+import threading
+import time
+import mock
+import pytest
+
+from memsql.common import database, health
+from memsql.common.health import HealthTracker
+from memsql.common.connection_pool import PoolConnectionException
+from memsql.common.random_aggregator_pool import RandomAggregatorPool
+from memsql.common.topology import Topology, TopologyCache, TopologyRefresher
+from memsql.common.test.thread_monitor import ThreadMonitor
+
+AGGREGATORS = [('agg-1', 3306), ('agg-2', 3306), ('agg-3', 3306)]
+
+def _connection_error(host, port):
+    return PoolConnectionException(errno.ECONNREFUSED, 'refused', (host, port, 'root', '', 'information_schema', None, 0))
+
+@pytest.fixture
+def agg_pool():
+    pool = RandomAggregatorPool('agg-1', 3306)
+    pool._pool = mock.MagicMock()
+    pool._topology = Topology(tuple(AGGREGATORS), AGGREGATORS[0], time.time())
+    pool._refresher = mock.MagicMock()
+    return pool
+
+def test_failover_skips_dead_aggregator(agg_pool):
+    def connect(host, port, *args):
+        if host == 'agg-1':
+            raise _connection_error(host, port)
+        return mock.MagicMock(host=host)
+    agg_pool._pool.connect.side_effect = connect
+    agg_pool._aggregator = ('agg-1', 3306)
+
+    conn = agg_pool.connect()
+    assert conn.host != 'agg-1'
+    assert agg_pool._aggregator == (conn.host, 3306)
+
+def test_all_aggregators_down(agg_pool):
+    def connect(host, port, *args):
+        raise _connection_error(host, port)
+    agg_pool._pool.connect.side_effect = connect
+
+    with pytest.raises(PoolConnectionException):
+        agg_pool.connect()
+    assert agg_pool._aggregator is None
+    assert agg_pool._refresher.run_now.called
+
+def test_concurrent_dials_are_coalesced(agg_pool):
+    dials = []
+
+    def connect(host, port, *args):
+        dials.append(host)
+        time.sleep(0.1)
+        raise _connection_error(host, port)
+    agg_pool._pool.connect.side_effect = connect
+
+    mon = ThreadMonitor()
+
+    def checkout():
+        with pytest.raises(PoolConnectionException):
+            agg_pool._dial(('agg-1', 3306))
+
+    threads = [ threading.Thread(target=mon.wrap(checkout)) for _ in range(8) ]
+    [ t.start() for t in threads ]
+    [ t.join() for t in threads ]
+    mon.check()
+
+    assert dials == ['agg-1']
+    assert agg_pool._dialing == {}
+
+def test_discover_swaps_topology(agg_pool):
+    conn = agg_pool._pool.connect.return_value
+    conn.__enter__.return_value = conn
+    conn.query.return_value = database.SelectResult(
+        ['Host', 'Port', 'State', 'Message', 'Master_Aggregator'],
+        [['127.0.0.1', 3306, 'online', '', 1], ['agg-4', 3306, 'online', '', 0]])
+    conn.connection_info.return_value = ('agg-1', 3306)
+
+    before = agg_pool.topology()
+    agg_pool._discover()
+    topology = agg_pool.topology()
+
+    assert topology is not before
+    assert topology.aggregators == (('agg-1', 3306), ('agg-4', 3306))
+    assert topology.master == ('agg-1', 3306)
+    assert agg_pool._topology_ready.is_set()
+
+def test_connect_does_not_discover(agg_pool):
+    agg_pool._topology = Topology((), None, 0)
+    agg_pool.connect()
+    # with an empty topology we fall back to the primary aggregator
+    agg_pool._pool.connect.assert_called_once_with('agg-1', 3306, 'root', '', 'information_schema')
+    assert not agg_pool._pool.connect.return_value.query.called
+
+def test_refresher_backs_off_on_errors():
+    calls = []
+
+    def discover():
+        calls.append(time.time())
+        raise IOError('nope')
+
+    refresher = TopologyRefresher(discover, min_backoff=0.05, max_backoff=0.2, jitter=0)
+    refresher.start()
+    time.sleep(0.5)
+    refresher.stop()
+
+    gaps = [ b - a for a, b in zip(calls, calls[1:]) ]
+    assert len(calls) >= 3
+    assert gaps[1] > gaps[0]
+    assert all(gap < 0.3 for gap in gaps)
+
+def test_failing_aggregator_is_ejected_and_probed_back(agg_pool):
+    dead = set([('agg-2', 3306)])
+
+    def connect(host, port, *args):
+        if (host, port) in dead:
+            raise _connection_error(host, port)
+        return mock.MagicMock(host=host)
+    agg_pool._pool.connect.side_effect = connect
+    agg_pool._health = HealthTracker(failure_threshold=2, reset_timeout=0.05)
+
+    for _ in range(2):
+        with pytest.raises(PoolConnectionException):
+            agg_pool._checkout(('agg-2', 3306))
+    assert agg_pool.health().state(('agg-2', 3306)) == health.OPEN
+
+    # ejected aggregators are skipped without dialing them
+    agg_pool._pool.connect.reset_mock()
+    for _ in range(10):
+        agg_pool._aggregator = None
+        assert agg_pool.connect().host != 'agg-2'
+    assert ('agg-2', 3306) not in [ c[0][:2] for c in agg_pool._pool.connect.call_args_list ]
+
+    time.sleep(0.06)
+    dead.clear()
+    agg_pool._probe()
+    assert agg_pool.health().state(('agg-2', 3306)) == health.CLOSED
+
+def test_half_open_allows_a_single_trial():
+    breaker = health.CircuitBreaker(failure_threshold=1, reset_timeout=0.01)
+    breaker.record_failure()
+    assert not breaker.available()
+
+    time.sleep(0.02)
+    assert breaker.available()
+    assert breaker.state == health.HALF_OPEN
+    assert not breaker.available()
+
+    breaker.record_failure()
+    assert breaker.state == health.OPEN
+    assert breaker.reset_timeout == 0.02
+
+def test_latency_outlier_is_ejected():
+    tracker = HealthTracker(outlier_factor=5)
+    for agg in AGGREGATORS[:2]:
+        tracker.record_success(agg, 0.001)
+    tracker.record_success(AGGREGATORS[2], 0.5)
+
+    assert tracker.state(AGGREGATORS[2]) == health.OPEN
+    assert tracker.ejected() == [AGGREGATORS[2]]
+
+def test_only_new_dials_are_latency_samples(agg_pool):
+    def connect(host, port, *args):
+        if host == 'agg-2':
+            time.sleep(0.08)
+            return mock.MagicMock(host=host, reused=False)
+        return mock.MagicMock(host=host, reused=True)
+    agg_pool._pool.connect.side_effect = connect
+
+    for _ in range(5):
+        agg_pool.connect_to(AGGREGATORS[0])
+    agg_pool.connect_to(AGGREGATORS[1])
+
+    assert agg_pool.health().breaker(AGGREGATORS[0]).latency is None
+    assert agg_pool.health().state(AGGREGATORS[1]) == health.CLOSED
+
+def test_connect_leaves_other_half_open_trials_alone(agg_pool):
+    agg_pool._health = HealthTracker(failure_threshold=1, reset_timeout=0.01)
+    for agg in AGGREGATORS[1:]:
+        agg_pool._health.record_failure(agg)
+    time.sleep(0.02)
+    agg_pool._pool.connect.side_effect = lambda host, port, *args: mock.MagicMock(host=host, reused=False)
+
+    assert agg_pool.connect().host == 'agg-1'
+    for agg in AGGREGATORS[1:]:
+        assert agg_pool.health().available(agg)
+
+def test_parallel_dial_uses_first_success(agg_pool):
+    agg_pool._parallel_dial = True
+    agg_pool._dial_stagger = 0.05
+    conns = {}
+
+    def connect(host, port, *args):
+        if host == 'agg-1':
+            time.sleep(0.5)
+        elif host == 'agg-2':
+            raise _connection_error(host, port)
+        conns[host] = mock.MagicMock(host=host)
+        return conns[host]
+    agg_pool._pool.connect.side_effect = connect
+
+    start = time.time()
+    aggregator, conn = agg_pool._dial_parallel(list(AGGREGATORS))
+    assert time.time() - start < 0.4
+    assert aggregator == ('agg-3', 3306)
+
+    # the slow connection is returned to the pool once it arrives
+    time.sleep(0.6)
+    assert conns['agg-1'].close.called
+    assert not conn.close.called
+
+def test_parallel_dial_raises_unexpected_errors(agg_pool):
+    agg_pool._pool.connect.side_effect = TypeError('bad pool')
+
+    start = time.time()
+    with pytest.raises(TypeError):
+        agg_pool._dial_parallel(list(AGGREGATORS))
+    assert time.time() - start < 1
+
+def test_failover_to_standby(agg_pool):
+    agg_pool._standby_connections = 2
+    agg_pool._aggregator = ('agg-1', 3306)
+    agg_pool._pool.connect.side_effect = lambda host, port, *args: mock.MagicMock(host=host)
+
+    agg_pool._maintain_standby()
+    assert len(agg_pool._standby) == 1
+    standby_agg, standby = list(agg_pool._standby.items())[0]
+    assert standby_agg != ('agg-1', 3306)
+    assert len(standby) == 2
+
+    def connect(host, port, *args):
+        raise _connection_error(host, port)
+    agg_pool._pool.connect.side_effect = connect
+
+    conn = agg_pool.connect()
+    assert conn.host == standby_agg[0]
+    assert agg_pool._aggregator == standby_agg
+    assert agg_pool._standby == {}
+
+def test_dead_standby_is_replaced(agg_pool):
+    agg_pool._standby_connections = 1
+    agg_pool._aggregator = ('agg-1', 3306)
+    agg_pool._pool.connect.side_effect = lambda host, port, *args: mock.MagicMock(host=host)
+
+    agg_pool._maintain_standby()
+    standby_agg, (standby,) = list(agg_pool._standby.items())[0]
+    standby.ping.side_effect = _connection_error(*standby_agg)
+
+    agg_pool._maintain_standby()
+    (replacement,) = agg_pool._standby[standby_agg]
+    assert replacement is not standby
+    assert standby.close.called
+
+def test_topology_cache_roundtrip(tmpdir):
+    path = str(tmpdir.join('topology.json'))
+    cache = TopologyCache(path, ttl=60)
+    topology = Topology(tuple(AGGREGATORS), AGGREGATORS[0], time.time())
+
+    assert cache.load(AGGREGATORS[0]) is None
+    cache.save(AGGREGATORS[0], topology)
+    assert cache.load(AGGREGATORS[0]) == topology
+    # snapshots are per cluster
+    assert cache.load(('other', 3306)) is None
+    # and leave no temporary files behind
+    assert tmpdir.listdir() == [tmpdir.join('topology.json')]
+
+    cache.ttl = 0
+    assert cache.load(AGGREGATORS[0]) is None
+
+def test_pool_starts_from_cached_topology(tmpdir):
+    path = str(tmpdir.join('topology.json'))
+    topology = Topology(tuple(AGGREGATORS), AGGREGATORS[0], time.time() - 10)
+    TopologyCache(path).save(AGGREGATORS[0], topology)
+
+    pool = RandomAggregatorPool('agg-1', 3306, topology_cache=path, refresh_interval=30)
+    assert pool.topology() == topology
+    assert pool._topology_ready.is_set()
+    assert 19 < pool._initial_refresh_delay <= 20
+
+def test_connect_master_does_not_block_the_refresher_loop():
+    pool = RandomAggregatorPool('agg-1', 3306, discovery_timeout=5)
+    pool._pool = mock.MagicMock()
+    loop = asyncio.new_event_loop()
+
+    # the primary aggregator is a child, the master is agg-2
+    def discover():
+        pool._topology = Topology(tuple(AGGREGATORS), AGGREGATORS[1], time.time())
+    pool._discover = mock.MagicMock(side_effect=discover)
+
+    async def connect_master():
+        pool.start_refresher(loop)
+        start = time.time()
+        conn = pool.connect_master()
+        return conn, time.time() - start
+
+    try:
+        conn, elapsed = loop.run_until_complete(connect_master())
+
+        # an unreachable cluster gives no master rather than a guess
+        pool._topology = Topology((), None, 0)
+        pool._discover.side_effect = _connection_error('agg-1', 3306)
+        assert loop.run_until_complete(connect_master())[0] is None
+    finally:
+        pool.close()
+        # let the stopped tasks finish
+        loop.run_until_complete(asyncio.sleep(0.05))
+        loop.close()
+
+    assert elapsed < 1
+    assert conn is pool._pool.connect.return_value
+    assert pool._pool.connect.call_count == 1
+    assert pool._pool.connect.call_args[0][:2] == ('agg-2', 3306)
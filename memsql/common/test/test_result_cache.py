@@ -0,0 +1,167 @@
+import time
+import mock
+import pytest
+
+from memsql.common import database
+from memsql.common.result_cache import ResultCache, tables_read, tables_written
+
+def test_table_extraction():
+    assert tables_read('SELECT * FROM foo') == set(['foo'])
+    assert tables_read('SELECT * FROM `db`.`Foo` f, baz JOIN bar AS b ON f.id = b.id WHERE 1') == set(['foo', 'bar', 'baz'])
+    assert tables_read('SELECT 1') == set()
+    assert tables_written('INSERT INTO foo VALUES (1)') == set(['foo'])
+    assert tables_written('/* x */ UPDATE db.foo SET a = 1') == set(['foo'])
+    assert tables_written('DELETE f FROM foo f JOIN bar b ON f.id = b.id') == set(['foo', 'bar'])
+    assert tables_written('DROP TABLE IF EXISTS foo') == set(['foo'])
+    assert tables_written('OPTIMIZE') is None
+    # table lists aren't parsed, so they invalidate everything
+    assert tables_written('UPDATE a, b SET a.x = b.x') is None
+    assert tables_written('DELETE FROM a USING a, b WHERE a.id = b.id') is None
+    assert tables_written('DROP TABLE a, b') is None
+    assert tables_written('UPDATE a SET x = 1, y = 2') == set(['a'])
+
+def _put(cache, sql, rows, ttl=None):
+    key, tables = cache.key('conn', sql)
+    cache.put(key, tables, cache.generation(tables), ['a'], rows, ttl)
+    return key
+
+def test_ttl_lru_and_stats():
+    cache = ResultCache(max_bytes=1000, ttl=60)
+    assert cache.key('conn', 'SELECT 1') == (None, None)
+    assert cache.key('conn', 'SHOW TABLES') == (None, None)
+    assert cache.key('conn', 'INSERT INTO foo VALUES (1)') == (None, None)
+
+    short = _put(cache, 'SELECT a FROM short', [(1,)], ttl=0.05)
+    assert cache.get(short) == (('a',), ((1,),))
+    time.sleep(0.06)
+    assert cache.get(short) is None
+
+    first = _put(cache, 'SELECT a FROM foo', [('x' * 300,)])
+    second = _put(cache, 'SELECT a FROM bar', [('y' * 300,)])
+    cache.get(first)
+    third = _put(cache, 'SELECT a FROM baz', [('z' * 300,)])
+    # bar was the least recently used
+    assert cache.get(second) is None
+    assert cache.get(first) is not None
+    assert cache.get(third) is not None
+
+    stats = cache.stats()
+    assert stats['hits'] == 4
+    assert stats['misses'] == 2
+    assert stats['expirations'] == 1
+    assert stats['evictions'] == 1
+    assert stats['entries'] == 2
+    assert 600 < stats['bytes'] <= 1000
+
+def test_invalidation_and_racing_writes():
+    cache = ResultCache()
+    foo = _put(cache, 'SELECT a FROM foo', [(1,)])
+    bar = _put(cache, 'SELECT a FROM bar', [(2,)])
+
+    cache.invalidate_statement('SELECT * FROM foo')
+    cache.invalidate_statement('INSERT INTO foo VALUES (2)')
+    assert cache.get(foo) is None
+    assert cache.get(bar) is not None
+
+    # a write landing while the read ran means its result may be stale
+    key, tables = cache.key('conn', 'SELECT a FROM bar')
+    generation = cache.generation(tables)
+    cache.invalidate_statement('TRUNCATE bar')
+    cache.put(key, tables, generation, ['a'], [(3,)])
+    assert cache.get(key) is None
+
+    _put(cache, 'SELECT a FROM foo', [(1,)])
+    cache.invalidate_statement('OPTIMIZE')
+    assert len(cache) == 0
+    assert cache.stats()['invalidations'] == 3
+
+@pytest.fixture
+def db():
+    with mock.patch.object(database._mysql, 'connect') as connect:
+        db = connect.return_value
+        result = db.store_result.return_value
+        result.describe.return_value = [('a',)]
+        result.fetch_row.return_value = ((1,), (2,))
+        yield db
+
+def test_connection_uses_cache(db):
+    cache = ResultCache()
+    conn = database.Connection('localhost', result_cache=cache)
+
+    first = conn.query('SELECT a FROM foo WHERE b = %s', 'x')
+    second = conn.query('SELECT a FROM foo WHERE b = %s', 'x')
+    assert db.query.call_count == 1
+    assert [ r.a for r in second ] == [1, 2]
+
+    # every hit gets its own result list
+    second.pop()
+    assert len(conn.query('SELECT a FROM foo WHERE b = %s', 'x')) == 2
+    assert len(first) == 2
+
+    db.store_result.return_value = None
+    conn.execute('UPDATE foo SET a = 3')
+    db.store_result.return_value = mock.MagicMock(**{ 'describe.return_value': [('a',)], 'fetch_row.return_value': ((3,),) })
+    assert [ r.a for r in conn.query('SELECT a FROM foo WHERE b = %s', 'x') ] == [3]
+
+    conn.cached_query(5, 'SELECT a FROM bar')
+    conn.query('SELECT 1')
+    conn.query('SELECT 1')
+    assert db.query.call_count == 6
+    assert cache.stats()['entries'] == 2
+
+def test_connection_without_cache(db):
+    conn = database.Connection('localhost')
+    conn.query('SELECT a FROM foo')
+    conn.query('SELECT a FROM foo')
+    assert db.query.call_count == 2
+    with pytest.raises(ValueError):
+        conn.cached_query(5, 'SELECT a FROM foo')
+
+def test_connection_cache_is_per_user_and_session(db):
+    cache = ResultCache()
+    alice = database.Connection('localhost', user='alice', result_cache=cache)
+    bob = database.Connection('localhost', user='bob', result_cache=cache)
+
+    alice.query('SELECT a FROM foo')
+    bob.query('SELECT a FROM foo')
+    alice.query('SELECT a FROM foo')
+    assert db.query.call_count == 2
+
+    # after USE the connection's database isn't what the key says
+    db.store_result.return_value = None
+    alice.execute('USE other')
+    db.store_result.return_value = mock.MagicMock(**{ 'describe.return_value': [('a',)], 'fetch_row.return_value': ((1,),) })
+    alice.query('SELECT a FROM foo')
+    alice.query('SELECT a FROM foo')
+    assert db.query.call_count == 5
+
+    alice.reconnect()
+    alice.query('SELECT a FROM foo')
+    assert db.query.call_count == 5
+
+def test_connection_cache_skips_transactions(db):
+    cache = ResultCache()
+    alice = database.Connection('localhost', result_cache=cache)
+    bob = database.Connection('localhost', result_cache=cache)
+
+    db.store_result.return_value = None
+    alice.execute('BEGIN')
+    alice.execute('INSERT INTO foo VALUES (3)')
+    db.store_result.return_value = mock.MagicMock(**{ 'describe.return_value': [('a',)], 'fetch_row.return_value': ((3,),) })
+    alice.query('SELECT a FROM foo')
+    # bob reads the committed rows while alice's transaction is open
+    db.store_result.return_value = mock.MagicMock(**{ 'describe.return_value': [('a',)], 'fetch_row.return_value': ((1,),) })
+    bob.query('SELECT a FROM foo')
+    db.store_result.return_value = None
+    alice.execute('ROLLBACK')
+    assert len(cache) == 0
+
+    db.store_result.return_value = mock.MagicMock(**{ 'describe.return_value': [('a',)], 'fetch_row.return_value': ((1,),) })
+    assert [ r.a for r in bob.query('SELECT a FROM foo') ] == [1]
+    assert db.query.call_count == 6
+
+    # with autocommit off every statement is in a transaction
+    db.get_autocommit.return_value = False
+    alice.query('SELECT a FROM foo')
+    assert db.query.call_count == 7
+    assert cache.stats()['hits'] == 0
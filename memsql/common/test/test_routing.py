@@ -0,0 +1,83 @@
+import mock
+import pytest
+
+from memsql.common import routing
+from memsql.common.exceptions import NotConnected
+
+@pytest.mark.parametrize(('query', 'kind'), [
+    ('SELECT 1', routing.READ),
+    ('  select * from foo', routing.READ),
+    ('(SELECT 1) UNION (SELECT 2)', routing.READ),
+    ('/* comment */ SHOW TABLES', routing.READ),
+    ('-- comment\nEXPLAIN SELECT 1', routing.READ),
+    ('SELECT * FROM into_table', routing.READ),
+    ('SELECT * FROM foo FOR UPDATE', routing.WRITE),
+    ('INSERT INTO foo VALUES (1)', routing.WRITE),
+    ('CREATE TABLE foo (id INT)', routing.WRITE),
+    ('BEGIN', routing.BEGIN),
+    ('START TRANSACTION', routing.BEGIN),
+    ('START PIPELINE p', routing.WRITE),
+    ('COMMIT', routing.END),
+    ('ROLLBACK', routing.END),
+    ('SET @a = 1', routing.SESSION),
+    ('USE foo', routing.SESSION),
+])
+def test_classify_statement(query, kind):
+    assert routing.classify_statement(query) == kind
+
+@pytest.fixture
+def agg_pool():
+    pool = mock.MagicMock()
+    pool.connect.return_value = mock.MagicMock(name='child')
+    pool.connect_master.return_value = mock.MagicMock(name='master')
+    return pool
+
+def test_reads_and_writes_are_routed(agg_pool):
+    with routing.RoutingPool(agg_pool).connect() as conn:
+        conn.query('SELECT 1')
+        conn.execute('INSERT INTO foo VALUES (1)')
+
+    agg_pool.connect.return_value.query.assert_called_once_with('SELECT 1')
+    agg_pool.connect_master.return_value.execute.assert_called_once_with('INSERT INTO foo VALUES (1)')
+    assert agg_pool.connect.return_value.close.called
+    assert agg_pool.connect_master.return_value.close.called
+
+def test_transactions_stick_to_master(agg_pool):
+    conn = routing.RoutingPool(agg_pool).connect()
+    master = agg_pool.connect_master.return_value
+
+    with conn.transaction():
+        conn.query('SELECT 1')
+        assert conn.pinned()
+
+    assert [ c[0][0] for c in master.execute.call_args_list ] == ['BEGIN', 'COMMIT']
+    master.query.assert_called_once_with('SELECT 1')
+    assert not agg_pool.connect.called
+
+    conn.query('SELECT 2')
+    agg_pool.connect.return_value.query.assert_called_once_with('SELECT 2')
+
+def test_session_statements_pin(agg_pool):
+    conn = routing.RoutingPool(agg_pool).connect()
+    conn.execute('SET @a = 1')
+    conn.query('SELECT @a')
+    agg_pool.connect_master.return_value.query.assert_called_once_with('SELECT @a')
+    assert not agg_pool.connect.called
+
+def test_session_functions_follow_the_previous_statement(agg_pool):
+    conn = routing.RoutedConnection(agg_pool)
+    conn.execute('START PIPELINE p')
+    assert not conn.pinned()
+
+    conn.execute('INSERT INTO foo VALUES (1)')
+    conn.get('SELECT LAST_INSERT_ID() AS id')
+    conn.query('SELECT * FROM foo')
+    conn.get('SELECT FOUND_ROWS()')
+    agg_pool.connect_master.return_value.get.assert_called_once_with('SELECT LAST_INSERT_ID() AS id')
+    agg_pool.connect.return_value.get.assert_called_once_with('SELECT FOUND_ROWS()')
+
+def test_master_unavailable(agg_pool):
+    agg_pool.connect_master.return_value = None
+    conn = routing.RoutingPool(agg_pool).connect()
+    with pytest.raises(NotConnected):
+        conn.execute('DELETE FROM foo')
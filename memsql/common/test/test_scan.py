@@ -0,0 +1,78 @@
+import sqlite3
+import threading
+import mock
+import pytest
+
+from memsql.common import database
+from memsql.common.scan import TableScan
+from memsql.common.test.sqlite_connection import SqliteConnection
+
+@pytest.fixture
+def table():
+    db = sqlite3.connect(':memory:', check_same_thread=False)
+    db.execute('CREATE TABLE foo (a INT, b TEXT, v INT, PRIMARY KEY (a, b))')
+    db.executemany('INSERT INTO foo VALUES (?, ?, ?)', [ (i // 3, 'k%d' % (i % 3), i) for i in range(25) ])
+    return db
+
+def test_scan_rows_in_key_order(table):
+    queries = []
+    conn = SqliteConnection(table, queries=queries)
+    rows = list(TableScan(conn, 'foo', ['a', 'b'], batch_size=4))
+
+    assert [ r.v for r in rows ] == list(range(25))
+    assert len(queries) == 7
+    assert queries[0] == 'SELECT * FROM `foo` ORDER BY `a`, `b` LIMIT 4'
+    assert queries[1] == ("SELECT * FROM `foo` WHERE ((`a` > 1) OR (`a` = 1 AND `b` > 'k0')) "
+                          "ORDER BY `a`, `b` LIMIT 4")
+
+def test_scan_where_columns_and_batches(table):
+    queries = []
+    conn = SqliteConnection(table, queries=queries)
+    scan = TableScan(conn, 'foo', 'v', batch_size=5, where='v >= %s', parameters=(10,), columns=['v'], batches=True)
+    pages = list(scan)
+
+    assert [ [ r.v for r in page ] for page in pages ] == [list(range(10, 15)), list(range(15, 20)), list(range(20, 25))]
+    assert queries[1] == 'SELECT `v` FROM `foo` WHERE (v >= 10) AND ((`v` > 14)) ORDER BY `v` LIMIT 5'
+
+    with pytest.raises(ValueError):
+        TableScan(conn, 'foo', ['a'], columns=['v'])
+
+def test_resume_from_checkpoint(table):
+    conn = SqliteConnection(table)
+    scan = TableScan(conn, 'foo', ['a', 'b'], batch_size=4)
+    assert scan.checkpoint() is None
+
+    seen = []
+    for row in scan:
+        seen.append(row.v)
+        if row.v == 9:
+            break
+    token = scan.checkpoint()
+
+    resumed = TableScan(conn, 'foo', ['a', 'b'], batch_size=4, checkpoint=token)
+    assert seen + [ r.v for r in resumed ] == list(range(25))
+
+    with pytest.raises(ValueError):
+        TableScan(conn, 'bar', ['a', 'b'], checkpoint=token)
+    with pytest.raises(ValueError):
+        TableScan(conn, 'foo', ['a', 'b'], checkpoint='not a token')
+
+def test_prefetch_on_another_connection(table):
+    conn = SqliteConnection(table)
+    other = SqliteConnection(table)
+
+    rows = list(TableScan(conn, 'foo', ['a', 'b'], batch_size=10, prefetch=lambda: other))
+
+    assert [ r.v for r in rows ] == list(range(25))
+    # the first page is read in place, the rest ahead of time elsewhere
+    assert len(conn.queries) == 1
+    assert len(other.queries) == 2
+    assert threading.current_thread().name not in other.threads
+    assert other.closed
+
+def test_connection_scan_table():
+    with mock.patch.object(database._mysql, 'connect'):
+        conn = database.Connection('localhost')
+    with mock.patch.object(conn, 'query', return_value=database.SelectResult(['id'], [(1,), (2,)])) as query:
+        assert [ r.id for r in conn.scan_table('foo', ['id'], batch_size=10) ] == [1, 2]
+    query.assert_called_once_with('SELECT * FROM `foo` ORDER BY `id` LIMIT 10')
@@ -0,0 +1,96 @@
+import asyncio
+import threading
+import time
+import mock
+import pytest
+
+from memsql.common import database
+from memsql.common.single_flight import SingleFlight, SingleFlightReader, AsyncSingleFlightReader
+
+def _slow_connect(executed, delay=0.2):
+    def connect():
+        conn = mock.MagicMock()
+
+        def query(sql):
+            executed.append(sql)
+            time.sleep(delay)
+            if sql.startswith('SELECT'):
+                return database.SelectResult(['a'], [(1,), (2,)])
+            return 1
+        conn.query.side_effect = query
+        return conn
+    return connect
+
+def _concurrently(fn, count):
+    results = [None] * count
+
+    def run(i):
+        results[i] = fn()
+    threads = [ threading.Thread(target=run, args=(i,)) for i in range(count) ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results
+
+def test_single_flight_shares_results_and_errors():
+    flight = SingleFlight()
+    calls = []
+
+    def fail():
+        calls.append(1)
+        time.sleep(0.1)
+        raise ValueError('boom')
+
+    def attempt():
+        try:
+            flight.do('k', fail)
+        except ValueError as e:
+            return e
+    errors = _concurrently(attempt, 5)
+
+    assert len(calls) == 1
+    assert all(isinstance(e, ValueError) for e in errors)
+    assert flight.stats() == { 'calls': 1, 'shared': 4 }
+
+    # finished calls are forgotten
+    assert flight.do('k', lambda: 5) == 5
+
+def test_reader_coalesces_identical_reads():
+    executed = []
+    reader = SingleFlightReader(_slow_connect(executed))
+
+    results = _concurrently(lambda: reader.query('SELECT a FROM foo WHERE id = %s', 1), 10)
+    assert executed == ['SELECT a FROM foo WHERE id = 1']
+    assert all([ r.a for r in result ] == [1, 2] for result in results)
+
+    # every caller has its own list over the shared rows
+    results[0].pop()
+    assert len(results[1]) == 2
+    assert reader.stats() == { 'calls': 1, 'shared': 9 }
+
+def test_reader_does_not_coalesce_writes():
+    executed = []
+    reader = SingleFlightReader(_slow_connect(executed, delay=0.05))
+    _concurrently(lambda: reader.query('UPDATE foo SET a = 1'), 3)
+    assert len(executed) == 3
+
+    with pytest.raises(database.MySQLError):
+        reader.get('SELECT a FROM foo')
+
+def test_async_reader_coalesces_identical_reads():
+    executed = []
+    reader = AsyncSingleFlightReader(_slow_connect(executed))
+
+    async def main():
+        return await asyncio.gather(*[ reader.query('SELECT a FROM foo') for _ in range(10) ])
+
+    loop = asyncio.new_event_loop()
+    try:
+        results = loop.run_until_complete(main())
+    finally:
+        loop.close()
+
+    assert executed == ['SELECT a FROM foo']
+    assert all(len(r) == 2 for r in results)
+    assert reader.stats() == { 'calls': 1, 'shared': 9 }
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+import datetime
+import decimal
+import mock
+import multiprocessing
+import os
+import pytest
+
+from memsql.common import snapshot
+from memsql.common.database import SelectResult
+
+ROWS = [
+    (1, 'ಠ_ಠ', 1.5, b'\x00\xff', decimal.Decimal('1.10'), datetime.datetime(2020, 1, 2, 3, 4, 5, 6),
+     datetime.date(2020, 1, 2), datetime.timedelta(hours=-1), 2 ** 64 - 1),
+    (None, '', None, None, None, None, None, None, None),
+]
+FIELDS = ['id', 'name', 'score', 'blob', 'amount', 'at', 'day', 'offset', 'big']
+
+def test_roundtrip(tmpdir):
+    path = str(tmpdir.join('t.snap'))
+    assert snapshot.write_snapshot(path, SelectResult(FIELDS, ROWS)) == 1
+
+    snap = snapshot.Snapshot(path)
+    assert snap.version == 1
+    assert len(snap) == 2
+    assert snap.fieldnames == tuple(FIELDS)
+    assert snap.field_index['score'] == 2
+    assert [ tuple(row.values()) for row in snap ] == ROWS
+    assert snap[0].name == 'ಠ_ಠ'
+    assert snap[-1]['id'] is None
+    assert snap.value(0, 'big') == 2 ** 64 - 1
+    assert len(snap[0:1]) == 1
+    with pytest.raises(IndexError):
+        snap[2]
+
+    row = snap[0]
+    assert row == dict(zip(FIELDS, ROWS[0]))
+    with pytest.raises(TypeError):
+        row['id'] = 5
+    # adding a field copies the row's values
+    row['extra'] = 1
+    assert row.extra == 1 and row.id == 1
+
+def test_empty_result(tmpdir):
+    path = str(tmpdir.join('t.snap'))
+    snapshot.write_snapshot(path, SelectResult(['a'], []))
+    assert list(snapshot.Snapshot(path)) == []
+
+def test_atomic_versioned_refresh(tmpdir):
+    path = str(tmpdir.join('t.snap'))
+    snapshot.write_snapshot(path, SelectResult(['a'], [(1,)]))
+
+    reader = snapshot.SnapshotReader(path, check_interval=0)
+    old = reader.current()
+    old_row = old[0]
+    assert reader.current() is old
+
+    conn = mock.MagicMock()
+    conn.query.return_value = SelectResult(['a'], [(2,), (3,)])
+    assert snapshot.materialize(conn, path, 'SELECT a FROM foo') == 2
+    conn.query.assert_called_once_with('SELECT a FROM foo')
+    # no temporary files are left behind
+    assert os.listdir(str(tmpdir)) == ['t.snap']
+
+    new = reader.current()
+    assert new is not old
+    assert new.version == 2
+    assert [ r.a for r in new ] == [2, 3]
+    # the replaced snapshot is still readable
+    assert old_row.a == 1
+
+def test_unsupported_type(tmpdir):
+    path = str(tmpdir.join('t.snap'))
+    with pytest.raises(TypeError):
+        snapshot.write_snapshot(path, SelectResult(['a'], [(object(),)]))
+    assert os.listdir(str(tmpdir)) == []
+
+def _count_rows(path, results):
+    results.put(sum(r.a for r in snapshot.Snapshot(path)))
+
+def test_other_processes_can_read(tmpdir):
+    path = str(tmpdir.join('t.snap'))
+    snapshot.write_snapshot(path, SelectResult(['a'], [ (i,) for i in range(100) ]))
+
+    results = multiprocessing.Queue()
+    proc = multiprocessing.Process(target=_count_rows, args=(path, results))
+    proc.start()
+    proc.join()
+    assert results.get(timeout=5) == sum(range(100))
@@ -0,0 +1,71 @@
+import mock
+import pytest
+
+from memsql.common import database
+from memsql.common.database import SelectResult
+from memsql.common.exceptions import ResultTooLarge
+from memsql.common.spill import ResultBudget, SpilledResult
+
+ROW_SIZE = 56 + 8 * 2 + 16 + 10
+
+def _result(rows):
+    """ A use_result() result handing out `rows` a few at a time. """
+    result = mock.MagicMock()
+    result.describe.return_value = [('id',), ('name',)]
+    batches = [ tuple(rows[i:i + 7]) for i in range(0, len(rows), 7) ] + [()]
+    result.fetch_row.side_effect = lambda maxrows: batches.pop(0)
+    return result
+
+ROWS = [ (i, 'name-%04d' % i) for i in range(100) ]
+
+def test_small_results_stay_in_memory():
+    result = ResultBudget(memory_bytes=ROW_SIZE * 100).fetch(_result(ROWS), ['id', 'name'])
+    assert isinstance(result, SelectResult)
+    assert [ r.id for r in result ] == list(range(100))
+
+def test_large_results_spill(tmpdir):
+    budget = ResultBudget(memory_bytes=ROW_SIZE * 10, directory=str(tmpdir))
+    with budget.fetch(_result(ROWS), ['id', 'name']) as result:
+        assert isinstance(result, SpilledResult)
+        assert len(result) == 100
+        assert result.rows_in_memory == 10
+        assert result.rows_on_disk == 90
+        assert result.memory_bytes <= ROW_SIZE * 10
+        assert result.disk_bytes > 0
+
+        assert result[3].name == 'name-0003'
+        assert result[42].name == 'name-0042'
+        assert result[-1].id == 99
+        assert [ r.id for r in result[8:12] ] == [8, 9, 10, 11]
+        assert [ tuple(r.values()) for r in result ] == ROWS
+        with pytest.raises(IndexError):
+            result[100]
+        with pytest.raises(TypeError):
+            result[50]['id'] = 5
+
+def test_hard_caps():
+    with pytest.raises(ResultTooLarge):
+        ResultBudget(memory_bytes=ROW_SIZE * 10, spill=False).fetch(_result(ROWS), ['id', 'name'])
+    with pytest.raises(ResultTooLarge):
+        ResultBudget(memory_bytes=ROW_SIZE * 10, disk_bytes=100).fetch(_result(ROWS), ['id', 'name'])
+
+def test_connection_budget():
+    with mock.patch.object(database._mysql, 'connect') as connect:
+        db = connect.return_value
+        db.use_result.side_effect = lambda: _result(ROWS)
+        conn = database.Connection('localhost')
+
+        result = conn.budgeted_query(ResultBudget(memory_bytes=ROW_SIZE * 10), 'SELECT * FROM foo')
+        assert len(result) == 100
+        assert not db.store_result.called
+        result.close()
+
+        with pytest.raises(ResultTooLarge):
+            conn.budgeted_query(ResultBudget(memory_bytes=ROW_SIZE * 10, spill=False), 'SELECT * FROM foo')
+        # the half read result can't be used, so the connection was closed
+        db.close.assert_called_once_with()
+        assert conn._db is None
+
+        conn.result_budget = ResultBudget()
+        assert len(conn.query('SELECT * FROM foo')) == 100
+        assert connect.call_count == 2
@@ -0,0 +1,70 @@
+import sqlite3
+import threading
+import pytest
+
+from memsql.common.incremental import WatermarkFile
+from memsql.common.table_copy import CopyPipeline
+from memsql.common.test.sqlite_connection import SqliteConnection
+
+@pytest.fixture
+def clusters():
+    lock = threading.Lock()
+    source = sqlite3.connect(':memory:', check_same_thread=False)
+    source.execute('CREATE TABLE foo (id INT PRIMARY KEY, name TEXT)')
+    source.executemany('INSERT INTO foo VALUES (?, ?)', [ (i, 'n%d' % i) for i in range(50) ])
+    dest = sqlite3.connect(':memory:', check_same_thread=False)
+    dest.execute('CREATE TABLE foo (id INT PRIMARY KEY, name TEXT)')
+    dest.execute('CREATE TABLE bar (id INT PRIMARY KEY, upper_name TEXT)')
+    return source, dest, lock
+
+def _rows(db, table):
+    return db.execute('SELECT * FROM %s ORDER BY 1' % table).fetchall()
+
+def test_copy(clusters):
+    source, dest, lock = clusters
+    progress = []
+    pipeline = CopyPipeline(lambda: SqliteConnection(source, lock), lambda: SqliteConnection(dest, lock),
+                            'foo', ['id'], batch_size=7, workers=3, progress=progress.append)
+    stats = pipeline.run()
+
+    assert _rows(dest, 'foo') == _rows(source, 'foo')
+    assert stats['rows_read'] == stats['rows_written'] == 50
+    assert stats['pages_read'] == stats['pages_written'] == 8
+    assert progress[-1]['rows_written'] == 50
+    assert pipeline.failed == []
+
+def test_transform_and_drop(clusters):
+    source, dest, lock = clusters
+
+    def transform(row):
+        if row.id % 2:
+            return None
+        return { 'id': row.id, 'upper_name': row.name.upper() }
+
+    pipeline = CopyPipeline(lambda: SqliteConnection(source, lock), lambda: SqliteConnection(dest, lock),
+                            'foo', ['id'], dest_table='bar', where='id < %s', parameters=(10,), transform=transform)
+    stats = pipeline.run()
+
+    assert _rows(dest, 'bar') == [ (i, 'N%d' % i) for i in range(0, 10, 2) ]
+    assert stats['rows_dropped'] == 5
+
+def test_checkpoint_stops_at_failed_pages(clusters, tmpdir):
+    source, dest, lock = clusters
+    store = WatermarkFile(str(tmpdir.join('copy.json')))
+
+    # the page holding id 23 fails, so the checkpoint can't move past it
+    def failing():
+        return SqliteConnection(dest, lock, fail_on="(23,'n23')")
+
+    pipeline = CopyPipeline(lambda: SqliteConnection(source, lock), failing, 'foo', ['id'],
+                            batch_size=10, workers=2, store=store, replace=True)
+    stats = pipeline.run()
+    assert stats['failed_pages'] == 1
+    assert [ r[0] for r in pipeline.failed[0].rows ] == list(range(20, 30))
+
+    # resuming copies the failed page and everything after it again
+    pipeline = CopyPipeline(lambda: SqliteConnection(source, lock), lambda: SqliteConnection(dest, lock),
+                            'foo', ['id'], batch_size=10, store=store, replace=True)
+    stats = pipeline.run()
+    assert stats['rows_read'] == 30
+    assert _rows(dest, 'foo') == _rows(source, 'foo')
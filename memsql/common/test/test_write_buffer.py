@@ -0,0 +1,130 @@
+import threading
+import time
+import mock
+import pytest
+
+from memsql.common import database
+from memsql.common.write_buffer import WriteBuffer, BufferFull
+
+def _connect(statements, fail_on=None, delay=0):
+    def connect():
+        conn = mock.MagicMock()
+
+        def execute(statement):
+            time.sleep(delay)
+            if fail_on is not None and fail_on in statement:
+                raise database.DatabaseError(1062, 'Duplicate entry')
+            statements.append(statement)
+        conn.execute.side_effect = execute
+        return conn
+    return connect
+
+def test_coalesces_rows_per_table_and_columns():
+    statements = []
+    buf = WriteBuffer(_connect(statements), max_rows=100, max_age=60)
+
+    threads = [ threading.Thread(target=lambda i=i: buf.add('foo', { 'id': i })) for i in range(10) ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    buf.add('foo', { 'id': 10, 'name': 'x' })
+    buf.add('bar', { 'id': 11 })
+    assert statements == []
+
+    buf.flush()
+    assert len(statements) == 3
+    foo = [ s for s in statements if s.startswith('INSERT INTO `foo` (`id`) VALUES ') ][0]
+    assert sorted(int(v) for v in foo.split('VALUES ')[1].strip('()').split('),(')) == list(range(10))
+    assert "INSERT INTO `foo` (`id`, `name`) VALUES (10,'x')" in statements
+    assert 'INSERT INTO `bar` (`id`) VALUES (11)' in statements
+
+    stats = buf.stats()
+    assert stats['rows_added'] == stats['rows_written'] == 12
+    assert stats['rows_buffered'] == stats['bytes_buffered'] == 0
+    buf.close()
+
+def test_flushes_on_size_and_age():
+    statements = []
+    buf = WriteBuffer(_connect(statements), max_rows=3, max_age=0.2)
+
+    for i in range(3):
+        buf.add('foo', { 'id': i })
+    deadline = time.time() + 2
+    while not statements and time.time() < deadline:
+        time.sleep(0.01)
+    assert statements == ['INSERT INTO `foo` (`id`) VALUES (0),(1),(2)']
+
+    buf.add('foo', { 'id': 3 })
+    time.sleep(0.5)
+    assert statements[-1] == 'INSERT INTO `foo` (`id`) VALUES (3)'
+    buf.close()
+
+def test_statement_size_limit():
+    statements = []
+    buf = WriteBuffer(_connect(statements), max_statement_bytes=40)
+    for i in range(4):
+        buf.add('foo', { 'id': i })
+    buf.flush()
+    assert statements == ['INSERT INTO `foo` (`id`) VALUES (0),(1)', 'INSERT INTO `foo` (`id`) VALUES (2),(3)']
+    buf.close()
+
+def test_rejected_rows_go_to_callback():
+    statements, rejected = [], []
+    buf = WriteBuffer(_connect(statements, fail_on='`bar`'), on_error=lambda *args: rejected.append(args))
+
+    buf.add('foo', { 'id': 1 })
+    buf.add('bar', { 'id': 2 })
+    buf.close()
+
+    assert statements == ['INSERT INTO `foo` (`id`) VALUES (1)']
+    assert len(rejected) == 1
+    table_name, rows, exception = rejected[0]
+    assert table_name == 'bar'
+    assert rows == [{ 'id': 2 }]
+    assert isinstance(exception, database.DatabaseError)
+    assert buf.stats()['rows_rejected'] == 1
+
+def test_memory_cap_blocks_producers():
+    statements = []
+    # each row is "(n)," = 4 bytes, so two rows fill the buffer
+    buf = WriteBuffer(_connect(statements, delay=0.2), max_bytes=8, max_age=60)
+    buf.add('foo', { 'id': 1 })
+    buf.add('foo', { 'id': 2 })
+
+    start = time.time()
+    buf.add('foo', { 'id': 3 })
+    # the third row waited for the first two to be written
+    assert time.time() - start >= 0.15
+    assert statements == ['INSERT INTO `foo` (`id`) VALUES (1),(2)']
+
+    # while a write is in flight the buffer is still full
+    slow = WriteBuffer(_connect([], delay=0.5), max_bytes=4, max_age=0)
+    slow.add('foo', { 'id': 1 })
+    time.sleep(0.1)
+    with pytest.raises(BufferFull):
+        slow.add('foo', { 'id': 2 }, timeout=0.05)
+
+    buf.close()
+    slow.close()
+
+def test_close_rejects_blocked_producers():
+    statements = []
+    buf = WriteBuffer(_connect(statements, delay=0.2), max_bytes=4, max_age=0)
+    buf.add('foo', { 'id': 1 })
+    errors = []
+
+    def produce():
+        try:
+            buf.add('foo', { 'id': 2 })
+        except ValueError as e:
+            errors.append(e)
+    producer = threading.Thread(target=produce)
+    producer.start()
+    time.sleep(0.05)
+
+    buf.close()
+    producer.join()
+    assert len(errors) == 1
+    assert statements == ['INSERT INTO `foo` (`id`) VALUES (1)']
+    assert buf.stats()['rows_added'] == buf.stats()['rows_written'] == 1
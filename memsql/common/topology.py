@@ -0,0 +1,95 @@
+import collections
+import logging
+import time
+
+from memsql.common import json
+from memsql.common.util import PeriodicTask, AsyncPeriodicTask, atomic_write
+
+class Topology(collections.namedtuple('Topology', ['aggregators', 'master', 'updated'])):
+    """ An immutable snapshot of the aggregators in a cluster.
+
+    `aggregators` is a tuple of (host, port) pairs, `master` is the
+    (host, port) of the master aggregator (or None if unknown) and
+    `updated` is the unix timestamp the snapshot was taken at.
+    """
+    __slots__ = ()
+
+    def age(self):
+        return time.time() - self.updated
+
+EMPTY_TOPOLOGY = Topology((), None, 0)
+
+class TopologyRefresher(PeriodicTask):
+    """ Periodically calls `discover` to refresh the aggregator topology.
+
+    `discover` does the actual work (connecting to an aggregator and
+    swapping in a new snapshot); the refresher only decides when to run it.
+    """
+
+    def __init__(self, discover, **kwargs):
+        kwargs.setdefault('name', 'memsql-topology-refresher')
+        super(TopologyRefresher, self).__init__(discover, **kwargs)
+
+class AsyncTopologyRefresher(AsyncPeriodicTask):
+    """ A TopologyRefresher which runs as a task on an asyncio event loop. """
+
+    def __init__(self, discover, loop=None, **kwargs):
+        kwargs.setdefault('name', 'memsql-topology-refresher')
+        super(AsyncTopologyRefresher, self).__init__(discover, loop=loop, **kwargs)
+
+class TopologyCache(object):
+    """ Persists Topology snapshots to `path` so new processes can start
+    spreading connections without discovering the topology first.
+
+    The file is shared by every process pointing at it: writes go to a
+    temporary file in the same directory which is atomically renamed
+    over `path`, so readers never see a partial file.  Snapshots older
+    than `ttl` seconds, or taken for a different primary aggregator, are
+    ignored.
+    """
+
+    VERSION = 1
+
+    def __init__(self, path, ttl=300):
+        self.logger = logging.getLogger('memsql.topology')
+        self.path = path
+        self.ttl = ttl
+
+    def load(self, primary):
+        """ Returns the cached Topology for `primary` (host, port), or None. """
+        try:
+            with open(self.path, 'r') as f:
+                data = json.loads(f.read())
+            if data['version'] != self.VERSION or tuple(data['primary']) != tuple(primary):
+                return None
+            topology = Topology(
+                tuple(tuple(agg) for agg in data['aggregators']),
+                tuple(data['master']) if data['master'] else None,
+                data['updated'])
+        except (IOError, OSError, ValueError, KeyError, TypeError):
+            return None
+
+        if not topology.aggregators or topology.age() > self.ttl:
+            return None
+        return topology
+
+    def save(self, primary, topology):
+        current = self.load(primary)
+        unchanged = current is not None and (current.aggregators, current.master) == (topology.aggregators, topology.master)
+        if unchanged and current.age() < self.ttl / 2.0:
+            # another process wrote the same snapshot recently
+            return
+
+        data = json.dumps({
+            'version': self.VERSION,
+            'primary': primary,
+            'aggregators': topology.aggregators,
+            'master': topology.master,
+            'updated': topology.updated,
+        })
+
+        try:
+            with atomic_write(self.path) as f:
+                f.write(data)
+        except (IOError, OSError):
+            self.logger.exception('Could not write the topology cache to %s' % self.path)
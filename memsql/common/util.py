@@ -1,3 +1,218 @@
+import asyncio
+import contextlib
+import datetime
+import logging
+import os
+import random
+import tempfile
+import threading
+import time
+
 def timedelta_total_seconds(td):
     """ Needed for python 2.6 compat """
     return (td.microseconds + (td.seconds + td.days * 24 * 3600) * 10. ** 6) / 10. ** 6
+
+def format_timedelta(td):
+    """ Formats a timedelta the way MySQL writes TIME values,
+    [-]HH:MM:SS[.ffffff], with as many hour digits as needed.
+    """
+    sign = '-' if td < datetime.timedelta(0) else ''
+    td = abs(td)
+    hours = td.days * 24 + td.seconds // 3600
+    text = '%s%02d:%02d:%02d' % (sign, hours, td.seconds // 60 % 60, td.seconds % 60)
+    if td.microseconds:
+        text += '.%06d' % td.microseconds
+    return text
+
+def estimate_row_size(row):
+    """ A rough estimate of the memory a result row takes: the payload of
+    every value plus per object overhead.
+    """
+    size = 56 + 8 * len(row)
+    for value in row:
+        if isinstance(value, (bytes, str)):
+            size += len(value)
+        else:
+            size += 16
+    return size
+
+@contextlib.contextmanager
+def atomic_write(path, mode='w'):
+    """ Yields a temporary file in the directory of `path` which is synced
+    and renamed over `path` once the block exits, so readers never see a
+    partially written file.  If the block raises, `path` is left alone
+    and the temporary file is removed.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.' + os.path.basename(path) + '.')
+    try:
+        with os.fdopen(fd, mode) as f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+class ThroughputMeter(object):
+    """ Thread safe counters for rows and bytes processed since creation. """
+
+    def __init__(self):
+        self.rows = 0
+        self.bytes = 0
+        self.started = time.time()
+        self._lock = threading.Lock()
+
+    def add(self, rows, nbytes=0):
+        with self._lock:
+            self.rows += rows
+            self.bytes += nbytes
+
+    def elapsed(self):
+        return time.time() - self.started
+
+    def rows_per_second(self):
+        return self.rows / max(self.elapsed(), 1e-9)
+
+    def bytes_per_second(self):
+        return self.bytes / max(self.elapsed(), 1e-9)
+
+    def __repr__(self):
+        return '%s(rows=%d, bytes=%d, %.1f rows/s, %.1f bytes/s)' % (
+            self.__class__.__name__, self.rows, self.bytes, self.rows_per_second(), self.bytes_per_second())
+
+class _Schedule(object):
+    """ Jittered intervals with exponential backoff on errors. """
+
+    def __init__(self, interval, jitter, min_backoff, max_backoff):
+        self.interval = interval
+        self.jitter = jitter
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.failures = 0
+
+    def next_delay(self, success):
+        if success:
+            self.failures = 0
+            delay = self.interval
+        else:
+            self.failures += 1
+            delay = min(self.max_backoff, self.min_backoff * 2 ** (self.failures - 1))
+        return delay * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+class PeriodicTask(object):
+    """ Periodically calls `fn` on a background daemon thread.
+
+    Runs are spread out by `jitter` (a fraction of `interval`) so that
+    many processes started at once don't run in lock step, and runs
+    that raise back off exponentially up to `max_backoff`.  The first
+    run happens after `initial_delay` seconds.
+    """
+
+    def __init__(self, fn, interval=30, jitter=0.2, min_backoff=0.5, max_backoff=60, name='memsql-periodic-task',
+                 initial_delay=0):
+        self.logger = logging.getLogger('memsql.periodic_task')
+        self.name = name
+        self._fn = fn
+        self._initial_delay = initial_delay
+        self._schedule = _Schedule(interval, jitter, min_backoff, max_backoff)
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name=self.name)
+            self._thread.daemon = True
+            self._thread.start()
+
+    def stop(self):
+        self._stopping.set()
+        self._wake.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+        self._thread = None
+
+    def run_now(self):
+        """ Ask the task to run as soon as possible. """
+        self._wake.set()
+
+    def can_wait(self):
+        """ Returns whether the calling thread may block waiting for a run. """
+        return True
+
+    def _run(self):
+        delay = self._initial_delay
+        while not self._stopping.is_set():
+            self._wake.wait(delay)
+            self._wake.clear()
+            if self._stopping.is_set():
+                break
+            delay = self._schedule.next_delay(self._run_once())
+
+    def _run_once(self):
+        try:
+            self._fn()
+            return True
+        except Exception:
+            self.logger.exception('%s failed' % self.name)
+            return False
+
+class AsyncPeriodicTask(PeriodicTask):
+    """ A PeriodicTask which runs as a task on an asyncio event loop.
+
+    `fn` is blocking, so it is run on the loop's default executor.
+    `run_now` and `stop` may be called from any thread.
+    """
+
+    def __init__(self, fn, loop=None, **kwargs):
+        super(AsyncPeriodicTask, self).__init__(fn, **kwargs)
+        self._loop = loop
+        self._task = None
+        self._async_wake = None
+
+    def start(self):
+        if self._task is None:
+            if self._loop is None:
+                self._loop = asyncio.get_event_loop()
+            self._loop.call_soon_threadsafe(self._start_task)
+
+    def _start_task(self):
+        if self._task is None:
+            self._async_wake = asyncio.Event()
+            self._task = self._loop.create_task(self._run_async())
+
+    def stop(self):
+        self._stopping.set()
+        self.run_now()
+
+    def run_now(self):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._set_async_wake)
+
+    def can_wait(self):
+        # blocking the loop's own thread would keep the task from running
+        try:
+            return asyncio.get_running_loop() is not self._loop
+        except RuntimeError:
+            return True
+
+    def _set_async_wake(self):
+        if self._async_wake is not None:
+            self._async_wake.set()
+
+    async def _run_async(self):
+        delay = self._initial_delay
+        while not self._stopping.is_set():
+            try:
+                await asyncio.wait_for(self._async_wake.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+            self._async_wake.clear()
+            if self._stopping.is_set():
+                break
+            success = await self._loop.run_in_executor(None, self._run_once)
+            delay = self._schedule.next_delay(success)
+        self._task = None
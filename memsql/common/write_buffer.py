@@ -0,0 +1,229 @@
+import logging
+import threading
+import time
+
+from memsql.common import database, query_builder
+
+class BufferFull(Exception):
+    """ The write buffer stayed full for longer than the add timeout. """
+    pass
+
+class WriteBuffer(object):
+    """ Coalesces single-row writes from many threads into multi-row
+    INSERT (or REPLACE) statements.
+
+    Rows are dicts, buffered per table and column set and written by a
+    background thread once a buffer holds `max_rows` rows, once its
+    oldest row is `max_age` seconds old, or on `flush()`.  Statements
+    are kept under `max_statement_bytes`.  At most `max_bytes` of
+    escaped rows are held at once (including rows being written); when
+    the buffer is full `add()` blocks until a flush frees up room.
+
+    Writes are not retried.  Rows in a statement which fails are passed
+    to `on_error(table_name, rows, exception)`, or logged if there is
+    no `on_error`.
+
+        buf = WriteBuffer(pool_connect, max_rows=500, max_age=0.5)
+        buf.add('events', { 'id': 1, 'name': 'signup' })
+        ...
+        buf.close()
+    """
+
+    def __init__(self, connect, max_rows=1000, max_age=1.0, max_bytes=16 * 1024 * 1024,
+                 max_statement_bytes=query_builder.DEFAULT_MAX_BYTES, replace=False, on_error=None):
+        self.logger = logging.getLogger('memsql.write_buffer')
+        self._connect = connect
+        self._max_rows = max_rows
+        self._max_age = max_age
+        self._max_bytes = max_bytes
+        self._max_statement_bytes = max_statement_bytes
+        self._replace = replace
+        self._on_error = on_error
+
+        self._cond = threading.Condition()
+        # (table_name, columns) => _Pending
+        self._pending = {}
+        self._bytes = 0
+        self._in_flight = 0
+        self._flush_requested = False
+        self._closed = False
+        self._thread = None
+        self._stats = { 'rows_added': 0, 'rows_written': 0, 'rows_rejected': 0, 'statements': 0 }
+
+    def add(self, table_name, row, timeout=None):
+        """ Buffer `row` for `table_name`.  Blocks while the buffer is
+        full, raising BufferFull after `timeout` seconds if given.
+        """
+        cols = tuple(sorted(row.keys()))
+        escape = database._escape
+        value = '(%s)' % ','.join([ escape(row[c]) for c in cols ])
+        size = query_builder._byte_len(value) + 1
+
+        deadline = None if timeout is None else time.time() + timeout
+        with self._cond:
+            if self._closed:
+                raise ValueError('Cannot add rows to a closed WriteBuffer')
+            self._start()
+
+            # a row larger than the whole buffer is let through on its own
+            while self._bytes and self._bytes + size > self._max_bytes:
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    raise BufferFull('Write buffer has been full for %ss' % timeout)
+                self._flush_requested = True
+                self._cond.notify_all()
+                self._cond.wait(remaining)
+                # close() may have taken the last batches while we waited
+                if self._closed:
+                    raise ValueError('Cannot add rows to a closed WriteBuffer')
+
+            key = (table_name, cols)
+            pending = self._pending.get(key)
+            if pending is None:
+                pending = self._pending[key] = _Pending()
+            pending.rows.append(row)
+            pending.values.append(value)
+            pending.sizes.append(size)
+            self._bytes += size
+            self._stats['rows_added'] += 1
+
+            # wake the flusher for a full buffer, or so it starts timing a new one
+            if len(pending.rows) == 1 or len(pending.rows) >= self._max_rows:
+                self._cond.notify_all()
+
+    def flush(self):
+        """ Write every buffered row, returning once all rows added before
+        the call have been written (or rejected).
+        """
+        with self._cond:
+            batches = self._take(all_keys=True)
+        self._write_all(batches)
+        with self._cond:
+            while self._in_flight:
+                self._cond.wait()
+
+    def close(self):
+        """ Flush remaining rows and stop the background thread. """
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+        self.flush()
+
+    def stats(self):
+        """ Returns a dict of counters: rows_added, rows_written,
+        rows_rejected and statements, plus the rows and bytes buffered.
+        """
+        with self._cond:
+            stats = dict(self._stats)
+            stats['rows_buffered'] = sum(len(p.rows) for p in self._pending.values())
+            stats['bytes_buffered'] = self._bytes
+            return stats
+
+    def _start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='memsql-write-buffer')
+            self._thread.daemon = True
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._closed and not self._ready():
+                    self._cond.wait(self._until_next_deadline())
+                if self._closed:
+                    return
+                batches = self._take(all_keys=self._flush_requested)
+                self._flush_requested = False
+            self._write_all(batches)
+
+    def _ready(self):
+        if self._flush_requested:
+            return True
+        now = time.time()
+        for pending in self._pending.values():
+            if len(pending.rows) >= self._max_rows or now - pending.created >= self._max_age:
+                return True
+        return False
+
+    def _until_next_deadline(self):
+        if not self._pending:
+            return None
+        oldest = min(p.created for p in self._pending.values())
+        return max(0, oldest + self._max_age - time.time())
+
+    def _take(self, all_keys):
+        """ Removes the buffers which are due (or all of them) and marks
+        them in flight.  Must be called with the lock held.
+        """
+        now = time.time()
+        batches = []
+        for key, pending in list(self._pending.items()):
+            if all_keys or len(pending.rows) >= self._max_rows or now - pending.created >= self._max_age:
+                del self._pending[key]
+                batches.append((key, pending))
+        self._in_flight += len(batches)
+        return batches
+
+    def _write_all(self, batches):
+        for (table_name, cols), pending in batches:
+            try:
+                self._write(table_name, cols, pending)
+            finally:
+                with self._cond:
+                    self._in_flight -= 1
+                    self._bytes -= sum(pending.sizes)
+                    self._cond.notify_all()
+
+    def _write(self, table_name, cols, pending):
+        prefix = '%s INTO `%s` (%s) VALUES ' % (
+            'REPLACE' if self._replace else 'INSERT',
+            table_name,
+            ', '.join(['`%s`' % col for col in cols])
+        )
+
+        for start, end in self._chunks(prefix, pending.sizes):
+            statement = prefix + ','.join(pending.values[start:end])
+            try:
+                conn = self._connect()
+                try:
+                    conn.execute(statement)
+                finally:
+                    conn.close()
+            except Exception as e:
+                self._reject(table_name, pending.rows[start:end], e)
+            else:
+                with self._cond:
+                    self._stats['rows_written'] += end - start
+                    self._stats['statements'] += 1
+
+    def _chunks(self, prefix, sizes):
+        """ Yields (start, end) ranges of rows which fit in one statement. """
+        fixed = query_builder._byte_len(prefix)
+        start, size = 0, fixed
+        for i, value_size in enumerate(sizes):
+            if i > start and size + value_size > self._max_statement_bytes:
+                yield start, i
+                start, size = i, fixed
+            size += value_size
+        if start < len(sizes):
+            yield start, len(sizes)
+
+    def _reject(self, table_name, rows, exception):
+        with self._cond:
+            self._stats['rows_rejected'] += len(rows)
+        if self._on_error is None:
+            self.logger.error('Dropped %d rows for %s: %s' % (len(rows), table_name, exception))
+            return
+        try:
+            self._on_error(table_name, rows, exception)
+        except Exception:
+            self.logger.exception('WriteBuffer on_error callback raised')
+
+class _Pending(object):
+    def __init__(self):
+        self.created = time.time()
+        self.rows = []
+        self.values = []
+        self.sizes = []
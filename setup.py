@@ -13,7 +13,6 @@ long_description = (this_directory / "README.md").read_text()
 
 
 REQUIREMENTS = [
-    'wraptor',
     'simplejson',
     'python-dateutil<3.0',
     'mysqlclient>=1.4,<3.0',
@@ -105,6 +104,7 @@ setup(
     ],
     zip_safe=False,
     install_requires=REQUIREMENTS,
+    extras_require={ 'numpy': ['numpy'] },
     tests_require=['pytest', 'mock', 'ordereddict==1.1'],
     cmdclass={ 'test': PyTest },
 )